@@ -2,3 +2,7 @@ from EMDA.emda import EMDA
 
 from EMDA._version import __version__
 from EMDA.plotters import ext_plot_contacts_frequencies_differences
+from EMDA.sinks import MemorySink, ChunkedFileSink, CallbackSink
+from EMDA.ensemble import EMDAEnsemble
+from EMDA.group import EMDAGroup
+from EMDA.registry import register_measure_type
@@ -8,8 +8,13 @@ from .exceptions import NotSingleAtomSelectionError
 from .exceptions import NotThreeAtomsSelectionError
 from .exceptions import NotExistingInteractionError
 from .exceptions import NotExistingSelectionError
+from .exceptions import NotEqualSelectionsListsLenghtError
 
-from .selection import convert_selection
+from .selection import convert_selection, dynamic_selection
+from .results import ContactsResult
+from .calculators import center_block, make_whole, guess_hydrogen_donors
+
+from numpy import asarray, einsum, float64, frombuffer, int32, int64, isin
 
 # @dataclass
 # class Measure:
@@ -41,7 +46,7 @@ HOW TO BUILD AN ADDER:
 """
 
 
-def add_distance(self, name, sel1, sel2, type="min"):
+def add_distance(self, name, sel1, sel2, type="min", pbc=False):
     """
     DESCRIPTION:
         This function outputs the minimum measured distance between the two input selections or coordinates or their combination.
@@ -53,6 +58,8 @@ def add_distance(self, name, sel1, sel2, type="min"):
         - Name of the measurement
         - Two selections, which can contain more than one atom
         - type: min [default], com (center of mass) or cog (center of geometry)
+        - pbc: apply the minimum image convention with the box of each frame, so distances across the box edges are correct
+            without unwrapping the trajectory. Default is False.
 
     OUTPUT:
         - Shorter distance between sel1 and sel2 (in ang) or distances between COMs or COGs.
@@ -68,14 +75,14 @@ def add_distance(self, name, sel1, sel2, type="min"):
         name=name,
         type="distance",
         sel=[convert_selection(self, sel1), convert_selection(self, sel2)],
-        options={"type": type},
+        options={"type": type, "pbc": pbc},
         result=[],
     )
 
     return "Distance added!"
 
 
-def add_angle(self, name, sel1, sel2, sel3, units="deg", domain=360):
+def add_angle(self, name, sel1, sel2, sel3, units="deg", domain=360, pbc=False):
     """
     DESCRIPTION:
         This functions measures the angle between 3 specified atoms and returns the value between 0 and 360 degrees.
@@ -91,6 +98,9 @@ def add_angle(self, name, sel1, sel2, sel3, units="deg", domain=360):
             - 180, pi: option for -180,180 domain
             - 360, 2pi: option for 0,360 domain. Default option
 
+        - pbc: apply the minimum image convention with the box of each frame, so measures across the box edges are correct
+            without unwrapping the trajectory. Default is False.
+
     INPUT:
         - Selection of four atoms in three different AtomGroups. They have to be input with the correct order
 
@@ -123,12 +133,14 @@ def add_angle(self, name, sel1, sel2, sel3, units="deg", domain=360):
             convert_selection(self, sel2),
             convert_selection(self, sel3),
         ],
-        options={"units": units, "domain": domain},
+        options={"units": units, "domain": domain, "pbc": pbc},
         result=[],
     )
 
 
-def add_dihedral(self, name, sel1, sel2, sel3, sel4, units="degree", domain=360):
+def add_dihedral(
+    self, name, sel1, sel2, sel3, sel4, units="degree", domain=360, pbc=False
+):
     """
     DESCRIPTION:
         This functions measures the dihedral angle between 4 specified atoms and returns the dihedral value between 0 and 360 degrees.
@@ -143,6 +155,9 @@ def add_dihedral(self, name, sel1, sel2, sel3, sel4, units="degree", domain=360)
             - 180, pi: option for -180,180 domain
             - 360, 2pi: option for 0,360 domain. Default option
 
+        - pbc: apply the minimum image convention with the box of each frame, so measures across the box edges are correct
+            without unwrapping the trajectory. Default is False.
+
     INPUT:
         - Name of the measurement
         - Selection of four atoms in four different AtomGroups. They have to be input with the correct order
@@ -177,16 +192,18 @@ def add_dihedral(self, name, sel1, sel2, sel3, sel4, units="degree", domain=360)
             convert_selection(self, sel3),
             convert_selection(self, sel4),
         ],
-        options={"units": units, "domain": domain},
+        options={"units": units, "domain": domain, "pbc": pbc},
         result=[],
     )
 
 
-def add_planar_angle(self, name, sel1, sel2, units="deg", domain=360):
+def add_planar_angle(self, name, sel1, sel2, units="deg", domain=360, pbc=False):
     """
     DESCRIPTION:
         This function measures the angle between two planes specified by three atoms each one and returns the angle.
-        The input selections have to contain three atoms.
+        The input selections have to contain three atoms. Several pairs of planes (i.e. all the ring-ring angles of a
+        binding site) can be measured at once by giving two lists of selections of the same length, so all the angles of
+        each frame are computed in one call and stored as a list per frame.
 
     OPTIONS:
         - Name of the measurement
@@ -198,14 +215,25 @@ def add_planar_angle(self, name, sel1, sel2, units="deg", domain=360):
             - 180, pi: option for -180,180 domain
             - 360, 2pi: option for 0,360 domain. Default option
 
+        - pbc: apply the minimum image convention with the box of each frame, so measures across the box edges are correct
+            without unwrapping the trajectory. Default is False.
+
     INPUT:
-        - Selection of two sets of three atoms in two different AtomGroups.
+        - Selection of two sets of three atoms in two different AtomGroups, or two lists of them.
 
     OUTPUT:
-        - Angle between the input atoms
+        - Angle between the input atoms, or list of angles between each pair of planes
     """
 
-    for sel in (sel1, sel2):
+    pairs = isinstance(sel1, (list, tuple))
+    if pairs:
+        if not isinstance(sel2, (list, tuple)) or len(sel1) != len(sel2):
+            raise NotEqualSelectionsListsLenghtError
+        sels = list(sel1) + list(sel2)
+    else:
+        sels = [sel1, sel2]
+
+    for sel in sels:
         if isinstance(sel, AtomGroup):
             if len(sel) != 3:
                 raise NotSingleAtomSelectionError
@@ -228,8 +256,8 @@ def add_planar_angle(self, name, sel1, sel2, units="deg", domain=360):
     self.measures[name] = self.Measure(
         name=name,
         type="planar_angle",
-        sel=[convert_selection(self, sel1), convert_selection(self, sel2)],
-        options={"units": units, "domain": domain},
+        sel=[convert_selection(self, sel) for sel in sels],
+        options={"units": units, "domain": domain, "pbc": pbc, "pairs": pairs},
         result=[],
     )
 
@@ -243,6 +271,7 @@ def add_contacts(
     include_WAT=False,
     out_format="new",
     measure_distances=True,
+    pbc=False,
 ):
     """
     DESCRIPTION:
@@ -257,9 +286,12 @@ def add_contacts(
                             interactions can be also analysed by passing a list of residues names
         - out_format   -> [ '0.3'/'new'/'n' | '0.2'/'old'/'o' ] Format of the output. 'old' corresponds to the old logics (versions 0.0 to 0.2)
                             and is kept for compatibility reasons.
+        - pbc          -> apply the minimum image convention to the measured distances (of selection and protein modes).
+                            Environments are always searched across the box edges. Default is False.
 
     OUTPUT:
-        - List of dictionaries containing the name and number of all interacting residues
+        - List of dictionaries containing the name and number of all interacting residues. With the new out_format, it is
+            stored as a ContactsResult, which returns the same dictionaries when indexed or iterated.
     """
 
     if isinstance(interactions, str):
@@ -379,17 +411,13 @@ def add_contacts(
         if isinstance(sel, str):
             sel = convert_selection(self, sel)
 
-        sel_env = self.universe.select_atoms(
-            f"around {sel_env} group select", select=sel, updating=True
-        )
+        sel_env = dynamic_selection(self, f"around {sel_env} group select", select=sel)
 
         if str(out_format).lower() in ["0.2", "old", "o"]:
             out_format = "old"
             if measure_distances:
-                print(
-                    "Distances can not been calculated using the old output format. \
-                        'measure_distances' has been set to False."
-                )
+                print("Distances can not been calculated using the old output format. \
+                        'measure_distances' has been set to False.")
                 out_format = "new"
 
         elif str(out_format).lower() in ["0.3", "new", "n"]:
@@ -401,6 +429,22 @@ def add_contacts(
             )
             out_format = "new"
 
+    # new format contacts are stored in a compact ContactsResult. In protein mode, each residue of the selection is a key
+    if out_format == "new" and mode == "protein":
+        residues = convert_selection(self, sel).residues
+        result = ContactsResult(
+            mode=mode,
+            labels=[
+                resname + str(resid)
+                for resname, resid in zip(residues.resnames, residues.resids)
+            ],
+            distances=measure_distances,
+        )
+    elif out_format == "new":
+        result = ContactsResult(mode=mode, distances=measure_distances)
+    else:
+        result = []
+
     self.measures[name] = self.Measure(
         name=name,
         type="contacts",
@@ -410,12 +454,13 @@ def add_contacts(
             "interactions": interactions,
             "measure_dists": measure_distances,
             "out_format": out_format,
+            "pbc": pbc,
         },
-        result=[],
+        result=result,
     )
 
 
-def add_RMSD(self, name, sel, ref=None, superposition=True):
+def add_RMSD(self, name, sel, ref=None, superposition=True, pbc=False, rotations=False):
     """
     DESCRIPTION:
         This function outputs the RMSD of a selection
@@ -425,6 +470,10 @@ def add_RMSD(self, name, sel, ref=None, superposition=True):
         - Selection
         - ref: selection of the reference universe. If not provided, the first frame will be used as the reference.
         - superposition [bool]: compute the RMSD of aligned
+        - pbc [bool]: make the selection (and the reference) whole with the box of each frame before computing the RMSD, so
+            molecules split by the box edges are handled without unwrapping the trajectory. Default is False.
+        - rotations [bool]: keep the rotation matrix that superposes each frame onto the reference (Measure.aux['rotations'])
+            so it can be reused by aligned measures. Only with superposition. Default is False.
 
     OUTPUT:
         - Array of RMSDs of each frame against a reference
@@ -434,24 +483,77 @@ def add_RMSD(self, name, sel, ref=None, superposition=True):
 
     if isinstance(ref, type(None)):
         self.universe.trajectory[0]
-        ref = sel.positions - sel.center_of_mass()
+        ref = sel
 
-    elif isinstance(ref, AtomGroup):
-        ref = ref.positions - ref.center_of_mass()
+    if isinstance(ref, AtomGroup):
+        if pbc:
+            positions = make_whole(ref.positions, ref.dimensions)
+            ref = positions - center_block(positions[None], ref.masses)[0]
+        else:
+            ref = ref.positions - ref.center_of_mass()
+
+    ref_centered = ref.astype(float64)
+    ref_centered -= ref_centered.mean(axis=0)
 
     self.measures[name] = self.Measure(
         name=name,
         type="RMSD",
         sel=[sel],
-        options={"superposition": superposition, "ref": ref},
+        options={
+            "superposition": superposition,
+            "ref": ref,
+            "pbc": pbc,
+            # the reference of the superposition (centered on its center of geometry) is precomputed once
+            "ref_centered": ref_centered,
+            "ref_inner": float(einsum("ij,ij->", ref_centered, ref_centered)),
+            "rotations": rotations,
+        },
         result=[],
     )
 
 
-def add_distWATbridge(self, name, sel1, sel2, sel1_rad=3, sel2_rad=3):
+def add_pairwise_RMSD(self, name, sel, superposition=True, pbc=False):
+    """
+    DESCRIPTION:
+        This function stores the centered coordinates of a selection in each frame, so the RMSD between each pair of frames
+        can be computed afterwards by tiles with analyse_RMSD_matrix and the frames clustered with analyse_clustering.
+
+    INPUT:
+        - Name of the measurement
+        - Selection
+        - superposition [bool]: compute the RMSD of each pair of frames after their optimal superposition
+        - pbc [bool]: make the selection whole with the box of each frame. Default is False.
+
+    OUTPUT:
+        - List with the nx3 centered coordinates of the selection in each frame
+    """
+
+    self.measures[name] = self.Measure(
+        name=name,
+        type="pairwise_RMSD",
+        sel=[convert_selection(self, sel)],
+        options={"superposition": superposition, "pbc": pbc},
+        result=[],
+    )
+
+
+def add_distWATbridge(
+    self,
+    name,
+    sel1,
+    sel2,
+    sel1_rad=3,
+    sel2_rad=3,
+    pbc=False,
+    water="resname WAT",
+    top=1,
+    two_water=False,
+    water_rad=3.5,
+):
     """
     DESCRIPTION
         This function takes a Universe, two selections and the size of their environments and returns the nearest bridging water between the two selections and the distance to both of them.
+        The waters close to each selection are found with one neighbour search over all the water atoms per frame.
 
     INPUT:
         - Name of the measurement
@@ -460,24 +562,25 @@ def add_distWATbridge(self, name, sel1, sel2, sel1_rad=3, sel2_rad=3):
         - sel2         -> selection of second set of central atoms. It has to be an AtomGroup
         - sel1_rad      -> radius around the first set of central atoms (in ang)
         - sel2_rad      -> radius around the first set of central atoms (in ang)
+        - pbc           -> apply the minimum image convention to the measured distances. Default is False.
+        - water         -> selection (string, name of a selection or AtomGroup) of the water atoms whose distances are
+                            measured. The distance of each water is the minimum of its atoms. Default are all the atoms
+                            of WAT residues (i.e. "resname HOH and name OW" only measures the oxygens of HOH waters).
+        - top           -> number of bridging waters (ranked by the average distance to both selections) stored per frame. Default is 1.
+        - two_water     -> also look for the best bridge of two waters in each frame, stored in the measure's aux attribute
+                            ("two_water") as [resid 1, resid 2, distance to sel1, distance between waters, distance to sel2].
+                            Default is False.
+        - water_rad     -> maximum distance between the waters of a two-water bridge (in ang). Default is 3.5.
 
     OUTPUT:
-        - List of dictionaries containing the number of the bridging water and the smallest distance to each of the selection sets.
+        - Per-frame list with the resid of the bridging water and its smallest distance to each of the selection sets (None
+            if there is no bridge), or a list of them for the top bridging waters if top > 1.
     """
 
-    # sel1_rad, sel2_rad = sel1_env, sel2_env
-
-    sel1_env = self.universe.select_atoms(
-        "resname WAT and around %s group select" % sel1_rad,
-        select=sel1,
-        updating=True,
-    )
-
-    sel2_env = self.universe.select_atoms(
-        "resname WAT and around %s group select" % sel2_rad,
-        select=sel2,
-        updating=True,
-    )
+    if isinstance(water, AtomGroup) or water in self.selections.keys():
+        water = convert_selection(self, water)
+    else:
+        water = self.universe.select_atoms(water)
 
     self.measures[name] = self.Measure(
         name=name,
@@ -485,13 +588,117 @@ def add_distWATbridge(self, name, sel1, sel2, sel1_rad=3, sel2_rad=3):
         sel=[
             convert_selection(self, sel1),
             convert_selection(self, sel2),
-            convert_selection(self, sel1_env),
-            convert_selection(self, sel2_env),
-            convert_selection(self, sel1_rad),
-            convert_selection(self, sel2_rad),
+            water,
         ],
-        options={},
+        options={
+            "sel1_rad": sel1_rad,
+            "sel2_rad": sel2_rad,
+            "pbc": pbc,
+            "top": top,
+            "two_water": two_water,
+            "water_rad": water_rad,
+        },
         result=[],
+        aux={"two_water": []} if two_water else {},
+    )
+
+
+def add_hbonds(
+    self,
+    name,
+    sel1,
+    sel2=None,
+    d_a_cutoff=3.0,
+    angle_cutoff=150,
+    hydrogens="name H*",
+    donors="name N* or name O* or name S*",
+    acceptors="name N* or name O*",
+    pbc=False,
+):
+    """
+    DESCRIPTION:
+        This function outputs the hydrogen bonds (donor-hydrogen...acceptor) within a selection or between two selections.
+        Donor-hydrogen pairs are taken from the bonds of the topology or, if there are not, by assigning each hydrogen to
+        the closest donor within 1.2 ang in the current frame. In each frame (or block of frames), all the donor-acceptor
+        pairs are found with one neighbour search and filtered by the angle cutoff.
+
+    INPUT:
+        - name:         name of the measurement
+        - sel1:         selection (or name of a selection) where the hydrogen bonds are searched
+        - sel2:         second selection. If given, only hydrogen bonds between sel1 and sel2 (in both directions) are kept.
+                        Default is None (hydrogen bonds within sel1).
+        - d_a_cutoff:   maximum donor-acceptor distance (in ang). Default is 3.0.
+        - angle_cutoff: minimum donor-hydrogen-acceptor angle (in degrees). Default is 150.
+        - hydrogens, donors, acceptors: selection strings of the hydrogens, donor and acceptor atoms within the selections.
+        - pbc:          apply the minimum image convention to the distances and angles. Default is False.
+
+    OUTPUT:
+        - Per-frame hydrogen bonds as a ContactsResult in pairs mode, where each frame is a dictionary with
+            (donor, acceptor) atom labels (i.e. 'SER4:OG', 'GLU3:OE1') as key and the donor-acceptor distance as value.
+    """
+
+    sel1 = convert_selection(self, sel1)
+    between = sel2 is not None
+    sel2 = convert_selection(self, sel2) if between else sel1
+    atoms = sel1 | sel2
+
+    hydrogen_atoms = atoms.select_atoms(hydrogens)
+    donor_atoms = atoms.select_atoms(donors)
+    acceptor_atoms = atoms.select_atoms(acceptors)
+
+    # donor of each hydrogen, from the bonds of the topology or guessed by distance
+    if hasattr(self.universe, "bonds") and len(self.universe.bonds) > 0:
+        donor_index = {index: d for d, index in enumerate(donor_atoms.indices)}
+        donor = [
+            next(
+                (
+                    donor_index[atom.index]
+                    for atom in hydrogen.bonded_atoms
+                    if atom.index in donor_index
+                ),
+                -1,
+            )
+            for hydrogen in hydrogen_atoms
+        ]
+    else:
+        donor = guess_hydrogen_donors(
+            hydrogen_atoms.positions,
+            donor_atoms.positions,
+            box=self.universe.dimensions if pbc else None,
+        )
+
+    donor = asarray(donor, dtype=int64)
+    hydrogen_atoms = hydrogen_atoms[donor >= 0]
+    donor_atoms = donor_atoms[donor[donor >= 0]]
+
+    # atom labels are interned in advance, so each hydrogen bond is stored as a pair of label indices
+    result = ContactsResult(
+        mode="pairs",
+        labels=[
+            f"{atom.resname}{atom.resid}:{atom.name}"
+            for atom in donor_atoms + acceptor_atoms
+        ],
+        distances=True,
+    )
+    labels = frombuffer(result.key_index, dtype=int32)
+
+    self.measures[name] = self.Measure(
+        name=name,
+        type="hbonds",
+        sel=[donor_atoms, hydrogen_atoms, acceptor_atoms],
+        options={
+            "d_a_cutoff": d_a_cutoff,
+            "angle_cutoff": angle_cutoff,
+            "pbc": pbc,
+            "between": between,
+            "donor_labels": labels[: len(donor_atoms)].copy(),
+            "acceptor_labels": labels[len(donor_atoms) :].copy(),
+            "donor_in_sel1": isin(donor_atoms.indices, sel1.indices),
+            "donor_in_sel2": isin(donor_atoms.indices, sel2.indices),
+            "acceptor_in_sel1": isin(acceptor_atoms.indices, sel1.indices),
+            "acceptor_in_sel2": isin(acceptor_atoms.indices, sel2.indices),
+        },
+        result=result,
     )
 
 
@@ -503,6 +710,9 @@ def add_pKa(
     pdb_folder=".pka",
     keep_pdb=False,
     keep_pka=False,
+    n_jobs=1,
+    cache_folder=None,
+    cache_size=1024,
 ):
     """
     DESCRIPTION:
@@ -514,6 +724,11 @@ def add_pKa(
         - pka_ref:          reference to calculate pKa. Default is neutral. [ neutral | low-pH]
         - keep_pdb:         trigger for keeping generated pdbs. Default is False. [ True | False ]
         - keep_pka:         trigger for keeping generated .pka file. Default is False. [ True | False ]
+        - n_jobs:           number of PROpKa3 processes executed concurrently. At most 2 * n_jobs frames are waiting for
+                            their prediction (with their scratch PDB written) at the same time. Default is 1.
+        - cache_folder:     folder where predictions are cached by the hash of the protein coordinates, so frames already
+                            predicted in previous runs are not predicted again. Default is None (no cache).
+        - cache_size:       maximum size of the cache (in MB). Least recently used predictions are removed first. Default is 1024.
 
     OUPUT:
         - Per-frame array of dicts with shape { residue : pKa }
@@ -534,6 +749,9 @@ def add_pKa(
             "pdb_folder": pdb_folder,
             "keep_pdb": keep_pdb,
             "keep_pka": keep_pka,
+            "n_jobs": n_jobs,
+            "cache_folder": cache_folder,
+            "cache_size": cache_size,
         },
         result=[],
     )
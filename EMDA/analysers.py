@@ -10,6 +10,13 @@ from .exceptions import (
     NotEnoughDataError,
 )
 from .tools import get_most_frequent
+from .results import ContactsResult
+
+from .calculators import calc_pairwise_RMSD_matrix, calc_kmedoids
+
+from collections import Counter
+from numpy import bincount, diff, frombuffer, int32, int64, unique
+from numpy import arange, argsort, asarray, repeat, stack
 
 # from numpy import maximum as max
 
@@ -26,6 +33,9 @@ AVAILABLE:
     - analyse_contacts_frequency:
     - analyse_contacts_amount:
     - analyse_NACs:
+    - analyse_RMSD_matrix:
+    - analyse_clustering:
+    - analyse_hbonds_frequency:
 """
 
 
@@ -97,60 +107,75 @@ def analyse_contacts_frequency(
     if self.measures[measure].options["out_format"] not in ("new"):
         raise NotCompatibleContactsFormatError
 
-    if self.measures[measure].options["mode"] == "protein":
-        # create dict containing the residue name as key and a list as value. In this list, each contact in each frame will be stored
-        total_contacts = {
-            resid: [] for resid in list(self.measures[measure].result[0].keys())
+    result = self.measures[measure].result
+    n_frames = len(result)
+
+    # count how many frames each pair of (residue, contacting residue) appears in a single pass
+    if isinstance(result, ContactsResult) and result.mode == "protein":
+        _, rows, cols, _ = result.arrays()
+        n_labels = len(result.labels)
+        pairs, counts = unique(rows.astype(int64) * n_labels + cols, return_counts=True)
+        counts = {
+            (result.labels[pair // n_labels], result.labels[pair % n_labels]): count
+            for pair, count in zip(pairs.tolist(), counts.tolist())
         }
 
-        for frame in self.measures[measure].result:
-            for resid in list(total_contacts.keys()):
-                total_contacts[resid] += list(frame[resid].keys())
+    elif isinstance(result, ContactsResult):
+        _, _, cols, _ = result.arrays()
+        partners, counts = unique(cols, return_counts=True)
+        counts = {
+            (None, result.labels[partner]): count
+            for partner, count in zip(partners.tolist(), counts.tolist())
+        }
 
-        contacts_freq = {}
-        for residue in list(total_contacts.keys()):
+    elif self.measures[measure].options["mode"] == "protein":
+        counts = Counter(
+            (resid, partner)
+            for frame in result
+            for resid in frame.keys()
+            for partner in frame[resid].keys()
+        )
 
-            if percentage:
-                contacts_freq[residue] = {
-                    residue_from_tot: total_contacts[residue].count(residue_from_tot)
-                    * 100
-                    / len(self.measures[measure].result)
-                    for residue_from_tot in list(set(list(total_contacts[residue])))
-                }
+    elif self.measures[measure].options["mode"] == "selection":
+        counts = Counter((None, resid) for frame in result for resid in frame.keys())
 
+    if self.measures[measure].options["mode"] == "protein":
+        contacts_freq = {resid: {} for resid in list(result[0].keys())}
+
+        for (resid, partner), count in counts.items():
+            if resid not in contacts_freq:
+                continue
+
+            if percentage:
+                contacts_freq[resid][partner] = count * 100 / n_frames
             elif not percentage:
-                contacts_freq[residue] = {
-                    residue_from_tot: total_contacts[residue].count(residue_from_tot)
-                    for residue_from_tot in list(set(list(total_contacts[residue])))
-                }
+                contacts_freq[resid][partner] = count
 
     elif self.measures[measure].options["mode"] == "selection":
 
-        contacts_freq = {}
-        for frame in self.measures[measure].result:
-            for resid in list(frame.keys()):
-                if resid in contacts_freq.keys():
-                    contacts_freq[resid] += 1
-                elif resid not in contacts_freq.keys():
-                    contacts_freq[resid] = 1
+        contacts_freq = {resid: count for (_, resid), count in counts.items()}
+        if isinstance(result, ContactsResult):
+            # keep the residues in order of appearance, which is the order of the labels table
+            contacts_freq = dict(
+                sorted(
+                    contacts_freq.items(),
+                    key=lambda item: result.label_index[item[0]],
+                )
+            )
+
+        most_frequent = max(contacts_freq.values(), default=1)
 
         if percentage and not normalise_to_most_frequent:
             for residue in list(contacts_freq.keys()):
-                contacts_freq[residue] = (
-                    contacts_freq[residue] * 100 / len(self.measures[measure].result)
-                )
+                contacts_freq[residue] = contacts_freq[residue] * 100 / n_frames
 
         elif not percentage and normalise_to_most_frequent:
             for residue in list(contacts_freq.keys()):
-                contacts_freq[residue] = contacts_freq[residue] / max(
-                    contacts_freq.values()
-                )
+                contacts_freq[residue] = contacts_freq[residue] / most_frequent
 
         elif percentage and normalise_to_most_frequent:
             for residue in list(contacts_freq.keys()):
-                contacts_freq[residue] = (
-                    contacts_freq[residue] * 100 / max(contacts_freq.values())
-                )
+                contacts_freq[residue] = contacts_freq[residue] * 100 / most_frequent
 
     self.analyses[name] = self.Analysis(
         name=name,
@@ -177,22 +202,31 @@ def analyse_contacts_amount(self, name, measure):
     if self.measures[measure].type not in ("contacts"):
         raise NotCompatibleMeasureForAnalysisError
 
-    if self.measures[measure].options["mode"] == "protein":
-        # create dict containing the residue name as key and a list as value. In this list, each contact in each frame will be stored
+    result = self.measures[measure].result
+
+    if isinstance(result, ContactsResult) and result.mode == "protein":
+        # number of contacts of each key residue in each frame, counted with a bincount per frame
+        indptr, rows, _, _ = result.arrays()
+        keys = [result.labels[k] for k in result.key_index]
+        key_index = frombuffer(result.key_index, dtype=int32)
+
         contacts_amount = []
+        for start, end in zip(indptr[:-1], indptr[1:]):
+            counts = bincount(rows[start:end], minlength=len(result.labels))
+            contacts_amount.append(dict(zip(keys, counts[key_index].tolist())))
 
-        for frame in self.measures[measure].result:
-            contacts_amount.append(
-                {resid: [] for resid in list(self.measures[measure].result[0].keys())}
-            )
-            for resid in list(contacts_amount[-1].keys()):
-                contacts_amount[-1][resid] = len(frame[resid])
+    elif isinstance(result, ContactsResult):
+        indptr, _, _, _ = result.arrays()
+        contacts_amount = diff(indptr).tolist()
 
-    elif self.measures[measure].options["mode"] == "selection":
+    elif self.measures[measure].options["mode"] == "protein":
+        keys = list(result[0].keys())
+        contacts_amount = [
+            {resid: len(frame[resid]) for resid in keys} for frame in result
+        ]
 
-        contacts_amount = []
-        for frame in self.measures[measure].result:
-            contacts_amount.append(len(frame))
+    elif self.measures[measure].options["mode"] == "selection":
+        contacts_amount = [len(frame) for frame in result]
 
     self.analyses[name] = self.Analysis(
         name=name,
@@ -267,3 +301,174 @@ def analyse_NACs(self, name, analyses: list, inverse: list = False):
                 result_ = result_ and self.analyses[analysis].result[frame]
 
         self.analyses[name].result.append(result_)
+
+
+def analyse_RMSD_matrix(
+    self, name, measure, tile_size=500, n_workers=1, matrix_file=None
+):
+    """
+    DESCRIPTION:
+        Analyser for calculating the RMSD between each pair of frames of a pairwise_RMSD measure. The matrix is computed by
+        tiles of tile_size x tile_size frames, which can be split among several processes and written to a memory-mapped
+        file, so matrices of large trajectories do not need to fit in memory.
+
+    OUTPUT:
+        A FxF array (or numpy memory map if matrix_file is given) with the RMSD between each pair of frames.
+
+    OPTIONS:
+        - tile_size:    Number of frames of each side of the tiles. Default is 500.
+        - n_workers:    Number of processes among which the tiles are split. Default is 1.
+        - matrix_file:  .npy file where the matrix is stored as a memory map. Default is None (matrix kept in memory).
+    """
+
+    if self.measures[measure].type not in ("pairwise_RMSD"):
+        raise NotCompatibleMeasureForAnalysisError
+
+    matrix = calc_pairwise_RMSD_matrix(
+        stack(self.measures[measure].result),
+        self.measures[measure].options["superposition"],
+        tile_size=tile_size,
+        n_workers=n_workers,
+        matrix_file=matrix_file,
+    )
+
+    self.analyses[name] = self.Analysis(
+        name=name,
+        type="RMSD_matrix",
+        measure_name=measure,
+        result=matrix,
+        options={"frames": list(self.measures[measure].frames)},
+    )
+
+
+def analyse_clustering(
+    self,
+    name,
+    analysis,
+    method="kmedoids",
+    n_clusters=5,
+    threshold=None,
+    linkage_method="average",
+    max_iter=100,
+    seed=0,
+):
+    """
+    DESCRIPTION:
+        Analyser for clustering the frames from an RMSD_matrix analysis, either by k-medoids or by hierarchical clustering.
+        k-medoids reads the matrix by rows, so it can be used with memory-mapped matrices, while hierarchical clustering
+        (scipy's linkage) needs the condensed matrix in memory.
+
+    OUTPUT:
+        A frame-wise list containing the cluster (from 0) of each frame. The frames of the medoids (k-medoids) or the linkage
+        matrix (hierarchical clustering) are stored in the options attribute of the Analysis class.
+
+    OPTIONS:
+        - method:           [ 'kmedoids' | 'linkage' ] Clustering method. Default is kmedoids.
+        - n_clusters:       Number of clusters. Default is 5.
+        - threshold:        RMSD (in ang) at which the hierarchical tree is cut instead of using n_clusters (linkage method).
+        - linkage_method:   Linkage criterion of the hierarchical clustering (single, complete, average...). Default is average.
+        - max_iter:         Maximum number of iterations of k-medoids. Default is 100.
+        - seed:             Seed of the random initialisation (k-medoids++) of k-medoids. Default is 0.
+    """
+
+    if self.analyses[analysis].type != "RMSD_matrix":
+        raise NotCompatibleAnalysisForAnalysisError
+
+    matrix = self.analyses[analysis].result
+    frames = self.analyses[analysis].options["frames"]
+
+    if method.lower() in ("kmedoids", "k-medoids"):
+        labels, medoids = calc_kmedoids(
+            matrix, n_clusters, max_iter=max_iter, seed=seed
+        )
+        options = {
+            "method": "kmedoids",
+            "medoids": [frames[medoid] for medoid in medoids],
+        }
+
+    elif method.lower() in ("linkage", "hierarchical"):
+        from scipy.cluster.hierarchy import fcluster, linkage
+        from scipy.spatial.distance import squareform
+
+        tree = linkage(squareform(asarray(matrix), checks=False), method=linkage_method)
+        if threshold is not None:
+            labels = fcluster(tree, threshold, criterion="distance") - 1
+        else:
+            labels = fcluster(tree, n_clusters, criterion="maxclust") - 1
+        options = {"method": "linkage", "linkage": tree}
+
+    else:
+        raise NotAvailableOptionError
+
+    self.analyses[name] = self.Analysis(
+        name=name,
+        type="clustering",
+        measure_name=analysis,
+        result=[int(label) for label in labels],
+        options=options,
+    )
+
+
+def analyse_hbonds_frequency(self, name, measure, percentage=False, level="atom"):
+    """
+    DESCRIPTION:
+        Analyser for calculating the frequency (in absolute value or %) of the hydrogen bonds of an hbonds measure. Pairs
+        are counted with a single pass over the stored label indices.
+
+    OUTPUT:
+        A dictionary in the result attribute of an Analysis class with the (donor, acceptor) pair as key and the number of
+            frames where the hydrogen bond is present (or the % of frames) as value, sorted from the most frequent.
+
+    OPTIONS:
+        - percentage:   Returns the values in percentage
+        - level:        [ 'atom' | 'residue' ] Count the hydrogen bonds between atoms (i.e. ('SER4:OG', 'GLU3:OE1')) or the
+                        frames where two residues are hydrogen bonded (i.e. ('SER4', 'GLU3')). Default is atom.
+    """
+
+    if self.measures[measure].type != "hbonds":
+        raise NotCompatibleMeasureForAnalysisError
+
+    if level not in ("atom", "residue"):
+        raise NotAvailableOptionError
+
+    result = self.measures[measure].result
+    indptr, rows, cols, _ = result.arrays()
+    n_frames = len(result)
+
+    labels = result.labels
+    if level == "residue":
+        # atom labels are mapped into residue labels, and each pair of residues is counted once per frame
+        index = {}
+        residue = asarray(
+            [
+                index.setdefault(label.split(":")[0], len(index))
+                for label in result.labels
+            ],
+            dtype=int64,
+        )
+        labels = list(index)
+        rows, cols = residue[rows], residue[cols]
+
+    n_labels = len(labels)
+    pairs = rows.astype(int64) * n_labels + cols
+    if level == "residue":
+        frames = repeat(arange(n_frames, dtype=int64), diff(indptr))
+        pairs = unique(frames * n_labels**2 + pairs) % n_labels**2
+
+    pairs, counts = unique(pairs, return_counts=True)
+    order = argsort(-counts, kind="stable")
+
+    hbonds_freq = {
+        (labels[pair // n_labels], labels[pair % n_labels]): (
+            count * 100 / n_frames if percentage else count
+        )
+        for pair, count in zip(pairs[order].tolist(), counts[order].tolist())
+    }
+
+    self.analyses[name] = self.Analysis(
+        name=name,
+        type="hbonds_frequency",
+        measure_name=measure,
+        result=hbonds_freq,
+        options={"percentage": percentage, "level": level},
+    )
@@ -0,0 +1,129 @@
+from os import listdir, makedirs, path, remove, replace, stat, utime, getpid
+from hashlib import sha256
+from functools import lru_cache
+from threading import get_ident
+import json
+
+from numpy import float32
+
+"""
+DESCRIPTION
+    This Python file contains the functions for the on-disk cache of expensive per-frame calculations (i.e. PROPKA
+    predictions). Each entry is stored as a JSON file named after its key. The modification time of each file is updated
+    when it is read, so the least recently used entries are the first ones removed when the cache exceeds its size.
+"""
+
+
+@lru_cache(maxsize=None)
+def get_propka_version():
+    """
+    DESCRIPTION:
+        Function that returns the installed version of PROPKA, or 'unknown' if it can not be determined.
+    """
+
+    from importlib.metadata import version, PackageNotFoundError
+
+    try:
+        return version("propka")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def pka_cache_key(sel_protein, pka_ref):
+    """
+    DESCRIPTION:
+        Function that builds the cache key of a pKa prediction by hashing the coordinates and the topology (atom names,
+        residue names and numbers) of the protein selection together with the pka_ref and the PROPKA version.
+    """
+
+    key = sha256()
+    key.update(sel_protein.positions.astype(float32).tobytes())
+    key.update(" ".join(sel_protein.names).encode())
+    key.update(" ".join(sel_protein.resnames).encode())
+    key.update(sel_protein.resids.tobytes())
+    key.update(f"{pka_ref} {get_propka_version()}".encode())
+
+    return key.hexdigest()
+
+
+def read_cache(cache_folder, key):
+    """
+    DESCRIPTION:
+        Function that returns the cached value of the given key or None if it is not in the cache. Read entries are
+        marked as recently used.
+    """
+
+    filename = path.join(cache_folder, f"{key}.json")
+
+    try:
+        with open(filename) as handle:
+            value = json.load(handle)
+        utime(filename)
+
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    return value
+
+
+def write_cache(cache_folder, key, value, max_size=None):
+    """
+    DESCRIPTION:
+        Function that stores a JSON-serialisable value in the cache under the given key. If max_size (in bytes) is given,
+        the least recently used entries are removed until the cache fits in it.
+    """
+
+    makedirs(cache_folder, exist_ok=True)
+    filename = path.join(cache_folder, f"{key}.json")
+
+    # write to a temporary file first, so concurrent readers never find half-written entries
+    tmp_filename = f"{filename}.{getpid()}.{get_ident()}.tmp"
+    with open(tmp_filename, "w") as handle:
+        json.dump(value, handle)
+    replace(tmp_filename, filename)
+
+    if max_size is not None:
+        evict_cache(cache_folder, max_size)
+
+
+def evict_cache(cache_folder, max_size):
+    """
+    DESCRIPTION:
+        Function that removes the least recently used entries of the cache until its size (in bytes) is below max_size.
+    """
+
+    entries = []
+    for filename in listdir(cache_folder):
+        if not filename.endswith(".json"):
+            continue
+
+        try:
+            stats = stat(path.join(cache_folder, filename))
+        except FileNotFoundError:
+            continue
+
+        entries.append((stats.st_mtime, stats.st_size, filename))
+
+    size = sum(entry[1] for entry in entries)
+    for _, entry_size, filename in sorted(entries):
+        if size <= max_size:
+            break
+
+        try:
+            remove(path.join(cache_folder, filename))
+        except FileNotFoundError:
+            pass
+
+        size -= entry_size
+
+
+def cached_call(function, cache_folder, key, max_size, *args, **kwargs):
+    """
+    DESCRIPTION:
+        Function that calls function(*args, **kwargs), stores its result in the cache under the given key and returns it.
+    """
+
+    value = function(*args, **kwargs)
+    write_cache(cache_folder, key, value, max_size=max_size)
+
+    return value
@@ -10,8 +10,20 @@ import MDAnalysis.analysis.rms as rms
 from .tools import check_folder
 
 from subprocess import run as run_command
-from os import remove, chdir
+from os import remove, close, path
+from tempfile import mkstemp
 
+from math import pi
+from numpy import empty, einsum, rad2deg, sqrt as npsqrt
+from numpy import concatenate, isin, lexsort, ones, inf, asarray, float32
+from numpy import stack, round as npround, arccos, clip, cross
+from numpy import float64, sign as npsign, argmin, minimum
+from numpy import argsort, flatnonzero, full, isfinite, unique
+from numpy.random import default_rng
+from numpy.linalg import det, norm, svd
+from numpy.lib.format import open_memmap
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 
 """
 DESCRIPTION
@@ -22,72 +34,167 @@ DESCRIPTION
 
 # tools
 def build_plane(
-    positions,  # nx3, being n the number of atoms that build the plane
+    positions,  # ...x3x3 array, being the last but one axis the three atoms that build each plane
 ):
     """
     DESCRIPTION
-        Function for obtaining the equation of the plane from a given list containing the positions of three atoms.
-        It is used in the 'planar_ange' function.
+        Function for obtaining the equation of the plane (a, b, c, d) from the positions of three atoms. It accepts stacks
+        of planes (i.e. frames x planes x 3 x 3) and returns the equation of each one in the last axis.
     """
-    from numpy import cross, dot
 
-    if len(positions) == 3:
-        v1 = positions[2] - positions[0]
-        v2 = positions[1] - positions[0]
+    v1 = positions[..., 2, :] - positions[..., 0, :]
+    v2 = positions[..., 1, :] - positions[..., 0, :]
 
-        a, b, c = cross(v1, v2)
-        d = dot([a, b, c], positions[2])
+    normal = cross(v1, v2)
+    d = einsum("...k,...k->...", normal, positions[..., 2, :])
 
-        #        return array(a, b, c, d)
-        return [a, b, c, d]
+    return concatenate([normal, d[..., None]], axis=-1)
 
 
-# calculators
-def calc_planar_angle(
-    plane_A,  # nx3 np array, being n the number of atoms for building the plane (min 3)
-    plane_B,  # nx3 np array, being n the number of atoms for building the plane (min 3)
+def convert_angle(
+    angle,  # float or array of angles in radians
     units,  # [ deg | rad ]
     domain,  # [ 360 | 180 ] 360: (0, 360); 180: (-180, 180)
 ):
-    from numpy import arccos, sqrt
+    """
+    DESCRIPTION
+        Function for converting angles (in radians) to the requested units and domain. It accepts both single values and arrays,
+        so it is shared by the frame-wise and the block calculators.
+    """
 
-    plane_A = build_plane(plane_A)
-    plane_B = build_plane(plane_B)
+    if units in ("rad", "radian", "radians", "pi"):
+        if domain in (360, "360", "2pi"):
+            angle = (angle + pi) % pi
 
-    ang = arccos(
-        (plane_A[0] * plane_B[0] + plane_A[1] * plane_B[1] + plane_A[2] * plane_B[2])
-        / (
-            sqrt(plane_A[0] ** 2 + plane_A[1] ** 2 + plane_A[2] ** 2)
-            * sqrt(plane_B[0] ** 2 + plane_B[1] ** 2 + plane_B[2] ** 2)
+    elif units in ("deg", "degree", "degrees"):
+        angle = rad2deg(angle)
+        if domain in (360, "360", "2pi"):
+            angle = (angle + 360) % 360
+
+    return angle
+
+
+def center_block(
+    coords,  # Fxnx3 array, being F the number of frames and n the number of atoms
+    masses=None,  # n array. If given, centers of mass are returned instead of centers of geometry
+):
+    """
+    DESCRIPTION
+        Function for obtaining the center of geometry (or of mass, if masses are given) of each frame of a block of coordinates.
+    """
+
+    if masses is None:
+        return coords.mean(axis=1)
+
+    return einsum("fnk,n->fk", coords, masses) / masses.sum()
+
+
+def minimum_image(
+    vectors,  # nx3 array (one frame) or Fxnx3 array (block of F frames)
+    box,  # box dimensions [lx, ly, lz, alpha, beta, gamma] or Fx6 array with the box of each frame
+):
+    """
+    DESCRIPTION
+        Function that applies the minimum image convention to a set of vectors. Orthorhombic boxes are handled at once for
+        all the vectors and frames, while triclinic boxes are handled frame by frame by MDAnalysis' minimize_vectors.
+    """
+
+    single = vectors.ndim == 2
+    if single:
+        vectors = vectors[None]
+
+    box = asarray(box, dtype=vectors.dtype).reshape(-1, 6)
+    if len(box) == 1:
+        box = box.repeat(len(vectors), axis=0)
+
+    if (box[:, 3:] == 90).all():
+        lengths = box[:, None, :3]
+        vectors = vectors - lengths * npround(vectors / lengths)
+
+    else:
+        vectors = stack(
+            [mdadist.minimize_vectors(vectors[f], box[f]) for f in range(len(vectors))]
         )
-    )
 
-    if units in ("rad", "radian", "radians"):
+    if single:
+        return vectors[0]
+
+    return vectors
+
+
+def make_whole(
+    coords,  # nx3 array (one frame) or Fxnx3 array (block of F frames)
+    box,  # box dimensions [lx, ly, lz, alpha, beta, gamma] or Fx6 array with the box of each frame
+):
+    """
+    DESCRIPTION
+        Function that moves each atom to its periodic image closest to the first atom of the selection, so selections split
+        by the box edges are whole again. Only valid for selections smaller than half of the box.
+    """
 
-        if domain in (180, "180", "pi"):
-            pass
+    first = coords[..., :1, :]
 
-        elif domain in (360, "360", "2pi"):
-            from math import pi
+    return first + minimum_image(coords - first, box)
 
-            ang = (ang + pi) % pi
 
-    elif units in ("deg", "degree", "degrees"):
-        from numpy import rad2deg
+# calculators
+def calc_planar_angle(
+    plane_A,  # 3x3 np array with the positions of the three atoms that build the plane
+    plane_B,  # 3x3 np array with the positions of the three atoms that build the plane
+    units,  # [ deg | rad ]
+    domain,  # [ 360 | 180 ] 360: (0, 360); 180: (-180, 180)
+    box=None,  # box dimensions. If given, each plane is made whole before being built
+):
+    """
+    DESCRIPTION
+        Function that calculates the angle between two planes defined by three atoms each one.
+    """
 
-        if domain in (180, "180", "pi"):
-            ang = rad2deg(ang)
+    return float(
+        calc_planar_angle_block(
+            plane_A[None, None],
+            plane_B[None, None],
+            units,
+            domain,
+            box=None if box is None else asarray(box)[None],
+        )[0, 0]
+    )
 
-        elif domain in (360, "360", "2pi"):
-            ang = (rad2deg(ang) + 360) % 360
 
-    return float(ang)
+def calc_planar_angle_block(
+    planes_A,  # FxPx3x3 array, being F the number of frames and P the number of planes
+    planes_B,  # FxPx3x3 array, being F the number of frames and P the number of planes
+    units,  # [ deg | rad ]
+    domain,  # [ 360 | 180 ] 360: (0, 360); 180: (-180, 180)
+    box=None,  # Fx6 array with the box dimensions of each frame. If given, each plane is made whole
+):
+    """
+    DESCRIPTION
+        Block version of calc_planar_angle. It takes the coordinates of P pairs of planes for a block of F frames and returns
+        a FxP array with the angle between each pair of planes in each frame.
+    """
+
+    if box is not None:
+        F, P = planes_A.shape[:2]
+        planes_A = make_whole(planes_A.reshape(F * P, 3, 3), box.repeat(P, axis=0))
+        planes_B = make_whole(planes_B.reshape(F * P, 3, 3), box.repeat(P, axis=0))
+        planes_A, planes_B = planes_A.reshape(F, P, 3, 3), planes_B.reshape(F, P, 3, 3)
+
+    normal_A = build_plane(planes_A)[..., :3]
+    normal_B = build_plane(planes_B)[..., :3]
+
+    cosine = einsum("fpk,fpk->fp", normal_A, normal_B) / (
+        norm(normal_A, axis=-1) * norm(normal_B, axis=-1)
+    )
+
+    return convert_angle(arccos(clip(cosine, -1, 1)), units, domain)
 
 
 def calc_distance(
     sel1,  # selection containing one or more atoms
     sel2,  # selection containing one or more atoms
     type,  # [min | max | com | cog ]
+    box=None,  # box dimensions. If given, the minimum image convention is applied
 ):
     """
     DESCRIPTION
@@ -97,30 +204,35 @@ def calc_distance(
             - distance between Centers of Mass (com)
             - distance between Centers of Geometry (cog)
     """
-    from numpy import min as npmin
-    from numpy import max as npmax
 
-    if type == "min":
-        d = npmin(mdadist.distance_array(sel1, sel2, backend="OpenMP"))
+    if type in ("min", "max"):
+        d = calc_distance_reduction(sel1.positions, sel2.positions, type, box=box)
 
-    elif type == "max":
-        d = npmax(mdadist.distance_array(sel1, sel2, backend="OpenMP"))
+    elif box is not None:
+        d = calc_distance_block(
+            sel1.positions[None],
+            sel2.positions[None],
+            type,
+            sel1.masses,
+            sel2.masses,
+            box=box,
+        )[0]
 
     elif type == "com":
         d = mdadist.distance_array(
             sel1.center_of_mass(), sel2.center_of_mass(), backend="OpenMP"
-        )
+        )[0, 0]
 
     elif type == "cog":
         d = mdadist.distance_array(
             sel1.center_of_geometry(), sel2.center_of_geometry(), backend="OpenMP"
-        )
+        )[0, 0]
 
     return float(d)
 
 
 def calc_dihedral(
-    sel1, sel2, sel3, sel4, units, domain  # [ rad | deg ]  # [ 180 | 360 ]
+    sel1, sel2, sel3, sel4, units, domain, box=None  # [ rad | deg ]  # [ 180 | 360 ]
 ):
     """
     DESCRIPTION
@@ -130,31 +242,24 @@ def calc_dihedral(
     OPTIONS (as arguments)
         - units: radians (rad) or degrees (deg)
         - domain: -180 to 180 º or 0 to 360º
+        - box: box dimensions. If given, the minimum image convention is applied to the bonds
     """
 
-    d = mdadist.calc_dihedrals(sel1, sel2, sel3, sel4, backend="OpenMP")
-
-    if units in ("rad", "radian", "radians", "pi"):
-        from math import pi
-
-        if domain in (360, "360", "2pi"):
-            d = (d + pi) % pi
-            return float(d)
-        elif domain in (180, "180", "pi"):
-            return float(d)
-
-    elif units in ("deg", "degree", "degrees"):
-        from numpy import rad2deg
+    d = mdadist.calc_dihedrals(
+        sel1.positions,
+        sel2.positions,
+        sel3.positions,
+        sel4.positions,
+        box=box,
+        backend="OpenMP",
+    )
 
-        d = rad2deg(d)
-        if domain in (360, "360", "2pi"):
-            d = (d + 360) % 360
-            return float(d)
-        elif domain in (180, "180", "pi"):
-            return float(d)
+    return float(convert_angle(d[0], units, domain))
 
 
-def calc_angle(sel1, sel2, sel3, units, domain):  # [ rad | deg ]  # [ 180 | 360 ]
+def calc_angle(
+    sel1, sel2, sel3, units, domain, box=None
+):  # [ rad | deg ]  # [ 180 | 360 ]
     """
     DESCRIPTION
         Function that calculates the angle between three atoms.
@@ -163,43 +268,179 @@ def calc_angle(sel1, sel2, sel3, units, domain):  # [ rad | deg ]  # [ 180 | 360
     OPTIONS (as arguments)
         - units: radians (rad) or degrees (deg)
         - domain: -180 to 180 º or 0 to 360º
+        - box: box dimensions. If given, the minimum image convention is applied to the bonds
     """
 
-    a = mdadist.calc_angles(sel1, sel2, sel3, backend="OpenMP")
+    a = mdadist.calc_angles(
+        sel1.positions, sel2.positions, sel3.positions, box=box, backend="OpenMP"
+    )
 
-    if units in ("rad", "radian", "radians", "pi"):
-        from math import pi
+    return float(convert_angle(a[0], units, domain))
 
-        if domain in (360, "360", "2pi"):
-            a = (a + pi) % pi
-            return float(a)
-        elif domain in (180, "180", "pi"):
-            return float(a)
 
-    elif units in ("deg", "degree", "degrees"):
-        from numpy import rad2deg
+def calc_distance_block(
+    coords1,  # Fxnx3 array, being F the number of frames and n the number of atoms of the first selection
+    coords2,  # Fxmx3 array, being F the number of frames and m the number of atoms of the second selection
+    type,  # [min | max | com | cog ]
+    masses1=None,  # n array, only needed for com
+    masses2=None,  # m array, only needed for com
+    box=None,  # box dimensions or Fx6 array. If given, the minimum image convention is applied
+):
+    """
+    DESCRIPTION
+        Block version of calc_distance. It takes the coordinates of both selections for a block of frames and returns
+        an array with the requested distance for each frame. If box is given, the selections are made whole before their
+        centers are computed.
+    """
 
-        a = rad2deg(a)
-        if domain in (360, "360", "2pi"):
-            a = (a + 360) % 360
-            return float(a)
-        elif domain in (180, "180", "pi"):
-            return float(a)
+    if type in ("min", "max"):
+        return calc_distance_reduction(coords1, coords2, type, box=box)
 
+    if box is not None:
+        coords1, coords2 = make_whole(coords1, box), make_whole(coords2, box)
 
-def calc_pka(
+    if type == "com":
+        vectors = center_block(coords1, masses1) - center_block(coords2, masses2)
+
+    elif type == "cog":
+        vectors = center_block(coords1) - center_block(coords2)
+
+    if box is not None:
+        vectors = minimum_image(vectors[:, None], box)[:, 0]
+
+    return norm(vectors, axis=1)
+
+
+def calc_distance_reduction(
+    coords1,  # nx3 array (one frame) or Fxnx3 array (stack of F frames)
+    coords2,  # mx3 array (one frame) or Fxmx3 array (stack of F frames)
+    type,  # [ min | max ]
+    box=None,  # None, box dimensions [lx, ly, lz, alpha, beta, gamma] or Fx6 array with the box of each frame
+    tile_size=None,  # number of atoms of coords1 whose distances are computed at once
+):
+    """
+    DESCRIPTION
+        Kernel that returns the minimum or maximum distance between two sets of coordinates (a float for one frame or an
+        array for a stack of frames) without building the full nxm distance matrix. coords1 is processed by tiles of
+        tile_size atoms that reuse a small buffer, which is reduced before computing the next tile. If box is given, the
+        minimum image convention is applied.
+    """
+
+    single = coords1.ndim == 2
+    if single:
+        coords1, coords2 = coords1[None], coords2[None]
+
+    n_frames, n_atoms1, n_atoms2 = len(coords1), coords1.shape[1], coords2.shape[1]
+
+    # by default, tiles of ~512 kB, so the buffer stays in cache
+    if tile_size is None:
+        tile_size = max(32, 65536 // max(n_atoms2, 1))
+    tile_size = max(1, min(tile_size, n_atoms1))
+
+    if box is not None:
+        box = asarray(box, dtype=float32)
+        if box.ndim == 1:
+            box = box[None].repeat(n_frames, axis=0)
+
+    buffer = empty((tile_size, n_atoms2))
+    d = empty(n_frames)
+
+    for f in range(n_frames):
+        value = inf if type == "min" else -inf
+        for start in range(0, n_atoms1, tile_size):
+            tile = coords1[f, start : start + tile_size]
+            distances = buffer[: len(tile)]
+            mdadist.distance_array(
+                tile,
+                coords2[f],
+                box=None if box is None else box[f],
+                result=distances,
+                backend="OpenMP",
+            )
+            if type == "min":
+                value = min(value, distances.min())
+            else:
+                value = max(value, distances.max())
+
+        d[f] = value
+
+    if single:
+        return float(d[0])
+
+    return d
+
+
+def calc_angle_block(coords1, coords2, coords3, units, domain, box=None):
+    """
+    DESCRIPTION
+        Block version of calc_angle. It takes the coordinates (Fx1x3 arrays) of the three atoms for a block of frames and
+        returns an array with the angle of each frame. If box (Fx6) is given, the atoms are moved to the periodic image
+        closest to the vertex.
+    """
+
+    if box is not None:
+        coords1 = coords2 + minimum_image(coords1 - coords2, box)
+        coords3 = coords2 + minimum_image(coords3 - coords2, box)
+
+    a = mdadist.calc_angles(
+        coords1[:, 0], coords2[:, 0], coords3[:, 0], backend="OpenMP"
+    )
+
+    return convert_angle(a, units, domain)
+
+
+def calc_dihedral_block(coords1, coords2, coords3, coords4, units, domain, box=None):
+    """
+    DESCRIPTION
+        Block version of calc_dihedral. It takes the coordinates (Fx1x3 arrays) of the four atoms for a block of frames and
+        returns an array with the dihedral angle of each frame. If box (Fx6) is given, each atom is moved to the periodic
+        image closest to the previous one.
+    """
+
+    if box is not None:
+        coords1 = coords2 + minimum_image(coords1 - coords2, box)
+        coords3 = coords2 + minimum_image(coords3 - coords2, box)
+        coords4 = coords3 + minimum_image(coords4 - coords3, box)
+
+    d = mdadist.calc_dihedrals(
+        coords1[:, 0], coords2[:, 0], coords3[:, 0], coords4[:, 0], backend="OpenMP"
+    )
+
+    return convert_angle(d, units, domain)
+
+
+def write_pka_input(
     sel_protein,  # whole protein AtomGroup for saving PDB
-    # sel_pka=None,           # optional selection for checking only the pKa of the selected resids
-    pka_ref="neutral",
     pdb_folder=".propka",  # folder to store files
     frame="current",
+):
+    """
+    DESCRIPTION
+        Function that saves the current coordinates of the protein as a PDB with a unique name inside pdb_folder and returns
+        its path. The name starts with the frame label, so files from different frames (or processes) never collide.
+    """
+
+    fd, pdb = mkstemp(prefix=f"{frame}_", suffix=".pdb", dir=pdb_folder)
+    close(fd)
+    sel_protein.write(pdb)
+
+    return pdb
+
+
+def predict_pka(
+    pdb,  # path of the PDB file to predict
+    pka_ref="neutral",
     keep_pdb=False,
     keep_pka=False,
 ):
+    """
+    DESCRIPTION
+        Function that runs PROPKA on a PDB file and parses the resulting .pka file. PROPKA is executed inside the PDB's
+        folder without changing the working directory of the process, so it can be called concurrently from several threads.
+    """
 
-    # save pdb
-    chdir(pdb_folder)
-    sel_protein.write(f"{frame}.pdb")
+    folder, filename = path.split(path.abspath(pdb))
+    pka_file = path.splitext(path.abspath(pdb))[0] + ".pka"
 
     # predict pKa with PROpKa
     run_command(
@@ -207,12 +448,14 @@ def calc_pka(
             "propka3",
             "-r",
             pka_ref,
-            f"{frame}.pdb",
-        ]
+            filename,
+        ],
+        cwd=folder,
     )
 
     # read .pka file
-    f = open(f"{frame}.pka").readlines()
+    with open(pka_file) as handle:
+        f = handle.readlines()
 
     # parse .pka file
     save_pka = False
@@ -237,23 +480,40 @@ def calc_pka(
 
     # remove PDBs if indicated
     if not keep_pdb:
-        remove(f"{frame}.pdb")
+        remove(pdb)
 
     # remove .pKas if indicated
     if not keep_pka:
-        remove(f"{frame}.pka")
-
-    chdir("..")
+        remove(pka_file)
 
     return pkas
 
 
+def calc_pka(
+    sel_protein,  # whole protein AtomGroup for saving PDB
+    # sel_pka=None,           # optional selection for checking only the pKa of the selected resids
+    pka_ref="neutral",
+    pdb_folder=".propka",  # folder to store files
+    frame="current",
+    keep_pdb=False,
+    keep_pka=False,
+):
+
+    return predict_pka(
+        write_pka_input(sel_protein, pdb_folder, frame),
+        pka_ref=pka_ref,
+        keep_pdb=keep_pdb,
+        keep_pka=keep_pka,
+    )
+
+
 def calc_contacts_selection(
     sel,
     sel_env,
     interactions,
     measure_distances=False,
     out_format="new",
+    box=None,
 ):
 
     residues = []
@@ -274,7 +534,9 @@ def calc_contacts_selection(
                 elif out_format == "new":
                     if measure_distances:
                         contacts[residues[r]["name"] + str(residues[r]["id"])] = (
-                            calc_distance(sel, sel_env.residues[r].atoms, type="min")
+                            calc_distance(
+                                sel, sel_env.residues[r].atoms, type="min", box=box
+                            )
                         )
                     elif not measure_distances:
                         contacts[residues[r]["name"] + str(residues[r]["id"])] = None
@@ -282,66 +544,91 @@ def calc_contacts_selection(
     return contacts
 
 
-def calc_contacts_protein(
-    sel, sel_env, interactions, measure_distances=False, out_format="new"
-):
+def calc_contacts_protein_pairs(sel, sel_env, interactions, box=None):
+    """
+    DESCRIPTION
+        Function that finds the pairs of contacting residues of sel within sel_env (radius in ang). All the atom pairs within
+        the radius are found with a single neighbour search per frame and reduced to the minimum distance of each pair of
+        residues. As with the around selections, contacts are searched across the box edges if the system has a box, while
+        the minimum image convention is only applied to the distances if box is given (pbc option).
+
+    OUTPUT
+        - Three arrays with the residue index of each residue, the residue index of its contacting residue and their minimum
+            distance. Pairs are sorted by residue index and contacting residue index.
+    """
 
-    contacts = {}
+    resindices = sel.resindices
+    resids = sel.universe.residues.resids
+    resnames = sel.universe.residues.resnames
+    positions = sel.positions
 
-    protein_residues = [
-        "ARG",
-        "HIS",
-        "HID",
-        "HIE",
-        "HIP",
-        "HSD",
-        "HSE",
-        "HSP",
-        "LYS",
-        "ASP",
-        "ASH",
-        "GLU",
-        "GLH",
-        "SER",
-        "THR",
-        "ASN",
-        "GLN",
-        "CYS",
-        "SEC",
-        "GLY",
-        "PRO",
-        "ALA",
-        "ILE",
-        "LEU",
-        "MET",
-        "PHE",
-        "TRP",
-        "TYR",
-        "VAL",
-    ]
+    pairs, distances = mdadist.self_capped_distance(
+        positions, max_cutoff=sel_env, box=sel.dimensions, return_distances=True
+    )
+    if box is None and sel.dimensions is not None:
+        distances = norm(positions[pairs[:, 0]] - positions[pairs[:, 1]], axis=1)
 
-    #    for residue in sel.atoms.select_atoms('protein').residues:
-    for residue in sel.residues:
-        # if residue.resname not in protein_residues:
-        # if the residue does not belong to the protein, skip it
-        #    continue
+    # keep pairs between different residues in both directions (residue of reference, residue of environment)
+    ref = concatenate([resindices[pairs[:, 0]], resindices[pairs[:, 1]]])
+    env = concatenate([resindices[pairs[:, 1]], resindices[pairs[:, 0]]])
+    distances = concatenate([distances, distances])
 
-        residue_env = sel.atoms.select_atoms(
-            f"around {sel_env} group select", select=residue.atoms
-        )
+    # residues whose number is equal to the reference residue index are skipped, as done with the per-residue engine
+    mask = (ref != env) & (resids[env] != ref) & isin(resnames[env], interactions)
+    ref, env, distances = ref[mask], env[mask], distances[mask]
+
+    # minimum distance of each pair of residues
+    order = lexsort((distances, env, ref))
+    ref, env, distances = ref[order], env[order], distances[order]
+    first = ones(len(ref), dtype=bool)
+    first[1:] = (ref[1:] != ref[:-1]) | (env[1:] != env[:-1])
+    ref, env, distances = ref[first], env[first], distances[first]
+
+    # residues only in contact across the box edges are measured between all their atoms without minimum image
+    for pair in flatnonzero(distances > sel_env):
+        distances[pair] = mdadist.distance_array(
+            positions[resindices == ref[pair]], positions[resindices == env[pair]]
+        ).min()
+
+    return ref, env, distances
+
+
+def calc_contacts_protein(
+    sel, sel_env, interactions, measure_distances=False, out_format="new", box=None
+):
+    """
+    DESCRIPTION
+        Function that finds the contacts of each residue of sel with the other residues of sel within sel_env (radius in ang)
+        using calc_contacts_protein_pairs. The minimum image convention is applied to the distances if box is given.
 
-        contacts[residue.resname + str(residue.resid)] = calc_contacts_selection(
-            sel=residue.atoms,
-            sel_env=residue_env,
-            interactions=interactions,
-            measure_distances=measure_distances,
-            out_format=out_format,
+    OUTPUT
+        - Dictionary containing each residue of sel as key and a dictionary of its contacting residues (as keys) and their
+            minimum distance (or None if measure_distances is False) as value.
+    """
+
+    residues = sel.residues
+    labels = {
+        resindex: resname + str(resid)
+        for resindex, resname, resid in zip(
+            residues.resindices, residues.resnames, residues.resids
         )
+    }
+    contacts = {labels[resindex]: {} for resindex in residues.resindices}
+
+    for r, e, d in zip(
+        *calc_contacts_protein_pairs(sel, sel_env, interactions, box=box)
+    ):
+        contacts[labels[r]][labels[e]] = float(d) if measure_distances else None
 
     return contacts
 
 
-def calc_RMSD(sel, ref, superposition):
+def calc_RMSD(sel, ref, superposition, box=None):
+
+    if box is not None:
+        return float(
+            calc_RMSD_block(sel.positions[None], ref, superposition, sel.masses, box)[0]
+        )
 
     if superposition:
         rmsd = rms.rmsd(
@@ -357,45 +644,425 @@ def calc_RMSD(sel, ref, superposition):
     return float(rmsd)
 
 
+def calc_RMSD_block(
+    coords,  # Fxnx3 array, being F the number of frames and n the number of atoms
+    ref,  # nx3 array with the reference centered on its center of mass
+    superposition,  # [ True | False ]
+    masses,  # n array
+    box=None,  # Fx6 array with the box dimensions of each frame. If given, the selection is made whole first
+    ref_centered=None,  # nx3 array with the reference centered on its center of geometry (superposition)
+    ref_inner=None,  # sum of the squared coordinates of ref_centered (superposition)
+    rotations=False,  # also return the rotation matrices (superposition)
+):
+    """
+    DESCRIPTION
+        Block version of calc_RMSD. It takes the coordinates (Fxnx3 array) of the selection for a block of frames, centers
+        them all at once and returns an array with the RMSD of each frame against the reference. With superposition, the
+        optimal rotation of all the frames is found at once by calc_superposition_RMSD_block (ref_centered and ref_inner
+        can be precomputed, see add_RMSD) and, if rotations is True, a Fx3x3 array with the rotation matrices is also
+        returned.
+    """
+
+    if box is not None:
+        coords = make_whole(coords, box)
+
+    if superposition:
+        if ref_centered is None:
+            ref_centered = ref - ref.mean(axis=0)
+
+        return calc_superposition_RMSD_block(
+            coords, ref_centered, ref_inner=ref_inner, rotations=rotations
+        )
+
+    coords = coords - center_block(coords, masses)[:, None, :]
+
+    return npsqrt(((coords - ref) ** 2).sum(axis=(1, 2)) / coords.shape[1])
+
+
+def calc_superposition_RMSD_block(
+    coords,  # Fxnx3 array, being F the number of frames and n the number of atoms
+    ref,  # nx3 array with the reference centered on its center of geometry
+    ref_inner=None,  # sum of the squared coordinates of ref
+    rotations=False,  # also return the rotation matrices
+):
+    """
+    DESCRIPTION
+        Kernel that returns the RMSD of each frame after its optimal superposition (Kabsch) onto the reference, as
+        MDAnalysis' rms.rmsd(center=True, superposition=True) does for a single frame. The 3x3 correlation matrices of all
+        the frames are computed with one einsum and decomposed with one batched SVD, and the RMSD is obtained from their
+        singular values, so the rotated coordinates are never built. If rotations is True, it also returns the Fx3x3
+        rotation matrices R that superpose each centered frame onto the reference (centered_coords @ R).
+    """
+
+    coords = coords.astype(float64)
+    coords -= coords.mean(axis=1, keepdims=True)
+
+    if ref_inner is None:
+        ref_inner = einsum("ij,ij->", ref, ref)
+
+    U, S, Vt = svd(einsum("fni,nj->fij", coords, ref))
+
+    # reflections are avoided by changing the sign of the smallest singular value
+    sign = npsign(det(U @ Vt))
+    S[:, 2] *= sign
+
+    inner = einsum("fni,fni->f", coords, coords) + ref_inner
+    rmsd = npsqrt((inner - 2 * S.sum(axis=1)).clip(0) / coords.shape[1])
+
+    if not rotations:
+        return rmsd
+
+    U[:, :, 2] *= sign[:, None]
+
+    return rmsd, U @ Vt
+
+
+def calc_pairwise_RMSD_tile(
+    coords_a,  # axnx3 array with the centered coordinates of a frames
+    coords_b,  # bxnx3 array with the centered coordinates of b frames
+    superposition,  # [ True | False ]
+):
+    """
+    DESCRIPTION
+        Kernel that returns the axb matrix with the RMSD between each frame of coords_a and each frame of coords_b. With
+        superposition, the RMSD after the optimal superposition is obtained from the singular values of the 3x3
+        correlation matrix of each pair of frames (the sign of the smallest one is changed if it would be a reflection).
+    """
+
+    coords_a, coords_b = coords_a.astype(float64), coords_b.astype(float64)
+
+    inner = (
+        einsum("ani,ani->a", coords_a, coords_a)[:, None]
+        + einsum("bni,bni->b", coords_b, coords_b)[None, :]
+    )
+
+    if superposition:
+        correlation = einsum("ani,bnj->abij", coords_a, coords_b)
+        S = svd(correlation, compute_uv=False)
+        S[..., 2] *= npsign(det(correlation))
+        overlap = S.sum(axis=-1)
+
+    else:
+        overlap = einsum("ani,bni->ab", coords_a, coords_b)
+
+    return npsqrt((inner - 2 * overlap).clip(0) / coords_a.shape[1])
+
+
+def calc_pairwise_RMSD_matrix(
+    coords,  # Fxnx3 array with the centered coordinates of each frame
+    superposition,  # [ True | False ]
+    tile_size=500,  # number of frames of each side of a tile
+    n_workers=1,  # number of processes among which the tiles are split
+    matrix_file=None,  # if given, the matrix is written to this file as a memory map
+):
+    """
+    DESCRIPTION
+        Function that returns the FxF matrix with the RMSD between each pair of frames. The upper triangle of the matrix is
+        computed by tiles of tile_size x tile_size frames (so memory is bounded by the tile size) that are mirrored into
+        the lower triangle. Tiles can be computed in several processes, and only 2 tiles per process are submitted at the
+        same time. If matrix_file is given, the matrix (float32) is a memory map stored in that file, so matrices larger
+        than the memory can be built.
+    """
+
+    n_frames = len(coords)
+
+    if matrix_file is None:
+        matrix = empty((n_frames, n_frames), dtype=float32)
+    else:
+        matrix = open_memmap(
+            matrix_file, mode="w+", dtype=float32, shape=(n_frames, n_frames)
+        )
+
+    starts = range(0, n_frames, tile_size)
+    tiles = [(i, j) for i in starts for j in starts if j >= i]
+
+    def store(i, j, tile):
+        matrix[i : i + tile_size, j : j + tile_size] = tile
+        matrix[j : j + tile_size, i : i + tile_size] = tile.T
+
+    if n_workers <= 1:
+        for i, j in tiles:
+            store(
+                i,
+                j,
+                calc_pairwise_RMSD_tile(
+                    coords[i : i + tile_size], coords[j : j + tile_size], superposition
+                ),
+            )
+
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            pending = {}
+            tiles = iter(tiles)
+
+            for i, j in tiles:
+                pending[
+                    executor.submit(
+                        calc_pairwise_RMSD_tile,
+                        coords[i : i + tile_size],
+                        coords[j : j + tile_size],
+                        superposition,
+                    )
+                ] = (i, j)
+
+                # tiles are submitted as the previous ones are finished, so the queue is bounded
+                while len(pending) >= 2 * n_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        store(*pending.pop(future), future.result())
+
+            for future in as_completed(pending):
+                store(*pending[future], future.result())
+
+    if matrix_file is not None:
+        matrix.flush()
+
+    return matrix
+
+
+def calc_kmedoids(
+    matrix,  # FxF distance matrix (array or memory map)
+    n_clusters,  # number of clusters
+    max_iter=100,  # maximum number of iterations
+    seed=0,  # seed of the random initialisation
+    chunk_size=1024,  # number of rows of the matrix read at once
+):
+    """
+    DESCRIPTION
+        k-medoids clustering (alternating assignment and medoid update) of a distance matrix, which is only read by blocks
+        of rows, so it works with memory-mapped matrices. Medoids are initialised with k-medoids++.
+
+    OUTPUT
+        - Array with the cluster of each frame
+        - Sorted list with the index of the medoid of each cluster
+    """
+
+    n_frames = len(matrix)
+    rng = default_rng(seed)
+
+    # k-medoids++: each new medoid is chosen with probability proportional to the squared distance to the closest one
+    medoids = [int(rng.integers(n_frames))]
+    closest = asarray(matrix[medoids[0]], dtype=float64)
+    for _ in range(1, min(n_clusters, n_frames)):
+        weights = closest**2
+        if weights.sum() == 0:
+            break
+        medoids.append(int(rng.choice(n_frames, p=weights / weights.sum())))
+        closest = minimum(closest, matrix[medoids[-1]])
+    medoids = sorted(medoids)
+
+    for _ in range(max_iter):
+        labels = argmin(asarray(matrix[medoids]), axis=0)
+
+        # the new medoid of each cluster is the member with the smallest sum of distances to the other members
+        new_medoids = []
+        for cluster, medoid in enumerate(medoids):
+            members = (labels == cluster).nonzero()[0]
+            if len(members) == 0:
+                new_medoids.append(medoid)
+                continue
+
+            costs = empty(len(members))
+            for start in range(0, len(members), chunk_size):
+                rows = asarray(matrix[members[start : start + chunk_size]])
+                costs[start : start + chunk_size] = rows[:, members].sum(axis=1)
+            new_medoids.append(int(members[argmin(costs)]))
+
+        new_medoids = sorted(new_medoids)
+        if new_medoids == medoids:
+            break
+        medoids = new_medoids
+
+    labels = argmin(asarray(matrix[medoids]), axis=0)
+
+    return labels, medoids
+
+
 def calc_distWATbridge(
     sel1,
     sel2,
-    sel1_env,
-    sel2_env,
-    sel1_rad,
-    sel2_rad,
+    water,
+    sel1_rad=3,
+    sel2_rad=3,
+    box=None,
+    top=1,
+    two_water=False,
+    water_rad=3.5,
 ):
+    """
+    DESCRIPTION
+        Function that takes two selections and the water atoms and returns the bridging waters between both selections for
+        the current frame. See calc_water_bridges.
+    """
 
-    if ("WAT" not in sel1_env.resnames or "WAT" not in sel2_env.resnames) or (
-        len(set(sel1_env.resids) & set(sel2_env.resids)) == 0
-    ):
-        # No WAT in one or both selections' environment
-        return [None, None, None]
+    return calc_water_bridges(
+        sel1.positions,
+        sel2.positions,
+        water.positions,
+        water.resids,
+        sel1_rad,
+        sel2_rad,
+        box=box,
+        top=top,
+        two_water=two_water,
+        water_rad=water_rad,
+    )
+
+
+def nearest_waters(coords, water_coords, radius, box=None):
+    """
+    DESCRIPTION
+        Function that returns the minimum distance from a set of coordinates to each water atom, searching only the pairs
+        closer than radius (inf for the waters farther than radius).
+    """
+
+    pairs, distances = mdadist.capped_distance(
+        coords, water_coords, max_cutoff=radius, box=box, return_distances=True
+    )
+
+    nearest = full(len(water_coords), inf)
+    minimum.at(nearest, pairs[:, 1], distances)
+
+    return nearest
+
+
+def calc_water_bridges(
+    coords1,
+    coords2,
+    water_coords,
+    water_resids,
+    sel1_rad=3,
+    sel2_rad=3,
+    box=None,
+    top=1,
+    two_water=False,
+    water_rad=3.5,
+):
+    """
+    DESCRIPTION
+        Function that finds the waters bridging two sets of atoms with one neighbour search per set over all the water
+        atoms. The distance of a water to each set is the minimum distance of any of its atoms (grouped by water_resids).
+        A water bridges both sets if it is closer than sel1_rad to the first one and closer than sel2_rad to the second
+        one, and bridges are ranked by the average of both (minimum) distances.
+
+    OPTIONS
+        - box:          box dimensions. If given, the minimum image convention is applied
+        - top:          number of bridging waters returned. Default is 1.
+        - two_water:    also look for bridges of two waters (one close to each set, closer than water_rad to each other)
+        - water_rad:    maximum distance between the waters of a two-water bridge. Default is 3.5.
+
+    OUTPUT
+        - [resid, distance to coords1, distance to coords2] of the best bridging water ([None, None, None] if there is no
+            bridge), or a list with the top ones (padded with [None, None, None]) if top > 1
+        - If two_water, [resid 1, resid 2, distance from coords1 to water 1, distance between waters, distance from water
+            2 to coords2] of the best two-water bridge (None values if there is not), as second output
+    """
+
+    # distances of each water residue are the minimum distances of its atoms
+    residues, inverse = unique(water_resids, return_inverse=True)
+    dist1 = full(len(residues), inf)
+    dist2 = full(len(residues), inf)
+    minimum.at(dist1, inverse, nearest_waters(coords1, water_coords, sel1_rad, box=box))
+    minimum.at(dist2, inverse, nearest_waters(coords2, water_coords, sel2_rad, box=box))
+
+    bridging = flatnonzero(isfinite(dist1) & isfinite(dist2))
+    bridging = bridging[argsort((dist1 + dist2)[bridging] / 2, kind="stable")][:top]
+
+    bridges = [[int(residues[w]), float(dist1[w]), float(dist2[w])] for w in bridging]
+    bridges += [[None, None, None]] * (top - len(bridges))
+    bridges = bridges[0] if top == 1 else bridges
+
+    if not two_water:
+        return bridges
+
+    # atoms of the waters close to each set are paired by a neighbour search between both groups
+    near1 = flatnonzero(isfinite(dist1[inverse]))
+    near2 = flatnonzero(isfinite(dist2[inverse]))
+    pairs, distances = mdadist.capped_distance(
+        water_coords[near1],
+        water_coords[near2],
+        max_cutoff=water_rad,
+        box=box,
+        return_distances=True,
+    )
+    first, second = inverse[near1[pairs[:, 0]]], inverse[near2[pairs[:, 1]]]
+    different = first != second
+    first, second, distances = first[different], second[different], distances[different]
+
+    if len(distances) == 0:
+        return bridges, [None] * 5
+
+    best = argmin((dist1[first] + distances + dist2[second]) / 3)
+    return bridges, [
+        int(residues[first[best]]),
+        int(residues[second[best]]),
+        float(dist1[first[best]]),
+        float(distances[best]),
+        float(dist2[second[best]]),
+    ]
+
+
+def calc_hbonds(
+    donors,
+    hydrogens,
+    acceptors,
+    d_a_cutoff=3.0,
+    angle_cutoff=150,
+    box=None,
+):
+    """
+    DESCRIPTION
+        Function that finds the hydrogen bonds of a frame in a single vectorised pass. Donor-acceptor pairs closer than
+        d_a_cutoff are found with one neighbour search, and those whose donor-hydrogen-acceptor angle is at least
+        angle_cutoff are kept.
+
+    INPUT
+        - donors:       nx3 coordinates of the donor atom of each donor-hydrogen pair
+        - hydrogens:    nx3 coordinates of the hydrogen of each donor-hydrogen pair
+        - acceptors:    mx3 coordinates of the acceptor atoms
+
+    OPTIONS
+        - d_a_cutoff:   maximum donor-acceptor distance (in ang). Default is 3.0.
+        - angle_cutoff: minimum donor-hydrogen-acceptor angle (in degrees). Default is 150.
+        - box:          box dimensions. If given, the minimum image convention is applied
+
+    OUTPUT
+        - Array with the donor-hydrogen pair index of each hydrogen bond
+        - Array with the acceptor index of each hydrogen bond
+        - Array with the donor-acceptor distance of each hydrogen bond
+        - Array with the donor-hydrogen-acceptor angle (in degrees) of each hydrogen bond
+    """
 
-    else:  # WAT residues in both environments and at least one of them coincident
-        WATs = [set(sel1_env.resids) & set(sel1_env.resids)]
+    pairs, distances = mdadist.capped_distance(
+        donors, acceptors, max_cutoff=d_a_cutoff, box=box, return_distances=True
+    )
+    pair, acceptor = pairs[:, 0], pairs[:, 1]
 
-        for wat in WATs:
-            selWAT = sel1_env.select_atoms(f"resid {wat}")
+    angles = rad2deg(
+        mdadist.calc_angles(donors[pair], hydrogens[pair], acceptors[acceptor], box=box)
+    )
+    hbonds = angles >= angle_cutoff
 
-            dist1_ = calc_distance(sel1, selWAT)
-            dist2_ = calc_distance(sel2, selWAT)
+    return pair[hbonds], acceptor[hbonds], distances[hbonds], angles[hbonds]
 
-            if dist1_ <= sel1_rad and dist2_ <= sel2_rad:
 
-                try:
-                    if (dist1_ + dist2_) / 2 < (dist1 + dist2) / 2:
-                        # Closest WAT is the one with the shortest average distance to both of the sels
-                        dist1, dist2 = dist1_, dist2_
-                        closestWAT = wat
+def guess_hydrogen_donors(hydrogens, donors, cutoff=1.2, box=None):
+    """
+    DESCRIPTION
+        Function that assigns to each hydrogen the closest donor atom within cutoff (in ang), used when the topology has no
+        bonds.
 
-                    else:
-                        pass
+    OUTPUT
+        - Array with the index (in donors) of the donor of each hydrogen, or -1 if there is no donor within cutoff
+    """
 
-                except NameError:
-                    dist1, dist2 = dist1_, dist2_
-                    closestWAT = wat
+    pairs, distances = mdadist.capped_distance(
+        hydrogens, donors, max_cutoff=cutoff, box=box, return_distances=True
+    )
 
-        selWAT = sel1_env.select_atoms(f"resid {closestWAT}")
+    # the closest donor of each hydrogen is the last one after sorting by hydrogen and descending distance
+    order = lexsort((-distances, pairs[:, 0]))
+    donor = full(len(hydrogens), -1)
+    donor[pairs[order, 0]] = pairs[order, 1]
 
-        return [closestWAT, calc_distance(sel1, selWAT), calc_distance(sel2, selWAT)]
+    return donor
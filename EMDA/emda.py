@@ -1,5 +1,6 @@
 from dataclasses import dataclass, field, is_dataclass
 import pickle
+from os import path
 
 from typing import Literal
 
@@ -17,13 +18,14 @@ from .adders import *
 from .runners import *
 from .analysers import *
 from .plotters import *
+from .results import ContactsResult
+from .store import get_store_kind, write_store, read_store, read_pickled_measure
+from .registry import MEASURE_TYPES
 
 # from .tools import in_notebook
 
 # load custom exceptions
-from .exceptions import EmptyMeasuresError
-
-from tqdm.autonotebook import tqdm
+from .exceptions import EmptyMeasuresError, NotCheckpointError, NotKnownFramesError
 
 # from metaclass import add_adders
 # class EMDA(metaclass=add_adders):
@@ -48,6 +50,8 @@ class EMDA:
             - selections:   Dictionary containing as key the name (ID) of a selection and the MDAnalysis AtomGroup object as value
             - measures:     Dictionary containing as key the name (ID) of a measure and the EMDA's Measure object as value
             - analyses:     Dictionary containing as key the name (ID) of an analysis and the EMDA's Analysis object as value
+            - dynamic_selections: Dictionary with the updating selections (environments) created by the adders, so
+                            measures with the same environment share it
 
 
         METHODS:
@@ -66,6 +70,7 @@ class EMDA:
         self.selections = {}
         self.measures = {}
         self.analyses = {}
+        self.dynamic_selections = {}
 
         # Automatically add all imported functions from adders.py and from analysers.py as EMDA methods
         external_functions = [
@@ -87,6 +92,11 @@ class EMDA:
         for func_name in external_functions:
             setattr(EMDA, func_name, globals()[func_name])
 
+        # Adders of registered measure types (see registry.py), so types registered outside EMDA are available
+        for measure_type in MEASURE_TYPES.values():
+            if measure_type.adder is not None:
+                setattr(EMDA, measure_type.adder.__name__, measure_type.adder)
+
     @dataclass
     class Measure:
         """
@@ -98,7 +108,11 @@ class EMDA:
             - type:     Type of the measure (distance, angle, dihedral, planar_angle, RMSD, and contacts are currently available)
             - sel:      Selections related to the measure as AtomGroups
             - options:  Empty dictionary containing different options to set the measure calculation
-            - result:   List containing the measured results.
+            - result:   List containing the measured results (or a ContactsResult for contacts measures with the new out_format).
+            - frames:   List containing the trajectory frame index of each result.
+            - sink:     Optional sink (see sinks.py) where results are streamed during run. If None, results are kept in memory.
+            - aux:      Dictionary with auxiliary per-frame outputs (i.e. RMSD rotation matrices) as lists parallel to result.
+                        They are kept in memory and not streamed to the sink, so they cover all the frames of the run.
 
         METHODS:
             - plot:     Creates a simple plot of the calculated measures. Only available for distance, angle, dihedral, planar_angle, and RMSD types
@@ -109,6 +123,9 @@ class EMDA:
         sel: list
         options: dict
         result: list
+        frames: list = field(default_factory=list)
+        sink: object = None
+        aux: dict = field(default_factory=dict)
 
         def __str__(self) -> str:
             if len(self.result) == 0:
@@ -127,6 +144,29 @@ class EMDA:
         def __repr__(self):
             return self.__str__()
 
+        def reset_result(self):
+            """
+            DESCRIPTION:
+                Measure's method to empty the result, frames and aux attributes keeping the result's container type (i.e. ContactsResult).
+            """
+
+            self.clear_result()
+            self.aux = {key: [] for key in self.aux}
+
+        def clear_result(self):
+            """
+            DESCRIPTION:
+                Measure's method to empty the result and frames attributes keeping the result's container type and the aux
+                attribute. It is called by the sinks after each flush.
+            """
+
+            if isinstance(self.result, ContactsResult):
+                self.result = self.result.empty()
+            else:
+                self.result = []
+
+            self.frames = []
+
         def plot(self):
             """
             DESCRIPTION:
@@ -217,6 +257,21 @@ class EMDA:
             return_atomic_sel_string=return_atomic_sel_string,
         )
 
+    def load_trajectory(self, trajectory):
+        """
+        DESCRIPTION:
+            Method for replacing the trajectory of the universe (i.e. by the list of files extended with new production
+            segments). Selections, measures and their results are kept, so a run with incremental=True only computes the
+            new frames.
+
+        INPUT:
+            - trajectory:   name or list of names of the trajectory file(s)
+        """
+
+        self.trajectory = trajectory
+        self.universe.load_new(trajectory)
+        print("Trajectory has been loaded!")
+
     def print_available_adders(self):
         """
         DESCRIPTION:
@@ -277,6 +332,16 @@ class EMDA:
         step=1,
         start=1,
         end=-1,
+        block_size=100,
+        n_workers=1,
+        flush_every=1000,
+        checkpoint=None,
+        resume=False,
+        executor=None,
+        retries=2,
+        incremental=False,
+        prefetch=0,
+        timeout=None,
     ):
         """
         DESCRIPTION:
@@ -290,6 +355,30 @@ class EMDA:
             - step:         Frames to jump during the analysis. Default is 1, so all the trajectory will be analysed.
             - start:        First frame to start the analysis. Default is 0.
             - end:          Last frame to analyse (included). Default is last frame of trajectory.
+            - block_size:   Number of frames whose coordinates are read before computing distance, angle, dihedral and RMSD
+                            measures all at once. Default is 100. Use 1 to compute them frame by frame.
+            - n_workers:    Number of processes among which the frames are split. Each process reopens the trajectory and
+                            computes a contiguous chunk of frames. Default is 1 (serial run).
+            - flush_every:  Number of frames after which the results of the measures with a sink (see set_sink) are flushed
+                            out of memory and the checkpoint is written. Default is 1000.
+            - checkpoint:   Path of a file where the partial results and the last completed frame are saved every flush_every
+                            frames, so an interrupted run can be resumed. Each save only appends the results computed since
+                            the previous one. Default is None (no checkpoint).
+            - resume:       [True | False | str] Restore the partial results of the checkpoint (or of the given checkpoint
+                            path) and compute the remaining frames with the start, end and step of the interrupted run.
+                            exclude, run_only, recalculate, step, start and end are ignored.
+            - executor:     Executor (see executors.py) where the chunks of frames are submitted as tasks instead of a local
+                            pool of processes. Frames are split into n_workers chunks (or chunks of flush_every frames).
+            - retries:      Number of times a chunk of frames whose task fails is submitted again. Default is 2.
+            - timeout:      Maximum number of seconds waited for the result of each chunk of frames. A chunk that is not
+                            finished in time (i.e. its worker was killed) is submitted again. Default is None (no limit).
+            - incremental:  [True | False] Compute only the frames that each measure does not cover yet (in its frames
+                            attribute or flushed to its sink), so measures already calculated are extended to the new
+                            frames (i.e. after load_trajectory) and new measures are calculated in all of them. Each
+                            frame is read once for all the measures that miss it. Default is False.
+            - prefetch:     Number of frames read ahead by a background thread while the measures of the current frame are
+                            computed, so disk I/O (i.e. on network storage) overlaps with the calculations. Default is 0
+                            (each frame is read when it is needed).
         """
 
         # Check that there is at least one measure set
@@ -300,6 +389,56 @@ class EMDA:
         if end == -1:
             end = len(self.universe.trajectory)
 
+        # If the run is resumed, the measures and frames left are those of the checkpoint.
+        if resume:
+            if isinstance(resume, str):
+                checkpoint = resume
+            if checkpoint is None:
+                raise NotCheckpointError
+            measures, first, end, step = read_checkpoint(checkpoint, self.measures)
+            start = first + 1
+
+        else:
+            measures = self._select_measures(
+                exclude, run_only, recalculate, incremental
+            )
+
+        # the checkpoint is written after each flush as on_flush(last_frame)
+        if checkpoint is not None:
+            on_flush = CheckpointWriter(
+                checkpoint,
+                [self.measures[measure] for measure in measures],
+                end=end,
+                step=step,
+            )
+        else:
+            on_flush = None
+
+        # trajectory cycle. In incremental (and resumed) runs, frames already covered by a measure are skipped.
+        run_trajectory(
+            self.universe,
+            [self.measures[measure] for measure in measures],
+            start - 1,
+            end,
+            step,
+            incremental=bool(resume or incremental),
+            n_workers=n_workers,
+            block_size=block_size,
+            flush_every=flush_every,
+            on_flush=on_flush,
+            executor=executor,
+            retries=retries,
+            prefetch=prefetch,
+            timeout=timeout,
+        )
+
+    def _select_measures(self, exclude, run_only, recalculate, incremental=False):
+        """
+        DESCRIPTION:
+            Returns the set of names of the measures to compute in run, resetting those that have to be recalculated.
+            In incremental runs, precalculated measures are kept (not excluded), so their missing frames are computed.
+        """
+
         # Convert exclude to list to append precalculated measures if recalculate is False.
         ## If it is True, set measure's result as empty list, so it is overwritten.
         ## If a measure or list of measures is given, their result list will be reset as [].
@@ -312,16 +451,23 @@ class EMDA:
             recalculate = [recalculate]
 
         for measure in list(self.measures.keys()):
-            if len(self.measures[measure].result) > 0:
+            sink = self.measures[measure].sink
+            if len(self.measures[measure].result) > 0 or (
+                sink is not None and len(sink.frames) > 0
+            ):
                 if isinstance(recalculate, bool):
                     if recalculate:
-                        self.measures[measure].result = []
-                    elif not recalculate:
+                        self.measures[measure].reset_result()
+                        if sink is not None:
+                            sink.reset()
+                    elif not incremental:
                         exclude.append(measure)
 
                 elif isinstance(recalculate, list):
                     if measure in recalculate:
-                        self.measures[measure].result = []
+                        self.measures[measure].reset_result()
+                        if sink is not None:
+                            sink.reset()
 
         # Check run_only. If run_only is used, the measure set will be the run_only list. Conversely, measures will be set as
         ## all measures except exclude (if none, it is converted to empty list in previous codeblock)
@@ -333,68 +479,44 @@ class EMDA:
         elif run_only == None:
             measures = set(set(self.measures.keys()) - set(exclude))
 
-        # trajectory cycle
-        first_cycle = True
-        for ts in tqdm(
-            self.universe.trajectory[start - 1 : end : step],
-            desc="Measuring",
-            unit="Frame",
-        ):
-
-            # measures cycle
+        # the frames left to compute are those missing from each measure's frames
+        if incremental:
             for measure in measures:
-                """
-                TO-DO:
-                    Look for an automatic way to run the proper runner depending on the type set in the Measure. \
-                    All runners should be named like run_${type_of_measure}, so maybe there is a chance to automate it.
-                """
-
-                if self.measures[measure].type == "distance":
-                    run_distance(self.measures[measure])
-
-                elif self.measures[measure].type == "angle":
-                    run_angle(self.measures[measure])
-
-                elif self.measures[measure].type == "dihedral":
-                    run_dihedral(self.measures[measure])
-
-                elif self.measures[measure].type == "planar_angle":
-                    run_planar_angle(self.measures[measure])
-
-                elif self.measures[measure].type == "contacts":
-                    run_contacts(self.measures[measure])
-
-                elif self.measures[measure].type == "RMSD":
-                    run_RMSD(self.measures[measure])
+                Measure = self.measures[measure]
+                if len(Measure.frames) != len(Measure.result):
+                    raise NotKnownFramesError(measure)
 
-                elif self.measures[measure].type == "distWATbridge":
-                    run_distWATbridge(self.measures[measure])
+        return measures
 
-                elif self.measures[measure].type == "pka":
-                    if first_cycle:
-                        check_folder(self.measures[measure].options["pdb_folder"])
-
-                    run_pka(self.measures[measure])
+    def set_sink(self, name, sink):
+        """
+        DESCRIPTION:
+            EMDA's method for attaching a sink (see sinks.py) to a measure, so its results are streamed out of memory during
+            run. Each measure needs its own sink. Use None to keep the results in memory again.
 
-                else:
-                    if first_cycle:
-                        print(
-                            f"The {measure} type is not available. If you need, you can create it."
-                        )
+        USAGE:
+            EMDA.set_sink('distance', ChunkedFileSink('distance.emda'))
+        """
 
-            if first_cycle:
-                first_cycle = False
+        self.measures[name].sink = sink
 
-    def save_result(self, name, out_name=None):
+    def save_result(self, name, out_name=None, format="emda"):
         """
         DESCRIPTION:
-            EMDA's method for saving into a pickle file the result attribute of a Measure class or an Analysis class.
-        """
+            EMDA's method for saving the result attribute of a Measure class or an Analysis class. Measures are saved in a
+            columnar store (a folder that can be partially read and appended, see store.py), while analyses and measures
+            that can not be stored in columns (i.e. old-format contacts) are saved into a pickle file.
 
-        if out_name == None:
-            out_name = name + ".pickle"
+        OPTIONS:
+            - out_name:     Name of the output file or folder. '_measure' or '_analysis' is added before its extension.
+            - format:       [ 'emda' | 'pickle' ] Format used for saving measures. Output names ending with .pickle or .pkl
+                            are always saved as pickle.
+        """
 
         if name in list(self.analyses.keys()):
+            if out_name == None:
+                out_name = name + ".pickle"
+
             with open(
                 ".".join(out_name.split(".")[:-1])
                 + "_analysis."
@@ -406,15 +528,34 @@ class EMDA:
             print(f"{name} analysis' result has been saved as {out_name}!")
 
         elif name in list(self.measures.keys()):
-            with open(
-                ".".join(out_name.split(".")[:-1])
-                + "_measure."
-                + out_name.split(".")[-1],
-                "wb",
-            ) as handle:
-                pickle.dump(self.measures[name].result, handle, protocol=2)
+            if out_name == None:
+                out_name = name + (".pickle" if format == "pickle" else ".emda")
+
+            if (
+                format == "pickle"
+                or out_name.split(".")[-1] in ("pickle", "pkl")
+                or get_store_kind(self.measures[name]) is None
+            ):
+                out_name = ".".join(out_name.split(".")[:-1]) + ".pickle"
+                with open(
+                    ".".join(out_name.split(".")[:-1])
+                    + "_measure."
+                    + out_name.split(".")[-1],
+                    "wb",
+                ) as handle:
+                    # the frames are pickled after the result, so the files can still be read as the result alone
+                    pickle.dump(self.measures[name].result, handle, protocol=2)
+                    pickle.dump(self.measures[name].frames, handle, protocol=2)
 
-            print(f"{name} analysis' result has been saved as {out_name}!")
+            else:
+                write_store(
+                    ".".join(out_name.split(".")[:-1])
+                    + "_measure."
+                    + out_name.split(".")[-1],
+                    self.measures[name],
+                )
+
+            print(f"{name} measure's result has been saved as {out_name}!")
 
         else:
             raise KeyError(f"{name} is not an available measure nor analysis.")
@@ -424,21 +565,43 @@ class EMDA:
         filename,
         name,
         type: Literal["d", "dataclass", "a", "analysis", "m", "measure"] = "dataclass",
+        start=None,
+        end=None,
     ):
         """
         DESCRIPTION:
-            EMDA's method for reading a pickle file containing the result attribute of a precreated Measure class or an Analysis class.
+            EMDA's method for reading a pickle file or a columnar store containing the result attribute of a precreated Measure
+            class or an Analysis class.
+
+        OPTIONS:
+            - start, end:   Only for columnar stores. Read only the results of the frames between start (included) and end
+                            (excluded), so a window of a large result can be loaded.
         """
 
-        if is_dataclass(name) and type.lower() in ["d", "dataclass"]:
-            with open(filename, "rb") as handle:
-                name.result = pickle.load(handle)
+        if path.isdir(filename):
+            result, frames = read_store(filename, start=start, end=end)
+
+            if is_dataclass(name) and type.lower() in ["d", "dataclass"]:
+                name.result, name.frames = result, frames
+
+            else:
+                try:
+                    self.measures[name].result = result
+                    self.measures[name].frames = frames
+
+                except KeyError:
+                    raise KeyError(f"{name} is not an available measure.")
+
+        elif is_dataclass(name) and type.lower() in ["d", "dataclass"]:
+            name.result, name.frames = read_pickled_measure(filename)
 
         else:
             try:
                 if type.lower() in ["m", "measure"]:
-                    with open(filename, "rb") as handle:
-                        self.measures[name].result = pickle.load(handle)
+                    (
+                        self.measures[name].result,
+                        self.measures[name].frames,
+                    ) = read_pickled_measure(filename)
 
                 if type.lower() in ["a", "analysis"]:
                     with open(filename, "rb") as handle:
@@ -0,0 +1,160 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from tqdm.autonotebook import tqdm
+
+from .emda import EMDA
+from .executors import LocalExecutor
+
+"""
+DESCRIPTION
+    This Python file contains the EMDAEnsemble class, which loads several variants (parameters and trajectories) and
+    replicas (trajectories of a variant) as one EMDA object per replica, so selections, measures and analyses are defined
+    once and applied to all of them.
+"""
+
+
+def run_member(member, kwargs):
+    """
+    DESCRIPTION:
+        Runs an EMDA object with the given run options and returns the result, frames, sink and aux of each of its measures. It
+        is the function executed by each worker of EMDAEnsemble.run, where the EMDA object arrives pickled, so the
+        trajectory is reopened in the worker process.
+    """
+
+    member.run(**kwargs)
+
+    return {
+        name: (Measure.result, Measure.frames, Measure.sink, Measure.aux)
+        for name, Measure in member.measures.items()
+    }
+
+
+class EMDAEnsemble:
+
+    def __init__(self, variants):
+        """
+        DESCRIPTION:
+            Function to initialise the EMDAEnsemble class by loading an EMDA object for each replica of each variant.
+
+        INPUT:
+            - variants:     Dictionary containing as key the name of the variant and as value a tuple with the parameters
+                            file and the replicas, given as a list of trajectories (named 1, 2, ...) or as a dictionary of
+                            replica name : trajectory. i.e. {'WT' : ('wt.prmtop', ['r1.nc', 'r2.nc'])}
+
+        ATTRIBUTES:
+            - members:      Dictionary containing as key a (variant, replica) tuple and the EMDA object as value
+
+        METHODS:
+            - select, add_*, analyse_*: Applied to the EMDA object of every replica with the same arguments. They return a
+                            dictionary with the output of each replica indexed by (variant, replica).
+        """
+
+        self.members = {}
+        for variant, (parameters, replicas) in variants.items():
+            if not isinstance(replicas, dict):
+                replicas = {r + 1: trajectory for r, trajectory in enumerate(replicas)}
+
+            for replica, trajectory in replicas.items():
+                self.members[(variant, replica)] = EMDA(parameters, trajectory)
+
+    def __getitem__(self, key):
+        return self.members[key]
+
+    def __iter__(self):
+        return iter(self.members.items())
+
+    def __len__(self):
+        return len(self.members)
+
+    def __getattr__(self, name):
+        # select, adders and analysers are broadcast to all the members
+        if name == "select" or name.startswith(("add_", "analyse_")):
+
+            def broadcast(*args, **kwargs):
+                return {
+                    key: getattr(member, name)(*args, **kwargs)
+                    for key, member in self.members.items()
+                }
+
+            return broadcast
+
+        raise AttributeError(
+            f"'{type(self).__name__}' object has no attribute '{name}'"
+        )
+
+    def run(self, n_workers=1, executor=None, retries=2, **kwargs):
+        """
+        DESCRIPTION:
+            Runs the measures of all the replicas. The options are passed to the run method of each EMDA object.
+
+        OPTIONS:
+            - n_workers:    Number of processes among which the replicas are split. Each process reopens the trajectory of
+                            a replica and runs all its measures. Default is 1 (replicas run one after another). Sinks are
+                            sent to the worker processes, so they must be picklable.
+            - executor:     Executor (see executors.py) where each replica is submitted as a task instead of a local pool
+                            of n_workers processes. It is not shut down.
+            - retries:      Number of times a replica whose task fails is submitted again. Default is 2.
+        """
+
+        if n_workers <= 1 and executor is None:
+            for member in self.members.values():
+                member.run(**kwargs)
+            return
+
+        own_executor = executor is None
+        if own_executor:
+            executor = LocalExecutor(n_workers)
+
+        try:
+            futures = {
+                executor.submit(run_member, member, kwargs): (key, 0)
+                for key, member in self.members.items()
+            }
+
+            progress = tqdm(total=len(futures), desc="Replicas")
+            while len(futures) > 0:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    key, attempt = futures.pop(future)
+                    member = self.members[key]
+
+                    if future.exception() is not None:
+                        if attempt == retries:
+                            raise future.exception()
+                        print(
+                            f"Replica {key} failed ({future.exception()!r}). Retrying."
+                        )
+                        futures[executor.submit(run_member, member, kwargs)] = (
+                            key,
+                            attempt + 1,
+                        )
+                        continue
+
+                    for name, (result, frames, sink, aux) in future.result().items():
+                        member.measures[name].result = result
+                        member.measures[name].frames = frames
+                        member.measures[name].sink = sink
+                        member.measures[name].aux = aux
+                    progress.update()
+
+            progress.close()
+
+        finally:
+            if own_executor:
+                executor.shutdown(wait=True)
+
+    def results(self, name):
+        """
+        DESCRIPTION:
+            Returns the result of the given measure (or analysis) of each replica, indexed by (variant, replica).
+        """
+
+        return {
+            key: (
+                member.measures[name].result
+                if name in member.measures
+                else member.analyses[name].result
+            )
+            for key, member in self.members.items()
+        }
@@ -31,6 +31,31 @@ class NotEqualListsLenghtError(Exception):
     pass
 
 
+class NotEqualSelectionsListsLenghtError(Exception):
+    """
+    Raised when two lists of selections that have to be paired do not have the same length.
+    """
+
+    def __init__(self):
+        Exception.__init__(self, "Both lists of selections must have the same length.")
+
+    pass
+
+
+class NotSameTrajectoryError(Exception):
+    """
+    Raised when EMDA objects that share the trajectory reads do not have the same number of atoms and frames.
+    """
+
+    def __init__(self):
+        Exception.__init__(
+            self,
+            "All the EMDA objects must have the same number of atoms and frames to share the trajectory.",
+        )
+
+    pass
+
+
 class NotEnoughAtomsSetectedError(Exception):
     """
     Raised when more than n atoms are required but not input.
@@ -187,3 +212,47 @@ class NotEnoughDataError(Exception):
         )
 
     pass
+
+
+class LostTaskError(Exception):
+    """
+    Raised when the worker running a task of a job queue stops sending heartbeats (i.e. it has been killed or preempted).
+    """
+
+    def __init__(self, job, timeout):
+        Exception.__init__(
+            self,
+            f"The worker running the job {job} has not sent a heartbeat in {timeout} seconds. The job is considered lost.",
+        )
+
+    pass
+
+
+class NotCheckpointError(Exception):
+    """
+    Raised when a run is resumed without the path of the checkpoint to resume from.
+    """
+
+    def __init__(self):
+        Exception.__init__(
+            self,
+            "A checkpoint has to be given to resume the run (resume='path' or checkpoint='path' with resume=True).",
+        )
+
+    pass
+
+
+class NotKnownFramesError(Exception):
+    """
+    Raised when the frames of a measure's result are not known, so the frames left to compute in an incremental run can
+    not be found.
+    """
+
+    def __init__(self, name):
+        Exception.__init__(
+            self,
+            f"The {name} measure has not the same number of frames and results (i.e. it was read from a pickle file of a "
+            "previous version), so it can not be extended incrementally. Recalculate it.",
+        )
+
+    pass
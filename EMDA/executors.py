@@ -0,0 +1,317 @@
+from .exceptions import LostTaskError
+
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures import wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import Process
+from threading import Event, Lock, Thread
+from os import getpid, listdir, makedirs, path, remove, rename, replace, utime
+from socket import gethostname
+from time import sleep, time, time_ns
+from traceback import format_exc
+from uuid import uuid4
+import pickle
+import sys
+
+"""
+DESCRIPTION
+    This Python file contains the executor backends that can be passed to EMDA.run (and EMDAEnsemble.run) to dispatch
+    chunks of frames (or replicas) as tasks. Any object with the concurrent.futures.Executor interface (submit and
+    shutdown) can be used, so the backends of cluster schedulers can be plugged in the same way.
+
+    Available backends:
+        - LocalExecutor:        pool of processes of the local machine (concurrent.futures.ProcessPoolExecutor), rebuilt
+                                when one of its processes dies
+        - FileQueueExecutor:    job queue stored in a folder. Tasks are pickled into the folder and executed by workers
+                                started with run_queue_worker (or python -m EMDA.executors <queue_folder>) in any machine
+                                that shares the folder.
+"""
+
+
+class LocalExecutor(Executor):
+    """
+    DESCRIPTION:
+        Executor that runs the tasks in a pool of n_workers processes of the local machine. If a worker process dies (i.e.
+        it is killed), the pool is broken and the futures of its tasks fail with BrokenProcessPool. The pool is then
+        rebuilt with the next submit, so the failed tasks can be submitted again.
+    """
+
+    def __init__(self, n_workers=1):
+        self.n_workers = n_workers
+        self.pool = ProcessPoolExecutor(max_workers=n_workers)
+
+    def submit(self, fn, /, *args, **kwargs):
+        try:
+            return self.pool.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            self.pool.shutdown(wait=False)
+            self.pool = ProcessPoolExecutor(max_workers=self.n_workers)
+            return self.pool.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+class FileQueueExecutor(Executor):
+    """
+    DESCRIPTION:
+        Executor that writes each task into a job queue folder and waits for its result. Tasks are taken by the workers
+        running run_queue_worker on the same folder, so they can be spread among several machines with a shared filesystem.
+
+        The queue folder contains:
+            - jobs:     pickled (function, args, kwargs) of the pending tasks
+            - running:  tasks taken by a worker. They are moved (renamed) from jobs, so each task is taken only once. The
+                        worker touches the file every heartbeat seconds while the task runs.
+            - results:  pickled ('ok', value) or ('error', exception, traceback) of the finished tasks
+
+        Futures can be cancelled until their result is received. Cancelled tasks still in jobs are removed from the queue,
+        and the results of cancelled tasks already taken by a worker are discarded.
+
+    ATTRIBUTES:
+        - queue_folder:     Path of the job queue folder
+        - n_workers:        Number of local workers started with the executor (0 to only use external workers)
+        - poll_interval:    Seconds between checks of the queue folder
+        - heartbeat:        Seconds between the heartbeats (touches of the running file) of the local workers
+        - timeout:          Seconds without heartbeat after which a running task is considered lost (i.e. its worker was
+                            killed). The task is removed from running and its future fails with LostTaskError, so EMDA.run
+                            submits it again to jobs as any failed task (counted against retries). If the worker was only
+                            slow, the result it writes later is removed. External workers have to send heartbeats more
+                            often than timeout.
+    """
+
+    def __init__(
+        self, queue_folder, n_workers=1, poll_interval=0.2, heartbeat=5, timeout=60
+    ):
+        self.queue_folder = queue_folder
+        self.n_workers = n_workers
+        self.poll_interval = poll_interval
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+
+        for folder in ("jobs", "running", "results"):
+            makedirs(path.join(queue_folder, folder), exist_ok=True)
+        if path.exists(path.join(queue_folder, "STOP")):
+            remove(path.join(queue_folder, "STOP"))
+
+        # local workers are started before the polling thread, so they are not forked with it
+        self.workers = [
+            Process(
+                target=run_queue_worker, args=(queue_folder, poll_interval, heartbeat)
+            )
+            for _ in range(n_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+        self.pending = {}
+        self.lost = set()
+        self.lock = Lock()
+        self.stopped = False
+        self.poller = Thread(target=self._poll, daemon=True)
+        self.poller.start()
+
+    def submit(self, fn, /, *args, **kwargs):
+        if self.stopped:
+            raise RuntimeError("cannot schedule new futures after shutdown")
+
+        # jobs are named after their submission time, so workers take them in order
+        job = f"{time_ns()}_{uuid4().hex}"
+        future = Future()
+
+        with self.lock:
+            self.pending[job] = future
+
+        filename = path.join(self.queue_folder, "jobs", f"{job}.pkl")
+        with open(f"{filename}.tmp", "wb") as handle:
+            pickle.dump((fn, args, kwargs), handle)
+        replace(f"{filename}.tmp", filename)
+
+        return future
+
+    def _poll(self):
+        jobs_folder = path.join(self.queue_folder, "jobs")
+        results_folder = path.join(self.queue_folder, "results")
+
+        while not self.stopped or len(self.pending) > 0:
+            with self.lock:
+                jobs = list(self.pending.items())
+
+            for job, future in jobs:
+                filename = path.join(results_folder, f"{job}.pkl")
+                if not path.exists(filename):
+                    if future.cancelled():
+                        try:
+                            remove(path.join(jobs_folder, f"{job}.pkl"))
+                        except FileNotFoundError:
+                            # the task has been taken by a worker, so its result is waited for
+                            continue
+                        with self.lock:
+                            self.pending.pop(job)
+                        # waiters of the future are notified of the cancellation
+                        future.set_running_or_notify_cancel()
+                    continue
+
+                with open(filename, "rb") as handle:
+                    status, *value = pickle.load(handle)
+                remove(filename)
+
+                with self.lock:
+                    self.pending.pop(job)
+
+                # the future can not be cancelled once it is running
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                if status == "ok":
+                    future.set_result(value[0])
+                else:
+                    future.set_exception(value[0])
+
+            self._check_lost()
+            self._remove_lost_results()
+            sleep(self.poll_interval)
+
+    def _check_lost(self):
+        """
+        DESCRIPTION:
+            Fails the futures of the running tasks whose worker has not touched the running file in timeout seconds.
+        """
+
+        running_folder = path.join(self.queue_folder, "running")
+
+        for filename in listdir(running_folder):
+            job = filename.split(".")[0]
+            running = path.join(running_folder, filename)
+
+            try:
+                lost = time() - path.getmtime(running) > self.timeout
+            except FileNotFoundError:
+                # the task has just finished
+                continue
+
+            with self.lock:
+                if not lost or job not in self.pending:
+                    continue
+                future = self.pending.pop(job)
+                self.lost.add(job)
+
+            try:
+                remove(running)
+            except FileNotFoundError:
+                pass
+
+            if future.set_running_or_notify_cancel():
+                future.set_exception(LostTaskError(job, self.timeout))
+
+    def _remove_lost_results(self):
+        """
+        DESCRIPTION:
+            Removes the results written by the workers of tasks that were considered lost (i.e. slow workers that were
+            still running them), as their futures have already failed.
+        """
+
+        with self.lock:
+            lost = list(self.lost)
+
+        for job in lost:
+            try:
+                remove(path.join(self.queue_folder, "results", f"{job}.pkl"))
+            except FileNotFoundError:
+                continue
+            with self.lock:
+                self.lost.discard(job)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        if wait:
+            with self.lock:
+                futures = list(self.pending.values())
+            wait_futures(futures)
+
+        # local workers (and any other worker of the queue) stop when the STOP file is found
+        if len(self.workers) > 0:
+            open(path.join(self.queue_folder, "STOP"), "w").close()
+            for worker in self.workers:
+                worker.join()
+            self.workers = []
+
+        # the local workers have finished their tasks, so late results of lost tasks are already written
+        self._remove_lost_results()
+
+        self.stopped = True
+        if wait:
+            self.poller.join()
+
+
+def run_queue_worker(queue_folder, poll_interval=0.2, heartbeat=5):
+    """
+    DESCRIPTION:
+        Runs the tasks of a FileQueueExecutor job queue until a STOP file is created in the queue folder. Exceptions raised
+        by a task are sent back as its result, so the executor can retry it. While a task runs, its running file is touched
+        every heartbeat seconds, so the executor can tell a long task from a dead worker.
+    """
+
+    jobs_folder = path.join(queue_folder, "jobs")
+    worker = f"{gethostname()}.{getpid()}"
+
+    while not path.exists(path.join(queue_folder, "STOP")):
+        jobs = sorted(job for job in listdir(jobs_folder) if job.endswith(".pkl"))
+        if len(jobs) == 0:
+            sleep(poll_interval)
+            continue
+
+        job = jobs[0][:-4]
+        running = path.join(queue_folder, "running", f"{job}.{worker}.pkl")
+        try:
+            rename(path.join(jobs_folder, jobs[0]), running)
+        except FileNotFoundError:
+            # the job has been taken by another worker
+            continue
+
+        # the rename keeps the submission time, so the first heartbeat is sent when the task is taken
+        utime(running)
+
+        with open(running, "rb") as handle:
+            fn, args, kwargs = pickle.load(handle)
+
+        done = Event()
+        beater = Thread(target=send_heartbeats, args=(running, heartbeat, done))
+        beater.start()
+
+        try:
+            result = ("ok", fn(*args, **kwargs))
+        except Exception as exception:
+            result = ("error", exception, format_exc())
+            try:
+                pickle.dumps(exception)
+            except Exception:
+                result = ("error", RuntimeError(result[2]), result[2])
+        finally:
+            done.set()
+            beater.join()
+
+        filename = path.join(queue_folder, "results", f"{job}.pkl")
+        with open(f"{filename}.{worker}.tmp", "wb") as handle:
+            pickle.dump(result, handle)
+        replace(f"{filename}.{worker}.tmp", filename)
+        try:
+            remove(running)
+        except FileNotFoundError:
+            # the executor gave the task up as lost
+            pass
+
+
+def send_heartbeats(running, heartbeat, done):
+    """
+    DESCRIPTION:
+        Touches the running file of a task every heartbeat seconds until the done event is set.
+    """
+
+    while not done.wait(heartbeat):
+        try:
+            utime(running)
+        except FileNotFoundError:
+            return
+
+
+if __name__ == "__main__":
+    run_queue_worker(sys.argv[1])
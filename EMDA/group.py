@@ -0,0 +1,106 @@
+from .runners import run_trajectory
+
+from .exceptions import EmptyMeasuresError, NotSameTrajectoryError
+
+"""
+DESCRIPTION
+    This Python file contains the EMDAGroup class, which runs the measures of several EMDA objects loaded with the same
+    parameters and trajectory (i.e. one per notebook section) in a single pass over the frames. Each frame is read from
+    disk once and shared with the universes of all the objects.
+"""
+
+
+class EMDAGroup:
+
+    def __init__(self, objects):
+        """
+        DESCRIPTION:
+            Function to initialise the EMDAGroup class with the EMDA objects whose trajectory reads are shared.
+
+        INPUT:
+            - objects:      List of EMDA objects with the same atoms and trajectory (same number of atoms and frames)
+
+        ATTRIBUTES:
+            - objects:      List of the grouped EMDA objects. The trajectory is read from the universe of the first one.
+        """
+
+        self.objects = list(objects)
+
+        universe = self.objects[0].universe
+        for EMDA_object in self.objects[1:]:
+            if EMDA_object.universe.atoms.n_atoms != universe.atoms.n_atoms or len(
+                EMDA_object.universe.trajectory
+            ) != len(universe.trajectory):
+                raise NotSameTrajectoryError
+
+    def __getitem__(self, index):
+        return self.objects[index]
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def run(
+        self,
+        recalculate=False,
+        step=1,
+        start=1,
+        end=-1,
+        block_size=100,
+        n_workers=1,
+        flush_every=1000,
+        executor=None,
+        retries=2,
+        incremental=False,
+        prefetch=0,
+        timeout=None,
+    ):
+        """
+        DESCRIPTION:
+            Runs the measures of all the EMDA objects reading each frame once. The frame is read by the universe of the
+            first object and copied into the universes of the rest, so every measure (including updating selections, i.e.
+            contacts) is computed on it without another read from disk.
+
+        OPTIONS:
+            - recalculate:  [True | False | (List | str)] Applied to each object as in EMDA.run.
+            - step, start, end, block_size, n_workers, flush_every, executor, retries, incremental, prefetch,
+                            timeout: As in EMDA.run.
+        """
+
+        # Check that there is at least one measure set
+        if all(len(EMDA_object.measures) == 0 for EMDA_object in self.objects):
+            raise EmptyMeasuresError
+
+        measures = []
+        universes = []
+        for EMDA_object in self.objects:
+            names = EMDA_object._select_measures(None, None, recalculate, incremental)
+            measures += [EMDA_object.measures[name] for name in names]
+
+            if len(names) > 0 and EMDA_object is not self.objects[0]:
+                universes.append(EMDA_object.universe)
+
+        universe = self.objects[0].universe
+
+        # If last frame is -1 (the default), last in trajectory is chosen.
+        if end == -1:
+            end = len(universe.trajectory)
+
+        run_trajectory(
+            universe,
+            measures,
+            start - 1,
+            end,
+            step,
+            incremental=incremental,
+            n_workers=n_workers,
+            block_size=block_size,
+            flush_every=flush_every,
+            executor=executor,
+            retries=retries,
+            universes=universes,
+            prefetch=prefetch,
+            timeout=timeout,
+        )
@@ -0,0 +1,91 @@
+from dataclasses import dataclass
+
+"""
+DESCRIPTION
+    This Python file contains the registry of measure types. Each type declares the functions used to add and compute its
+    measures, so the runners look up the functions of each measure once before the frame loop instead of comparing type
+    names for every frame, and new types (i.e. in-house measures) can be registered without modifying EMDA.
+
+HOW TO REGISTER A MEASURE TYPE:
+    - Create an adder add_<type>(self, name, ...) that stores a self.Measure(name=name, type="<type>", sel=[...],
+        options={...}, result=[]) in self.measures. Selections are AtomGroups.
+    - Create a frame-wise runner(Measure) that appends the result of the current frame to Measure.result and/or a block
+        runner(Measure, coords, box=None) that extends Measure.result with the results of a block of frames, where coords is
+        a list with a (frames x atoms x 3) array per selection and box a (frames x 6) array if the pbc option is set.
+    - Call register_measure_type("<type>", runner=..., block_runner=..., adder=..., kind=...) before creating the EMDA
+        objects, so the adder is loaded as an EMDA method. Workers of parallel runs (see executors.py) have to import the
+        module where the type is registered.
+"""
+
+
+@dataclass
+class MeasureType:
+    """
+    DESCRIPTION:
+        Dataclass that stores the functions and result format of a measure type.
+
+    ATTRIBUTES:
+        - name:         Name of the type (Measure.type)
+        - runner:       Frame-wise runner, called as runner(Measure) for each frame (or runner(Measure, executor) if executor)
+        - block_runner: Block runner, called as block_runner(Measure, coords, box) for each block of frames. If given, it is
+                        used instead of the frame-wise runner, except for measures with updating selections (whose atoms
+                        change in each frame) when the type also has a frame-wise runner.
+        - adder:        Adder function, loaded as an EMDA method with its own name
+        - kind:         Kind of columnar store of the result (value, contacts, dict; see store.py). None if the result can not
+                        be stored in columns.
+        - shape:        Function shape(Measure) returning the shape of each frame's result of value kind. Default is a float.
+        - setup:        Function setup(Measure) called before the frame loop (i.e. creating folders)
+        - collect:      Function collect(Measure) called before the result is read (flushes, checkpoints and the end of the
+                        run), i.e. to gather results computed asynchronously
+        - executor:     If True, the frame-wise runner receives the thread pool of the run (sized by the n_jobs option)
+    """
+
+    name: str
+    runner: object = None
+    block_runner: object = None
+    adder: object = None
+    kind: str = None
+    shape: object = None
+    setup: object = None
+    collect: object = None
+    executor: bool = False
+
+
+MEASURE_TYPES = {}
+
+
+def register_measure_type(
+    name,
+    runner=None,
+    block_runner=None,
+    adder=None,
+    kind=None,
+    shape=None,
+    setup=None,
+    collect=None,
+    executor=False,
+):
+    """
+    DESCRIPTION:
+        Function that registers (or replaces) a measure type. See MeasureType for the description of the options.
+
+    OUTPUT:
+        - MeasureType of the registered type
+    """
+
+    if runner is None and block_runner is None:
+        raise ValueError(f"A runner or a block runner is needed to register {name}.")
+
+    MEASURE_TYPES[name] = MeasureType(
+        name=name,
+        runner=runner,
+        block_runner=block_runner,
+        adder=adder,
+        kind=kind,
+        shape=shape,
+        setup=setup,
+        collect=collect,
+        executor=executor,
+    )
+
+    return MEASURE_TYPES[name]
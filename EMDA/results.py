@@ -0,0 +1,198 @@
+from array import array
+
+from numpy import asarray, frombuffer, int32, float32, int64
+
+"""
+DESCRIPTION
+    This Python file contains the containers used as result attribute of the Measures whose per-frame output is not a
+    single value. They behave like the list of per-frame dicts they replace, so analysers and plotters keep working.
+"""
+
+
+class ContactsResult:
+    """
+    DESCRIPTION:
+        Compact list-like container of the per-frame contacts of a contacts Measure (new out_format). Residue labels are
+        interned once in a table and each frame is stored as the rows of a sparse (CSR) matrix of contacting pairs of
+        residues with an optional float32 array of distances, so memory scales with the number of contacts.
+
+        Indexing or iterating returns the same dictionaries produced by the contacts calculators:
+            - protein mode:     { residue : { contacting_residue : distance } } including all the key residues
+            - selection mode:   { contacting_residue : distance }
+            - pairs mode:       { (label, partner_label) : distance } (i.e. hydrogen bonds as (donor, acceptor) atoms)
+
+    ATTRIBUTES:
+        - mode:             Contacts mode [ protein | selection | pairs ]
+        - labels:           List of interned residue labels (i.e. 'ARG12')
+        - label_index:      Dictionary with each label as key and its position in labels as value
+        - key_index:        Array with the label index of each key residue (protein mode) or of each label known in advance
+                            (pairs mode), so they keep their index when the result is emptied
+        - has_distances:    Whether distances are stored or None is returned as value
+        - indptr:           Offset of the first contact of each frame in rows, cols and distances
+        - rows, cols:       Label indices of the residue and its contacting residue of each contact
+        - distances:        Distance of each contact
+    """
+
+    def __init__(self, mode="selection", labels=None, distances=True):
+        self.mode = mode
+        self.labels = []
+        self.label_index = {}
+        self.has_distances = distances
+
+        self.key_index = array("i", [self.intern(label) for label in labels or []])
+
+        self.indptr = array("q", [0])
+        self.rows = array("i")
+        self.cols = array("i")
+        self.distances = array("f")
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, frame):
+        if isinstance(frame, slice):
+            return [self.frame(f) for f in range(*frame.indices(len(self)))]
+
+        if frame < 0:
+            frame += len(self)
+        if not 0 <= frame < len(self):
+            raise IndexError("ContactsResult index out of range")
+
+        return self.frame(frame)
+
+    def __iter__(self):
+        for frame in range(len(self)):
+            yield self.frame(frame)
+
+    def __repr__(self):
+        return f"ContactsResult(mode={self.mode}, frames={len(self)}, contacts={len(self.cols)})"
+
+    def intern(self, label):
+        """
+        DESCRIPTION:
+            Returns the index of a residue label in the labels table, adding it if it is not already there.
+        """
+
+        if label not in self.label_index:
+            self.label_index[label] = len(self.labels)
+            self.labels.append(label)
+
+        return self.label_index[label]
+
+    def empty(self):
+        """
+        DESCRIPTION:
+            Returns an empty ContactsResult sharing mode, key residues and the distances option.
+        """
+
+        return ContactsResult(
+            mode=self.mode,
+            labels=[self.labels[k] for k in self.key_index],
+            distances=self.has_distances,
+        )
+
+    def arrays(self):
+        """
+        DESCRIPTION:
+            Returns (indptr, rows, cols, distances) as numpy arrays sharing memory with the container. distances is None if
+            they are not stored.
+        """
+
+        return (
+            frombuffer(self.indptr, dtype=int64),
+            frombuffer(self.rows, dtype=int32),
+            frombuffer(self.cols, dtype=int32),
+            frombuffer(self.distances, dtype=float32) if self.has_distances else None,
+        )
+
+    def frame(self, frame):
+        """
+        DESCRIPTION:
+            Returns the contacts of a frame as a dictionary.
+        """
+
+        start, end = self.indptr[frame], self.indptr[frame + 1]
+        rows, cols = self.rows[start:end], self.cols[start:end]
+        if self.has_distances:
+            distances = [float(d) for d in self.distances[start:end]]
+        else:
+            distances = [None] * (end - start)
+
+        if self.mode == "protein":
+            contacts = {self.labels[k]: {} for k in self.key_index}
+            for r, c, d in zip(rows, cols, distances):
+                contacts[self.labels[r]][self.labels[c]] = d
+
+        elif self.mode == "pairs":
+            contacts = {
+                (self.labels[r], self.labels[c]): d
+                for r, c, d in zip(rows, cols, distances)
+            }
+
+        else:
+            contacts = {self.labels[c]: d for c, d in zip(cols, distances)}
+
+        return contacts
+
+    def append(self, contacts):
+        """
+        DESCRIPTION:
+            Appends the contacts of a frame given as a dictionary (as returned by the contacts calculators).
+        """
+
+        if self.mode == "protein":
+            for residue, partners in contacts.items():
+                row = self.intern(residue)
+                for partner, distance in partners.items():
+                    self._append_contact(row, self.intern(partner), distance)
+
+        elif self.mode == "pairs":
+            for (label, partner), distance in contacts.items():
+                self._append_contact(self.intern(label), self.intern(partner), distance)
+
+        else:
+            for partner, distance in contacts.items():
+                self._append_contact(-1, self.intern(partner), distance)
+
+        self.indptr.append(len(self.cols))
+
+    def append_pairs(self, rows, cols, distances=None):
+        """
+        DESCRIPTION:
+            Appends the contacts of a frame given as arrays of label indices (rows are ignored in selection mode) and,
+            optionally, distances.
+        """
+
+        self.rows.frombytes(asarray(rows, dtype=int32).tobytes())
+        self.cols.frombytes(asarray(cols, dtype=int32).tobytes())
+        if self.has_distances:
+            self.distances.frombytes(asarray(distances, dtype=float32).tobytes())
+
+        self.indptr.append(len(self.cols))
+
+    def extend(self, frames):
+        """
+        DESCRIPTION:
+            Appends several frames, given as another ContactsResult or as an iterable of dictionaries.
+        """
+
+        if not isinstance(frames, ContactsResult):
+            for contacts in frames:
+                self.append(contacts)
+            return
+
+        # labels of the other container are interned into this one
+        mapping = [self.intern(label) for label in frames.labels]
+        offset = len(self.cols)
+
+        self.rows.extend(mapping[r] if r >= 0 else r for r in frames.rows)
+        self.cols.extend(mapping[c] for c in frames.cols)
+        if self.has_distances:
+            self.distances.extend(frames.distances)
+        self.indptr.extend(offset + i for i in frames.indptr[1:])
+
+    def _append_contact(self, row, col, distance):
+        self.rows.append(row)
+        self.cols.append(col)
+        if self.has_distances:
+            self.distances.append(float("nan") if distance is None else distance)
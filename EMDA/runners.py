@@ -1,7 +1,40 @@
 from .calculators import *
+from .tools import check_folder
+from .cache import pka_cache_key, read_cache, cached_call
+from .results import ContactsResult
+from .registry import MEASURE_TYPES, register_measure_type
+from .executors import LocalExecutor
+from .adders import (
+    add_distance,
+    add_angle,
+    add_dihedral,
+    add_planar_angle,
+    add_contacts,
+    add_RMSD,
+    add_pairwise_RMSD,
+    add_distWATbridge,
+    add_hbonds,
+    add_pKa,
+)
+
+from numpy import empty, float32, int32, concatenate, unique, searchsorted, array_split
+from numpy import frombuffer, full, nan, stack
+from numpy import argsort, asarray, diff, flatnonzero, int64, isin
+from tqdm.autonotebook import tqdm
+
+from concurrent.futures import BrokenExecutor, Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from dataclasses import replace
+from functools import partial
+from MDAnalysis.core.groups import UpdatingAtomGroup
+from os import replace as replace_file
+from queue import Full, Queue
+from threading import BoundedSemaphore, Event, Thread
+import pickle
 
 """ 
 TO-DO:
+    - [x] Automatic dispatch of the runners by type (see registry.py)
     - [x] Add distance
     - [x] Add angle
     - [x] Add dihedral
@@ -13,6 +46,19 @@ TO-DO:
 """
 
 
+def get_box(Measure):
+    """
+    DESCRIPTION:
+        Returns the box dimensions of the current frame if the Measure is computed with periodic boundary conditions
+        (pbc option) or None otherwise.
+    """
+
+    if Measure.options.get("pbc", False):
+        return Measure.sel[0].dimensions
+
+    return None
+
+
 def run_distance(Measure):
     """
     DESCRIPTION:
@@ -20,7 +66,12 @@ def run_distance(Measure):
     """
 
     Measure.result.append(
-        calc_distance(Measure.sel[0], Measure.sel[1], Measure.options["type"])
+        calc_distance(
+            Measure.sel[0],
+            Measure.sel[1],
+            Measure.options["type"],
+            box=get_box(Measure),
+        )
     )
 
 
@@ -37,6 +88,7 @@ def run_angle(Measure):
             Measure.sel[2],
             Measure.options["units"],
             Measure.options["domain"],
+            box=get_box(Measure),
         )
     )
 
@@ -55,6 +107,7 @@ def run_dihedral(Measure):
             Measure.sel[3],
             Measure.options["units"],
             Measure.options["domain"],
+            box=get_box(Measure),
         )
     )
 
@@ -65,32 +118,83 @@ def run_planar_angle(Measure):
 
     """
 
-    Measure.result.append(
-        calc_planar_angle(
-            Measure.sel[0],
-            Measure.sel[1],
-            Measure.options["units"],
-            Measure.options["domain"],
-        )
+    box = get_box(Measure)
+    run_planar_angle_block(
+        Measure,
+        [sel.positions[None] for sel in Measure.sel],
+        box=None if box is None else box[None],
     )
 
 
-def run_pka(Measure):
+def run_pka(Measure, executor=None):
     """
     DESCRIPTION:
-
+        Saves the current frame as a PDB and predicts its pKas. If an executor is given, PROPKA is submitted to it and the
+        Future is stored in the result, so collect_pka has to be called once all the frames have been submitted.
+        If the Measure has a cache_folder, frames already predicted with the same coordinates are read from the cache.
     """
 
-    Measure.result.append(
-        calc_pka(
-            Measure.sel[0],
-            Measure.options["pka_ref"],
-            Measure.options["pdb_folder"],
-            Measure.options["keep_pdb"],
-            Measure.options["keep_pka"],
-        )
+    cache_folder = Measure.options.get("cache_folder")
+
+    if cache_folder is not None:
+        key = pka_cache_key(Measure.sel[0], Measure.options["pka_ref"])
+        pkas = read_cache(cache_folder, key)
+
+        if pkas is not None:
+            Measure.result.append(pkas)
+            return
+
+    pdb = write_pka_input(
+        Measure.sel[0],
+        Measure.options["pdb_folder"],
+        frame=f"frame{Measure.sel[0].universe.trajectory.ts.frame}",
     )
 
+    if cache_folder is not None:
+        function, args = cached_call, (
+            predict_pka,
+            cache_folder,
+            key,
+            Measure.options["cache_size"] * 1024**2,
+            pdb,
+        )
+    else:
+        function, args = predict_pka, (pdb,)
+
+    kwargs = {
+        "pka_ref": Measure.options["pka_ref"],
+        "keep_pdb": Measure.options["keep_pdb"],
+        "keep_pka": Measure.options["keep_pka"],
+    }
+
+    if executor is None:
+        Measure.result.append(function(*args, **kwargs))
+
+    else:
+        Measure.result.append(executor.submit(function, *args, **kwargs))
+
+
+def collect_pka(Measure):
+    """
+    DESCRIPTION:
+        Replaces the pending PROPKA predictions (Futures) stored in the result of a pka Measure by their pKas, keeping the
+        frame order.
+    """
+
+    Measure.result[:] = [
+        result.result() if isinstance(result, Future) else result
+        for result in Measure.result
+    ]
+
+
+def setup_pka(Measure):
+    """
+    DESCRIPTION:
+        Creates the folder where the PDBs of a pka Measure are written.
+    """
+
+    check_folder(Measure.options["pdb_folder"])
+
 
 def run_contacts(Measure):
     """
@@ -106,9 +210,29 @@ def run_contacts(Measure):
                 Measure.options["interactions"],
                 Measure.options["measure_dists"],
                 Measure.options["out_format"],
+                box=get_box(Measure),
             )
         )
 
+    elif Measure.options["mode"] == "protein" and isinstance(
+        Measure.result, ContactsResult
+    ):
+        # residue indices are converted into positions of the result's key residues, which are the residues of sel
+        ref, env, distances = calc_contacts_protein_pairs(
+            Measure.sel[0],
+            Measure.sel[1],
+            Measure.options["interactions"],
+            box=get_box(Measure),
+        )
+        resindices = Measure.sel[0].residues.resindices
+        key_index = frombuffer(Measure.result.key_index, dtype=int32)
+
+        Measure.result.append_pairs(
+            key_index[searchsorted(resindices, ref)],
+            key_index[searchsorted(resindices, env)],
+            distances,
+        )
+
     elif Measure.options["mode"] == "protein":
         Measure.result.append(
             calc_contacts_protein(
@@ -117,6 +241,7 @@ def run_contacts(Measure):
                 Measure.options["interactions"],
                 Measure.options["measure_dists"],
                 Measure.options["out_format"],
+                box=get_box(Measure),
             )
         )
 
@@ -129,7 +254,10 @@ def run_RMSD(Measure):
 
     Measure.result.append(
         calc_RMSD(
-            Measure.sel[0], Measure.options["ref"], Measure.options["superposition"]
+            Measure.sel[0],
+            Measure.options["ref"],
+            Measure.options["superposition"],
+            box=get_box(Measure),
         )
     )
 
@@ -140,13 +268,1268 @@ def run_distWATbridge(Measure):
 
     """
 
-    Measure.result.append(
-        calc_distWATbridge(
-            Measure.sel[0],
-            Measure.sel[1],
-            Measure.sel[2],
-            Measure.sel[3],
-            Measure.sel[4],
-            Measure.sel[5],
+    box = get_box(Measure)
+    run_distWATbridge_block(
+        Measure,
+        [sel.positions[None] for sel in Measure.sel],
+        box=None if box is None else box[None],
+    )
+
+
+def run_distance_block(Measure, coords, box=None):
+    """
+    DESCRIPTION:
+        Block runner for distance measures. coords is a list with the Fxnx3 coordinates of each selection and box the
+        Fx6 box dimensions of each frame (None without pbc).
+    """
+
+    Measure.result.extend(
+        calc_distance_block(
+            coords[0],
+            coords[1],
+            Measure.options["type"],
+            Measure.sel[0].masses,
+            Measure.sel[1].masses,
+            box=box,
+        ).tolist()
+    )
+
+
+def run_angle_block(Measure, coords, box=None):
+    """
+    DESCRIPTION:
+        Block runner for angle measures. coords is a list with the Fx1x3 coordinates of each selection.
+    """
+
+    Measure.result.extend(
+        calc_angle_block(
+            coords[0],
+            coords[1],
+            coords[2],
+            Measure.options["units"],
+            Measure.options["domain"],
+            box=box,
+        ).tolist()
+    )
+
+
+def run_dihedral_block(Measure, coords, box=None):
+    """
+    DESCRIPTION:
+        Block runner for dihedral measures. coords is a list with the Fx1x3 coordinates of each selection.
+    """
+
+    Measure.result.extend(
+        calc_dihedral_block(
+            coords[0],
+            coords[1],
+            coords[2],
+            coords[3],
+            Measure.options["units"],
+            Measure.options["domain"],
+            box=box,
+        ).tolist()
+    )
+
+
+def run_planar_angle_block(Measure, coords, box=None):
+    """
+    DESCRIPTION:
+        Block runner for planar_angle measures. coords is a list with the Fx3x3 coordinates of the first plane of each pair
+        followed by those of the second plane of each pair. Measures with several pairs of planes store a list of angles
+        per frame.
+    """
+
+    n_pairs = len(coords) // 2
+
+    angles = calc_planar_angle_block(
+        stack(coords[:n_pairs], axis=1),
+        stack(coords[n_pairs:], axis=1),
+        Measure.options["units"],
+        Measure.options["domain"],
+        box=box,
+    )
+
+    if Measure.options.get("pairs", False):
+        Measure.result.extend(angles.tolist())
+    else:
+        Measure.result.extend(angles[:, 0].tolist())
+
+
+def run_RMSD_block(Measure, coords, box=None):
+    """
+    DESCRIPTION:
+        Block runner for RMSD measures. coords is a list with the Fxnx3 coordinates of the selection. If the rotations
+        option is set, the rotation matrices are stored in Measure.aux['rotations'].
+    """
+
+    rotations = Measure.options.get("rotations", False)
+
+    rmsd = calc_RMSD_block(
+        coords[0],
+        Measure.options["ref"],
+        Measure.options["superposition"],
+        Measure.sel[0].masses,
+        box=box,
+        ref_centered=Measure.options.get("ref_centered"),
+        ref_inner=Measure.options.get("ref_inner"),
+        rotations=rotations and Measure.options["superposition"],
+    )
+
+    if rotations and Measure.options["superposition"]:
+        rmsd, matrices = rmsd
+        Measure.aux.setdefault("rotations", []).extend(matrices)
+
+    Measure.result.extend(rmsd.tolist())
+
+
+def run_distWATbridge_block(Measure, coords, box=None):
+    """
+    DESCRIPTION:
+        Finds the bridging waters of each frame of the block with calc_water_bridges. Best two-water bridges are stored in
+        Measure.aux["two_water"].
+    """
+
+    water_resids = Measure.sel[2].resids
+    options = Measure.options
+
+    for frame in range(len(coords[0])):
+        bridges = calc_water_bridges(
+            coords[0][frame],
+            coords[1][frame],
+            coords[2][frame],
+            water_resids,
+            options["sel1_rad"],
+            options["sel2_rad"],
+            box=None if box is None else box[frame],
+            top=options["top"],
+            two_water=options["two_water"],
+            water_rad=options["water_rad"],
         )
+
+        if options["two_water"]:
+            bridges, two_water = bridges
+            Measure.aux.setdefault("two_water", []).append(two_water)
+
+        Measure.result.append(bridges)
+
+
+def run_hbonds(Measure):
+    """
+    DESCRIPTION:
+        Runner for hbonds measures. Calculates the hydrogen bonds of the current frame as a block of one frame.
+    """
+
+    box = get_box(Measure)
+    run_hbonds_block(
+        Measure,
+        [sel.positions[None] for sel in Measure.sel],
+        box=None if box is None else box[None],
     )
+
+
+def run_hbonds_block(Measure, coords, box=None):
+    """
+    DESCRIPTION:
+        Finds the hydrogen bonds of each frame of the block with calc_hbonds and appends them to the ContactsResult as
+        (donor, acceptor) pairs of atom labels with their distance.
+    """
+
+    options = Measure.options
+    donor_atoms = Measure.sel[0].indices
+    acceptor_atoms = Measure.sel[2].indices
+
+    for frame in range(len(coords[0])):
+        pair, acceptor, distances, _ = calc_hbonds(
+            coords[0][frame],
+            coords[1][frame],
+            coords[2][frame],
+            options["d_a_cutoff"],
+            options["angle_cutoff"],
+            box=None if box is None else box[frame],
+        )
+
+        # an atom does not bond itself, and between two selections only bonds from one to the other are kept
+        keep = donor_atoms[pair] != acceptor_atoms[acceptor]
+        if options["between"]:
+            keep &= (
+                options["donor_in_sel1"][pair] & options["acceptor_in_sel2"][acceptor]
+            ) | (options["donor_in_sel2"][pair] & options["acceptor_in_sel1"][acceptor])
+
+        Measure.result.append_pairs(
+            options["donor_labels"][pair[keep]],
+            options["acceptor_labels"][acceptor[keep]],
+            distances[keep],
+        )
+
+
+def run_pairwise_RMSD_block(Measure, coords, box=None):
+    """
+    DESCRIPTION:
+        Block runner for pairwise_RMSD measures. coords is a list with the Fxnx3 coordinates of the selection, which are
+        stored centered (on the center of geometry with superposition or on the center of mass without it) to build the
+        RMSD matrix afterwards (see analyse_RMSD_matrix).
+    """
+
+    coords = coords[0]
+    if box is not None:
+        coords = make_whole(coords, box)
+
+    if Measure.options["superposition"]:
+        centers = center_block(coords)
+    else:
+        centers = center_block(coords, Measure.sel[0].masses)
+
+    Measure.result.extend(coords - centers[:, None, :])
+
+
+class FrameBlock:
+    """
+    DESCRIPTION:
+        Buffer that stores the coordinates of all the atoms used by block-compatible measures (types with a block runner) for
+        a number of frames. The atoms of the selections are read once, so measures with updating selections are computed
+        frame by frame instead (see run_frames), unless their type only has a block runner. Once the block is full, each measure is calculated for all the stored frames at once, so the
+        calculators are called once per block instead of once per frame.
+
+    ATTRIBUTES:
+        - measures:     List of Measure objects computed by block
+        - size:         Maximum number of frames stored before computing the measures
+        - indices:      Sorted array with the indices of all the atoms needed by the measures
+        - coordinates:  Array (size x n_atoms x 3) where the coordinates of each frame are stored
+        - dimensions:   Array (size x 6) where the box dimensions of each frame are stored
+        - n_frames:     Number of frames currently stored
+    """
+
+    def __init__(self, measures, size):
+        self.measures = measures
+        self.size = max(int(size), 1)
+
+        if len(measures) > 0:
+            self.indices = unique(
+                concatenate(
+                    [sel.indices for Measure in measures for sel in Measure.sel]
+                )
+            )
+        else:
+            self.indices = empty(0, dtype=int)
+
+        # block runners are looked up once, so the type is not compared for each block
+        self.runners = [
+            MEASURE_TYPES[Measure.type].block_runner for Measure in measures
+        ]
+
+        # position of each selection's atoms in the coordinates buffer
+        self.local_indices = [
+            [searchsorted(self.indices, sel.indices) for sel in Measure.sel]
+            for Measure in measures
+        ]
+
+        self.coordinates = empty((self.size, len(self.indices), 3), dtype=float32)
+        self.dimensions = full((self.size, 6), nan, dtype=float32)
+        self.n_frames = 0
+
+    def add_frame(self, ts):
+        """
+        DESCRIPTION:
+            Copies the coordinates of the needed atoms from the current timestep into the buffer. If the buffer is full,
+            the measures are computed and the buffer is emptied.
+        """
+
+        self.coordinates[self.n_frames] = ts.positions[self.indices]
+        if ts.dimensions is not None:
+            self.dimensions[self.n_frames] = ts.dimensions
+        self.n_frames += 1
+
+        if self.n_frames == self.size:
+            self.flush()
+
+    def flush(self):
+        """
+        DESCRIPTION:
+            Computes all the measures for the stored frames and empties the buffer.
+        """
+
+        if self.n_frames == 0:
+            return
+
+        coordinates = self.coordinates[: self.n_frames]
+        dimensions = self.dimensions[: self.n_frames]
+        for Measure, runner, local_indices in zip(
+            self.measures, self.runners, self.local_indices
+        ):
+            runner(
+                Measure,
+                [coordinates[:, idx] for idx in local_indices],
+                box=dimensions if Measure.options.get("pbc", False) else None,
+            )
+
+        self.n_frames = 0
+
+
+def get_runner(Measure, executor=None):
+    """
+    DESCRIPTION:
+        Returns the frame-wise runner of the type of the given Measure (see registry.py) bound to the Measure, so it is
+        called without arguments for each frame. executor is passed to the types that use it (pka, to run PROPKA
+        concurrently).
+    """
+
+    measure_type = MEASURE_TYPES[Measure.type]
+    if measure_type.executor:
+        return partial(measure_type.runner, Measure, executor)
+
+    return partial(measure_type.runner, Measure)
+
+
+def run_measure(Measure, executor=None):
+    """
+    DESCRIPTION:
+        Runs the frame-wise runner corresponding to the type of the given Measure for the current frame.
+    """
+
+    get_runner(Measure, executor)()
+
+
+def collect_results(Measure):
+    """
+    DESCRIPTION:
+        Calls the collect function of the type of the given Measure (i.e. waits for pending PROPKA predictions), so its
+        result is complete.
+    """
+
+    measure_type = MEASURE_TYPES.get(Measure.type)
+    if measure_type is not None and measure_type.collect is not None:
+        measure_type.collect(Measure)
+
+
+def flush_sinks(measures):
+    """
+    DESCRIPTION:
+        Flushes the results of the measures that have a sink attached (see sinks.py). Pending results (i.e. PROPKA
+        predictions) are collected first.
+    """
+
+    for Measure in measures:
+        if Measure.sink is not None:
+            collect_results(Measure)
+            Measure.sink.flush(Measure)
+
+
+class BoundedExecutor:
+    """
+    DESCRIPTION:
+        Wrapper of an executor whose submit blocks while max_pending of its tasks are not finished, so the caller can not
+        queue an unbounded number of tasks (i.e. PROPKA predictions of the frames read ahead of the thread pool).
+    """
+
+    def __init__(self, executor, max_pending):
+        self.executor = executor
+        self.slots = BoundedSemaphore(max_pending)
+
+    def submit(self, fn, /, *args, **kwargs):
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self.slots.release())
+
+        return future
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+def has_updating_selection(Measure):
+    """
+    DESCRIPTION:
+        Checks if any selection of the Measure is an updating selection (re-evaluated in each frame, i.e. with around).
+    """
+
+    return any(isinstance(sel, UpdatingAtomGroup) for sel in Measure.sel)
+
+
+class SelectionSnapshots:
+    """
+    DESCRIPTION:
+        Tracks the updating selections (i.e. environments of selection-mode contacts measures) of the frame-wise
+        measures. In each frame, every updating selection is evaluated once into a static AtomGroup (snapshot), which
+        replaces it in the sel attribute of all the measures that use it. Measures sharing an environment pay its spatial
+        search once per frame, and repeated accesses to the snapshot (resnames, resids, select_atoms...) do not check
+        the selection again.
+
+    ATTRIBUTES:
+        - measures:     List of Measure objects with updating selections
+        - selections:   Original sel attribute of each of these measures
+        - groups:       List of the unique updating selections
+    """
+
+    def __init__(self, measures):
+        self.measures = [
+            Measure for Measure in measures if has_updating_selection(Measure)
+        ]
+        self.selections = [list(Measure.sel) for Measure in self.measures]
+
+        groups = {
+            id(sel): sel
+            for selections in self.selections
+            for sel in selections
+            if isinstance(sel, UpdatingAtomGroup)
+        }
+        self.groups = list(groups.values())
+
+    def update(self):
+        """
+        DESCRIPTION:
+            Evaluates the updating selections for the current frame and sets the snapshots in the measures.
+        """
+
+        if len(self.groups) == 0:
+            return
+
+        snapshots = {id(group): group.atoms for group in self.groups}
+        for Measure, selections in zip(self.measures, self.selections):
+            Measure.sel = [snapshots.get(id(sel), sel) for sel in selections]
+
+    def restore(self):
+        """
+        DESCRIPTION:
+            Sets the original (updating) selections back in the measures.
+        """
+
+        for Measure, selections in zip(self.measures, self.selections):
+            Measure.sel = selections
+
+
+class SharedTrajectory:
+    """
+    DESCRIPTION:
+        Wrapper of a (sliced) trajectory that copies the coordinates, box and index of each frame read into the current
+        timestep of other universes with the same atoms. Their selections (including updating ones) see the frame without
+        reading it from disk again.
+    """
+
+    def __init__(self, trajectory, universes):
+        self.trajectory = trajectory
+        self.universes = universes
+
+    def __len__(self):
+        return len(self.trajectory)
+
+    def __iter__(self):
+        for ts in self.trajectory:
+            for universe in self.universes:
+                shared = universe.trajectory.ts
+                shared.positions = ts.positions
+                shared.dimensions = ts.dimensions
+                shared.frame = ts.frame
+
+            yield ts
+
+
+class PrefetchedTrajectory:
+    """
+    DESCRIPTION:
+        Wrapper of a (sliced) trajectory whose frames are read ahead by a background thread, so the reading and decoding of
+        the next frames from disk overlaps with the calculation of the measures of the current one. The thread reads from an
+        independent copy of the reader into a queue of at most size frames, and the coordinates, box and index of each
+        frame are copied into the current timestep of the universe, as if it had been read by its own reader.
+    """
+
+    def __init__(self, trajectory, size):
+        self.trajectory = trajectory
+        self.size = size
+
+    def __len__(self):
+        return len(self.trajectory)
+
+    def __iter__(self):
+        # sliced trajectories (FrameIterators) keep the universe's reader in their trajectory attribute. The copy of the
+        # reader is sliced in the same way, so frames are read with the same (i.e. sequential) access.
+        reader = getattr(self.trajectory, "trajectory", self.trajectory)
+        copy = reader.copy()
+        if hasattr(self.trajectory, "frames"):
+            frames = copy[list(self.trajectory.frames)]
+        elif hasattr(self.trajectory, "step"):
+            frames = copy[
+                self.trajectory.start : self.trajectory.stop : self.trajectory.step
+            ]
+        else:
+            frames = copy
+
+        queue = Queue(maxsize=self.size)
+        stop = Event()
+        thread = Thread(
+            target=prefetch_frames,
+            args=(copy, frames, queue, stop),
+            daemon=True,
+        )
+        thread.start()
+
+        ts = reader.ts
+        try:
+            while True:
+                item = queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                ts.frame, ts.positions, ts.dimensions = item
+                yield ts
+
+        finally:
+            stop.set()
+            thread.join()
+            reader.rewind()
+
+
+def prefetch_frames(reader, frames, queue, stop):
+    """
+    DESCRIPTION:
+        Function executed by the thread of a PrefetchedTrajectory. Iterates the frames of its own reader and puts the
+        index, coordinates and box of each of them in the queue, followed by None at the end (or the exception raised while
+        reading). It stops when the stop event is set (i.e. the run was interrupted).
+    """
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    try:
+        for ts in frames:
+            dimensions = None if ts.dimensions is None else ts.dimensions.copy()
+            if not put((ts.frame, ts.positions.copy(), dimensions)):
+                return
+        put(None)
+
+    except Exception as exception:
+        put(exception)
+
+    finally:
+        reader.close()
+
+
+def run_frames(
+    trajectory,
+    measures,
+    block_size=1,
+    desc="Measuring",
+    progress=True,
+    flush_every=None,
+    on_flush=None,
+    universes=(),
+    prefetch=0,
+):
+    """
+    DESCRIPTION:
+        Runs the given measures over the frames of a (sliced) trajectory. Measures of a type with a block runner (see
+        registry.py) are computed by blocks of block_size frames, while the rest are computed frame by frame.
+
+    OPTIONS:
+        - trajectory:   MDAnalysis trajectory or sliced trajectory (FrameIterator) to iterate
+        - measures:     list of Measure objects to compute
+        - block_size:   number of frames stored before computing the block-compatible measures
+        - desc:         description shown in the progress bar
+        - progress:     show the progress bar
+        - flush_every:  number of frames after which the results of the measures with a sink are flushed
+        - on_flush:     function called as on_flush(last_frame) after each flush and at the end (i.e. write_checkpoint)
+        - universes:    other universes with the same atoms and trajectory whose measures are also computed. Each frame
+                        read is shared with them (see SharedTrajectory), so the trajectory is read once.
+        - prefetch:     number of frames read ahead by a background thread while the measures are computed (see
+                        PrefetchedTrajectory). 0 reads each frame when it is needed.
+    """
+
+    if prefetch > 0:
+        trajectory = PrefetchedTrajectory(trajectory, prefetch)
+
+    if len(universes) > 0:
+        trajectory = SharedTrajectory(trajectory, universes)
+
+    for Measure in measures:
+        if Measure.type not in MEASURE_TYPES:
+            print(
+                f"The {Measure.name} type is not available. If you need, you can create it."
+            )
+    measures = [Measure for Measure in measures if Measure.type in MEASURE_TYPES]
+
+    # the atoms of updating selections change in each frame, so their measures are computed frame by frame
+    by_block = [
+        MEASURE_TYPES[Measure.type].block_runner is not None
+        and (
+            MEASURE_TYPES[Measure.type].runner is None
+            or not has_updating_selection(Measure)
+        )
+        for Measure in measures
+    ]
+    block_measures = [
+        Measure for Measure, in_block in zip(measures, by_block) if in_block
+    ]
+    frame_measures = [
+        Measure for Measure, in_block in zip(measures, by_block) if not in_block
+    ]
+
+    for Measure in measures:
+        if MEASURE_TYPES[Measure.type].setup is not None:
+            MEASURE_TYPES[Measure.type].setup(Measure)
+
+    block = FrameBlock(block_measures, block_size)
+
+    # PROPKA subprocesses of all pka measures (types using an executor) share a pool of n_jobs threads
+    n_jobs = max(
+        [1]
+        + [
+            Measure.options.get("n_jobs", 1)
+            for Measure in frame_measures
+            if MEASURE_TYPES[Measure.type].executor
+        ]
+    )
+    # at most 2 predictions per thread are pending, so the frames do not run ahead of PROPKA writing scratch PDBs
+    executor = (
+        BoundedExecutor(ThreadPoolExecutor(max_workers=n_jobs), 2 * n_jobs)
+        if n_jobs > 1
+        else None
+    )
+
+    # frame-wise runners are looked up once, before the frame loop
+    runners = [get_runner(Measure, executor) for Measure in frame_measures]
+
+    # updating selections are evaluated once per frame for all the measures
+    snapshots = SelectionSnapshots(frame_measures)
+
+    n_frames = 0
+    last_frame = None
+    try:
+        for ts in tqdm(trajectory, desc=desc, unit="Frame", disable=not progress):
+            snapshots.update()
+            for runner in runners:
+                runner()
+
+            if len(block_measures) > 0:
+                block.add_frame(ts)
+
+            for Measure in measures:
+                Measure.frames.append(ts.frame)
+
+            n_frames += 1
+            last_frame = ts.frame
+            if flush_every is not None and n_frames % flush_every == 0:
+                block.flush()
+                flush_sinks(measures)
+                if on_flush is not None:
+                    on_flush(last_frame)
+
+        block.flush()
+
+    finally:
+        snapshots.restore()
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    for Measure in frame_measures:
+        collect_results(Measure)
+
+    flush_sinks(measures)
+    if on_flush is not None and last_frame is not None:
+        on_flush(last_frame)
+
+
+def run_chunk(
+    universe, measures, start, end, step, block_size=1, universes=(), prefetch=0
+):
+    """
+    DESCRIPTION:
+        Runs the given measures over the frames start:end:step of the universe's trajectory and returns the results and
+        frames of each measure. It is the function executed by each worker of run_frames_parallel, where the universe and the
+        measures arrive pickled, so the trajectory is reopened and the selections rebuilt in the worker process.
+    """
+
+    for Measure in measures:
+        Measure.reset_result()
+
+    run_frames(
+        universe.trajectory[start:end:step],
+        measures,
+        block_size=block_size,
+        progress=False,
+        universes=universes,
+        prefetch=prefetch,
+    )
+
+    return [(Measure.result, Measure.frames, Measure.aux) for Measure in measures]
+
+
+def run_frames_parallel(
+    universe,
+    measures,
+    start,
+    end,
+    step,
+    n_workers,
+    block_size=1,
+    desc="Measuring",
+    flush_every=None,
+    on_flush=None,
+    executor=None,
+    retries=0,
+    universes=(),
+    prefetch=0,
+    timeout=None,
+):
+    """
+    DESCRIPTION:
+        Splits the frames start:end:step of the universe's trajectory into n_workers contiguous chunks, computes each chunk
+        as a task of the executor (by default, a pool of n_workers processes) with run_chunk and appends the results to
+        each Measure's result in frame order.
+
+    OPTIONS:
+        - universe:     MDAnalysis universe whose trajectory is analysed
+        - measures:     list of Measure objects to compute
+        - start, end, step: slice of frames to analyse (0-based, end excluded)
+        - n_workers:    number of worker processes
+        - block_size:   number of frames stored before computing the block-compatible measures
+        - flush_every:  if any measure has a sink (or on_flush is given), chunks are limited to this number of frames and
+                        the sinks are flushed after merging each chunk
+        - on_flush:     function called as on_flush(last_frame) after merging each chunk (i.e. write_checkpoint)
+        - executor:     executor with the concurrent.futures interface (see executors.py) where the chunks are submitted. It
+                        is not shut down. If None, a LocalExecutor of n_workers processes is used.
+        - retries:      number of times a chunk whose task raises an exception is submitted again. If a worker dies and
+                        breaks the pool of processes, the other chunks in flight are submitted again too.
+        - universes:    other universes with the same atoms and trajectory whose measures are also computed (see run_frames).
+                        They are sent to the workers together with the measures.
+        - prefetch:     number of frames read ahead by each worker (see run_frames)
+        - timeout:      maximum number of seconds waited for the result of each chunk. A chunk that is not finished
+                        in time (i.e. its worker was lost) fails, its task is cancelled if it has not started and it is
+                        submitted again (counted against retries). None waits without limit. Tasks not started when the
+                        run fails are cancelled too.
+    """
+
+    frames = range(*slice(start, end, step).indices(len(universe.trajectory)))
+
+    n_chunks = n_workers
+    if flush_every is not None and (
+        on_flush is not None or any(Measure.sink is not None for Measure in measures)
+    ):
+        n_chunks = max(n_chunks, -(-len(frames) // flush_every))
+    chunks = [chunk for chunk in array_split(frames, n_chunks) if len(chunk) > 0]
+
+    # sinks are kept in the main process, and the copies sent to the workers have empty results (the results already
+    # merged would be pickled with every chunk otherwise)
+    worker_measures = []
+    for Measure in measures:
+        worker_measure = replace(Measure, sink=None)
+        worker_measure.reset_result()
+        worker_measures.append(worker_measure)
+
+    for Measure in measures:
+        if (
+            Measure.type in MEASURE_TYPES
+            and MEASURE_TYPES[Measure.type].setup is not None
+        ):
+            MEASURE_TYPES[Measure.type].setup(Measure)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = LocalExecutor(n_workers)
+
+    def submit(chunk):
+        return executor.submit(
+            run_chunk,
+            universe,
+            worker_measures,
+            int(chunk[0]),
+            int(chunk[-1]) + 1,
+            step,
+            block_size,
+            universes,
+            prefetch,
+        )
+
+    futures = []
+    try:
+        futures = [submit(chunk) for chunk in chunks]
+
+        # futures are merged in submission order, so results are kept in frame order
+        for index, chunk in enumerate(
+            tqdm(chunks, total=len(chunks), desc=desc, unit="Chunk")
+        ):
+            for attempt in range(retries + 1):
+                try:
+                    chunk_results = futures[index].result(timeout=timeout)
+                    break
+                except Exception as exception:
+                    futures[index].cancel()
+                    if attempt == retries:
+                        raise
+                    print(
+                        f"Chunk of frames {chunk[0]}-{chunk[-1]} failed ({exception!r}). Retrying."
+                    )
+
+                    # a dead worker breaks the pool, so the tasks in flight are lost too and are submitted again
+                    if isinstance(exception, BrokenExecutor):
+                        wait_futures(futures[index + 1 :])
+                        for later in range(index + 1, len(chunks)):
+                            if isinstance(futures[later].exception(), BrokenExecutor):
+                                futures[later] = submit(chunks[later])
+
+                    futures[index] = submit(chunk)
+
+            for Measure, (result, chunk_frames, aux) in zip(measures, chunk_results):
+                Measure.result.extend(result)
+                Measure.frames.extend(chunk_frames)
+                for key, values in aux.items():
+                    Measure.aux.setdefault(key, []).extend(values)
+
+            flush_sinks(measures)
+            if on_flush is not None:
+                on_flush(int(chunk[-1]))
+
+    finally:
+        # chunks not started when the run fails (or is interrupted) are not computed
+        for future in futures:
+            future.cancel()
+
+        if own_executor:
+            executor.shutdown(wait=True)
+
+
+def run_trajectory(
+    universe,
+    measures,
+    start,
+    end,
+    step,
+    incremental=False,
+    n_workers=1,
+    block_size=1,
+    flush_every=None,
+    on_flush=None,
+    executor=None,
+    retries=0,
+    universes=(),
+    prefetch=0,
+    timeout=None,
+):
+    """
+    DESCRIPTION:
+        Runs the given measures over the frames start:end:step of the universe's trajectory, serially (run_frames) or split
+        into chunks (run_frames_parallel). In incremental runs, only the frames that each measure does not cover yet are
+        computed (see pending_segments) and the results are sorted by frame.
+
+    OPTIONS:
+        - start, end, step: slice of frames to analyse (0-based, end excluded)
+        - incremental:  skip the frames already covered by each measure
+        - n_workers, executor, retries, timeout: parallel options (see run_frames_parallel). The run is parallel if
+                        n_workers > 1 or an executor is given.
+        - block_size, flush_every, on_flush, universes, prefetch: see run_frames
+    """
+
+    frames = range(*slice(start, end, step).indices(len(universe.trajectory)))
+
+    if incremental:
+        segments = pending_segments(measures, frames)
+    else:
+        segments = [(frames, measures)]
+
+    for segment, segment_measures in segments:
+        if n_workers > 1 or executor is not None:
+            run_frames_parallel(
+                universe,
+                segment_measures,
+                segment.start,
+                segment.stop,
+                step,
+                n_workers,
+                block_size=block_size,
+                flush_every=flush_every,
+                on_flush=on_flush,
+                executor=executor,
+                retries=retries,
+                universes=universes,
+                prefetch=prefetch,
+                timeout=timeout,
+            )
+
+        else:
+            run_frames(
+                universe.trajectory[segment.start : segment.stop : step],
+                segment_measures,
+                block_size=block_size,
+                flush_every=flush_every,
+                on_flush=on_flush,
+                universes=universes,
+                prefetch=prefetch,
+            )
+
+    # results of frames previous to the ones already calculated are put in frame order
+    if incremental:
+        for Measure in measures:
+            if Measure.sink is None:
+                sort_frames(Measure)
+
+
+def checkpoint_part(Measure, written=None):
+    """
+    DESCRIPTION:
+        Returns the part of the results of a Measure that is not in the checkpoint yet, as a tuple of (offset, result,
+        frames, sink offset, sink frames, {key: (offset, values)} of the auxiliary outputs), where each offset is the
+        position of the part in the container it extends (0 replaces the whole container). Also returns the lengths of the
+        containers, which are the written argument of the next call.
+
+    OPTIONS:
+        - Measure:      Measure object being computed
+        - written:      lengths returned by the previous call. None (the default) returns the whole results.
+    """
+
+    if written is None:
+        written = (0, 0, {})
+    n_result, n_sink, n_aux = written
+
+    # containers emptied since the previous call (i.e. flushed to a sink) are written again from the beginning
+    if len(Measure.result) < n_result:
+        n_result = 0
+    result = Measure.result if n_result == 0 else Measure.result[n_result:]
+
+    sink_frames = None if Measure.sink is None else list(Measure.sink.frames)
+    if sink_frames is not None and len(sink_frames) < n_sink:
+        n_sink = 0
+
+    aux = {}
+    for key, values in Measure.aux.items():
+        offset = n_aux.get(key, 0)
+        if len(values) < offset:
+            offset = 0
+        aux[key] = (offset, values[offset:])
+
+    part = (
+        n_result,
+        result,
+        Measure.frames[n_result:],
+        n_sink,
+        None if sink_frames is None else sink_frames[n_sink:],
+        aux,
+    )
+    lengths = (
+        len(Measure.result),
+        0 if sink_frames is None else len(sink_frames),
+        {key: len(values) for key, values in Measure.aux.items()},
+    )
+
+    return part, lengths
+
+
+def write_checkpoint(checkpoint, measures, last_frame, end, step, written=None):
+    """
+    DESCRIPTION:
+        Saves the partial results of a run, so it can be resumed with read_checkpoint. The checkpoint contains the result,
+        frames and auxiliary outputs of each measure, the frames already flushed to its sink and the last completed frame,
+        together with the end and step of the run.
+        The first call of a run writes the whole results to a temporary file first, so a crash never leaves a half-written
+        checkpoint. The next calls (given the written lengths returned by the previous one) only append the results added
+        since then, so the checkpoint of a run is written in a time proportional to its number of frames. A record left
+        half-written by a crash is ignored by read_checkpoint.
+
+    OPTIONS:
+        - checkpoint:   path of the checkpoint file
+        - measures:     list of Measure objects being computed
+        - last_frame:   index of the last frame whose results are included
+        - end, step:    end (excluded) and step of the frames of the run (0-based)
+        - written:      dictionary of name : lengths returned by the previous call of the run. None (the default) writes a
+                        new checkpoint.
+
+    OUTPUT:
+        - Dictionary of name : lengths of the results written, to be passed as written in the next call
+    """
+
+    # pending PROPKA predictions can not be pickled
+    for Measure in measures:
+        collect_results(Measure)
+
+    parts, lengths = {}, {}
+    for Measure in measures:
+        parts[Measure.name], lengths[Measure.name] = checkpoint_part(
+            Measure, None if written is None else written[Measure.name]
+        )
+
+    record = {"last_frame": last_frame, "end": end, "step": step, "measures": parts}
+
+    if written is None:
+        with open(f"{checkpoint}.tmp", "wb") as handle:
+            pickle.dump(record, handle)
+        replace_file(f"{checkpoint}.tmp", checkpoint)
+
+    else:
+        with open(checkpoint, "ab") as handle:
+            pickle.dump(record, handle)
+
+    return lengths
+
+
+class CheckpointWriter:
+    """
+    DESCRIPTION:
+        Function called as on_flush(last_frame) in a run to write its checkpoint (see write_checkpoint). It keeps the
+        lengths of the results already written, so each call only appends the new ones.
+
+    OPTIONS:
+        - checkpoint:   path of the checkpoint file
+        - measures:     list of Measure objects being computed
+        - end, step:    end (excluded) and step of the frames of the run (0-based)
+    """
+
+    def __init__(self, checkpoint, measures, end, step):
+        self.checkpoint = checkpoint
+        self.measures = measures
+        self.end = end
+        self.step = step
+        self.written = None
+
+    def __call__(self, last_frame):
+        self.written = write_checkpoint(
+            self.checkpoint,
+            self.measures,
+            last_frame,
+            self.end,
+            self.step,
+            written=self.written,
+        )
+
+
+def read_checkpoint(checkpoint, measures):
+    """
+    DESCRIPTION:
+        Restores the partial results saved by write_checkpoint into the given measures (dictionary of name : Measure) and
+        their sinks. The records of the checkpoint are applied in order, up to the last one completely written.
+
+    OUTPUT:
+        - List of names of the measures of the checkpoint
+        - First frame (0-based), end (excluded) and step of the frames that remain to be computed
+    """
+
+    records = []
+    with open(checkpoint, "rb") as handle:
+        while True:
+            try:
+                records.append(pickle.load(handle))
+            except (EOFError, pickle.UnpicklingError):
+                break
+
+    sink_frames = {}
+    for record in records:
+        for name, part in record["measures"].items():
+            if name not in measures:
+                raise KeyError(f"{name} measure of the checkpoint is not defined.")
+
+            offset, result, frames, sink_offset, new_sink_frames, aux = part
+            Measure = measures[name]
+            restored = name in sink_frames
+
+            if offset == 0 or not restored:
+                Measure.result = result
+                Measure.frames = list(frames)
+            else:
+                Measure.result.extend(result)
+                Measure.frames.extend(frames)
+
+            if new_sink_frames is None:
+                sink_frames[name] = None
+            elif sink_offset == 0 or not restored:
+                sink_frames[name] = list(new_sink_frames)
+            else:
+                sink_frames[name].extend(new_sink_frames)
+
+            if not restored:
+                Measure.aux = {}
+            for key, (aux_offset, values) in aux.items():
+                if aux_offset == 0:
+                    Measure.aux[key] = list(values)
+                else:
+                    Measure.aux[key].extend(values)
+
+    for name, frames in sink_frames.items():
+        Measure = measures[name]
+        if Measure.sink is not None and frames is not None:
+            Measure.sink.restore(frames)
+
+    last = records[-1]
+    return (
+        list(last["measures"].keys()),
+        last["last_frame"] + last["step"],
+        last["end"],
+        last["step"],
+    )
+
+
+def covered_frames(Measure):
+    """
+    DESCRIPTION:
+        Returns an array with the trajectory frame indices whose result the Measure already has, either in memory
+        (Measure.frames) or flushed to its sink.
+    """
+
+    frames = list(Measure.frames)
+    if Measure.sink is not None:
+        frames += list(Measure.sink.frames)
+
+    return asarray(frames, dtype=int64)
+
+
+def pending_segments(measures, frames):
+    """
+    DESCRIPTION:
+        Splits the given frames into segments of consecutive frames missing from the same measures, so each frame is read
+        once and only the measures that do not cover it yet are computed.
+
+    OPTIONS:
+        - measures:     list of Measure objects
+        - frames:       range of trajectory frame indices to cover
+
+    OUTPUT:
+        - List of (range of frames, list of Measure objects to compute in those frames) tuples, in frame order. Segments
+            where all the measures are already covered are left out.
+    """
+
+    if len(frames) == 0 or len(measures) == 0:
+        return []
+
+    # pending[m, f] is True if the frame f is missing from the measure m
+    pending = ~stack(
+        [isin(asarray(frames), covered_frames(Measure)) for Measure in measures]
+    )
+
+    bounds = flatnonzero((diff(pending, axis=1)).any(axis=0)) + 1
+    bounds = [0] + bounds.tolist() + [len(frames)]
+
+    segments = []
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        segment_measures = [
+            Measure for Measure, missing in zip(measures, pending[:, first]) if missing
+        ]
+        if len(segment_measures) > 0:
+            segments.append((frames[first:last], segment_measures))
+
+    return segments
+
+
+def sort_frames(Measure):
+    """
+    DESCRIPTION:
+        Sorts the results kept in memory (and their auxiliary outputs) by trajectory frame index, so results computed for
+        frames previous to the ones already present are placed in frame order.
+    """
+
+    if all(a < b for a, b in zip(Measure.frames[:-1], Measure.frames[1:])):
+        return
+
+    order = argsort(asarray(Measure.frames, dtype=int64), kind="stable").tolist()
+
+    if isinstance(Measure.result, ContactsResult):
+        result = Measure.result.empty()
+        # the labels table is copied, so the stored indices are valid in the sorted result
+        for label in Measure.result.labels:
+            result.intern(label)
+
+        indptr, rows, cols, distances = Measure.result.arrays()
+        for position in order:
+            window = slice(indptr[position], indptr[position + 1])
+            result.append_pairs(
+                rows[window],
+                cols[window],
+                None if distances is None else distances[window],
+            )
+        Measure.result = result
+
+    else:
+        Measure.result = [Measure.result[position] for position in order]
+
+    Measure.frames = [Measure.frames[position] for position in order]
+    Measure.aux = {
+        key: [values[position] for position in order]
+        for key, values in Measure.aux.items()
+    }
+
+
+def planar_angle_shape(Measure):
+    # measures of several pairs of planes store one angle per pair
+    if Measure.options.get("pairs", False):
+        return [len(Measure.sel) // 2]
+
+    return []
+
+
+# built-in measure types
+register_measure_type(
+    "distance",
+    runner=run_distance,
+    block_runner=run_distance_block,
+    adder=add_distance,
+    kind="value",
+)
+register_measure_type(
+    "angle",
+    runner=run_angle,
+    block_runner=run_angle_block,
+    adder=add_angle,
+    kind="value",
+)
+register_measure_type(
+    "dihedral",
+    runner=run_dihedral,
+    block_runner=run_dihedral_block,
+    adder=add_dihedral,
+    kind="value",
+)
+register_measure_type(
+    "planar_angle",
+    runner=run_planar_angle,
+    block_runner=run_planar_angle_block,
+    adder=add_planar_angle,
+    kind="value",
+    shape=planar_angle_shape,
+)
+register_measure_type(
+    "contacts", runner=run_contacts, adder=add_contacts, kind="contacts"
+)
+register_measure_type(
+    "RMSD",
+    runner=run_RMSD,
+    block_runner=run_RMSD_block,
+    adder=add_RMSD,
+    kind="value",
+)
+register_measure_type(
+    "pairwise_RMSD", block_runner=run_pairwise_RMSD_block, adder=add_pairwise_RMSD
+)
+register_measure_type(
+    "distWATbridge",
+    runner=run_distWATbridge,
+    block_runner=run_distWATbridge_block,
+    adder=add_distWATbridge,
+    kind="value",
+    shape=lambda Measure: (
+        [3] if Measure.options.get("top", 1) == 1 else [Measure.options["top"], 3]
+    ),
+)
+register_measure_type(
+    "hbonds",
+    runner=run_hbonds,
+    block_runner=run_hbonds_block,
+    adder=add_hbonds,
+    kind="contacts",
+)
+register_measure_type(
+    "pka",
+    runner=run_pka,
+    adder=add_pKa,
+    kind="dict",
+    setup=setup_pka,
+    collect=collect_pka,
+    executor=True,
+)
@@ -1,5 +1,116 @@
-# from ..exceptions import NotEqualListsLenghtError
-from MDAnalysis.core.groups import AtomGroup
+from .exceptions import NotEqualListsLenghtError
+from MDAnalysis.core.groups import AtomGroup, UpdatingAtomGroup
+
+from numpy import (
+    argsort,
+    asarray,
+    concatenate,
+    empty,
+    int64,
+    integer,
+    isin,
+    searchsorted,
+    unique,
+)
+from weakref import WeakKeyDictionary
+
+BACKBONE_NAMES = ["H", "N", "CA", "HA", "C", "O", "OXT", "H1", "H2", "H3"]
+
+# MDAnalysis selection keywords whose atoms depend on the coordinates, so they are not memoised
+COORDINATE_KEYWORDS = {
+    "around",
+    "sphzone",
+    "sphlayer",
+    "isolayer",
+    "cyzone",
+    "cylayer",
+    "point",
+    "prop",
+}
+
+# lookup tables and parsed selection strings of each universe
+SELECTION_CACHE = WeakKeyDictionary()
+
+
+def get_selection_cache(u):
+    """
+    DESCRIPTION
+        Returns the selection cache of a universe, creating it the first time. It contains the atoms sorted by residue
+        number (resid -> atoms lookup table) and the indices of the parsed selection strings.
+    """
+
+    if u not in SELECTION_CACHE:
+        resids = u.atoms.resids
+        order = argsort(resids, kind="stable")
+        SELECTION_CACHE[u] = {
+            "resid_order": order,
+            "sorted_resids": resids[order],
+            "strings": {},
+        }
+
+    return SELECTION_CACHE[u]
+
+
+def atom_numbers_to_indices(u, numbers):
+    """
+    DESCRIPTION
+        Converts atom numbers (1-based, as bynum) into atom indices. Numbers out of the universe are ignored.
+    """
+
+    indices = asarray(numbers, dtype=int64) - 1
+
+    return indices[(indices >= 0) & (indices < u.atoms.n_atoms)]
+
+
+def residue_numbers_to_indices(u, numbers):
+    """
+    DESCRIPTION
+        Converts residue numbers (as resid) into the indices of all their atoms using the resid -> atoms lookup table.
+    """
+
+    cache = get_selection_cache(u)
+    numbers = asarray(numbers, dtype=int64)
+    first = searchsorted(cache["sorted_resids"], numbers, side="left")
+    last = searchsorted(cache["sorted_resids"], numbers, side="right")
+
+    return concatenate(
+        [cache["resid_order"][f:l] for f, l in zip(first, last)]
+        + [empty(0, dtype=int64)]
+    )
+
+
+def string_to_indices(u, sel_string):
+    """
+    DESCRIPTION
+        Returns the indices of the atoms of a selection string. Strings that only depend on the topology are parsed once
+        per universe and memoised, while selections depending on the coordinates (i.e. around) are parsed each time.
+    """
+
+    if depends_on_coordinates(sel_string):
+        return u.select_atoms(sel_string).indices
+
+    strings = get_selection_cache(u)["strings"]
+    if sel_string not in strings:
+        strings[sel_string] = u.select_atoms(sel_string).indices
+
+    return strings[sel_string]
+
+
+def depends_on_coordinates(sel_string):
+    """
+    DESCRIPTION
+        Checks if a selection string has keywords whose atoms depend on the coordinates of the frame.
+    """
+
+    tokens = set(sel_string.replace("(", " ").replace(")", " ").split())
+
+    return len(tokens & COORDINATE_KEYWORDS) > 0 or (
+        "same" in tokens and len(tokens & {"x", "y", "z"}) > 0
+    )
+
+
+def is_number(sel_input):
+    return isinstance(sel_input, (int, integer)) and not isinstance(sel_input, bool)
 
 
 def selection(
@@ -8,6 +119,8 @@ def selection(
     """
     DESCRIPTION
         This function takes an input number or name and type of selection (atom or residue or none) and transforms it into an MDAnalysis selection. The input can also be a list of numbers or name and it can combine both types of input by using a list of selection types (of the same lenght).
+        Atom and residue numbers are converted into atom indices through lookup tables, and the rest of inputs are joined
+        into one selection string parsed once by MDAnalysis (and memoised), so long lists do not build long selection strings.
 
     INPUT
         - u: MDAnalysis' universe
@@ -19,72 +132,68 @@ def selection(
             res_name  -> residue name
             none/pipe -> pipes the selection command directly
         - no_backbone: bool. False is the default. True removes backbone atoms from selection
-        - return_atomic_sel_string: Returns the selection string defined by atom
+        - return_atomic_sel_string: Returns the selection string defined by atom indices ("index i j k ...")
 
     OUTPUT
         - MDAnalysis selection as AtomGroup
     """
 
-    if sel_type == None or sel_type.lower() in ("none", "pipe"):
-        sel_string = sel_input
+    if sel_type == None or (
+        isinstance(sel_type, str) and sel_type.lower() in ("none", "pipe")
+    ):
+        inputs, types = [sel_input], ["none"]
 
-    elif isinstance(sel_input, list):
+    elif isinstance(sel_input, (list, tuple)):
         if isinstance(sel_type, str):
-            if sel_type.lower() == "at_num":
-                sel_string = "bynum " + " or bynum ".join(str(at) for at in sel_input)
-            elif sel_type.lower() == "at_name":
-                sel_string = "name " + " or name ".join(sel_input)
-            elif sel_type.lower() == "res_num":
-                sel_string = "resid " + " or resid ".join(str(at) for at in sel_input)
-            elif sel_type.lower() == "res_name":
-                sel_string = "resname " + " or resname ".join(sel_input)
-            else:
-                sel_string = " or ".join(sel_input)
+            inputs, types = list(sel_input), [sel_type] * len(sel_input)
 
         elif isinstance(sel_type, list):
             if len(sel_input) != len(sel_type):
-                pass  # raise NotEqualListsLenghtError
-
-            else:
-                sel_string = ""
-                for inp, typ in zip(sel_input, sel_type):
-                    if sel_string == "":
-                        pass
-                    else:
-                        sel_string = "".join([sel_string, " or"])
-
-                    if typ.lower() == "at_num":
-                        sel_string = " ".join([sel_string, "bynum", str(inp)])
-                    elif typ.lower() == "at_name":
-                        sel_string = " ".join([sel_string, "name", str(inp)])
-                    elif typ.lower() == "res_num":
-                        sel_string = " ".join([sel_string, "resid", str(inp)])
-                    elif typ.lower() == "res_name":
-                        sel_string = " ".join([sel_string, "resname", str(inp)])
-                    else:
-                        sel_string = " ".join([sel_string, str(inp)])
-
-    elif isinstance(sel_input, (str, int)):
-        if sel_type.lower() == "at_num":
-            sel_string = " ".join(["bynum", str(sel_input)])
-        elif sel_type.lower() == "at_name":
-            sel_string = " ".join(["name", str(sel_input)])
-        elif sel_type.lower() == "res_num":
-            sel_string = " ".join(["resid", str(sel_input)])
-        elif sel_type.lower() == "res_name":
-            sel_string = " ".join(["resname", str(sel_input)])
+                raise NotEqualListsLenghtError
+
+            inputs, types = list(sel_input), sel_type
+
+    else:
+        inputs, types = [sel_input], [sel_type]
+
+    # atom and residue numbers are resolved with the lookup tables, other inputs are joined in a selection string
+    atom_numbers, residue_numbers, sel_strings = [], [], []
+    for inp, typ in zip(inputs, types):
+        typ = str(typ).lower()
+
+        if typ == "at_num" and is_number(inp):
+            atom_numbers.append(inp)
+        elif typ == "res_num" and is_number(inp):
+            residue_numbers.append(inp)
+        elif typ == "at_num":
+            sel_strings.append(f"bynum {inp}")
+        elif typ == "at_name":
+            sel_strings.append(f"name {inp}")
+        elif typ == "res_num":
+            sel_strings.append(f"resid {inp}")
+        elif typ == "res_name":
+            sel_strings.append(f"resname {inp}")
+        else:
+            sel_strings.append(str(inp))
+
+    indices = [
+        atom_numbers_to_indices(u, atom_numbers),
+        residue_numbers_to_indices(u, residue_numbers),
+    ]
+    if len(sel_strings) > 0:
+        indices.append(string_to_indices(u, " or ".join(sel_strings)))
+
+    # as MDAnalysis selections, atoms are sorted and unique
+    indices = unique(concatenate(indices).astype(int64))
 
     if no_backbone == True:
-        sel_string = (
-            sel_string
-            + " and not (name H or name N or name CA or name HA or name C or name O or name OXT or name H1 or name H2 or name H3)"
-        )
+        indices = indices[~isin(u.atoms.names[indices], BACKBONE_NAMES)]
 
     if return_atomic_sel_string == False:
-        return u.select_atoms(sel_string)
+        return u.atoms[indices]
 
     elif return_atomic_sel_string == True:
-        return "index " + " or index ".join(list(u.select_atoms(sel_string).indices))
+        return "index " + " ".join(str(index) for index in indices)
 
 
 def convert_selection(self, sel):
@@ -99,3 +208,39 @@ def convert_selection(self, sel):
 
     elif isinstance(sel, str):
         return self.selections[sel]
+
+
+def dynamic_selection(self, sel_string, **groups):
+    """
+    DESCRIPTION
+        Function that returns an updating AtomGroup (re-evaluated in each frame, i.e. environments selected with around) of
+        EMDA's universe. Updating selections with the same selection string and groups are created once per EMDA object
+        and shared by all the measures that use them, so they are evaluated once per frame (see SelectionSnapshots).
+
+    INPUT
+        - sel_string: MDAnalysis' selection string
+        - groups: AtomGroups used in the selection string (as group <name>)
+
+    OUTPUT
+        - MDAnalysis UpdatingAtomGroup
+    """
+
+    # static groups are identified by their atoms and updating groups by the object itself
+    key = (sel_string,) + tuple(
+        (
+            name,
+            (
+                id(group)
+                if isinstance(group, UpdatingAtomGroup)
+                else tuple(group.indices.tolist())
+            ),
+        )
+        for name, group in sorted(groups.items())
+    )
+
+    if key not in self.dynamic_selections:
+        self.dynamic_selections[key] = self.universe.select_atoms(
+            sel_string, updating=True, **groups
+        )
+
+    return self.dynamic_selections[key]
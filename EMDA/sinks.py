@@ -0,0 +1,116 @@
+from os import path
+
+from .store import create_store, append_store, read_store, open_column, truncate_store
+
+from numpy import int64
+
+"""
+DESCRIPTION
+    This Python file contains the sinks that can be attached to a Measure (Measure.sink) to stream its results out of
+    memory while EMDA.run is in progress. Every flush_every frames, run calls the flush method of the sink of each
+    measure, which receives the Measure with the results computed since the previous flush and empties them.
+
+HOW TO BUILD A SINK:
+    - Create a class with a flush(Measure) method that consumes Measure.result and Measure.frames and calls
+        Measure.clear_result() if the results have not to be kept in memory. Auxiliary outputs (Measure.aux) are kept.
+    - Add a frames attribute with the list of flushed frames and a reset() method, which is called when the measure is
+        recalculated.
+    - Add a restore(frames) method, which is called when a run is resumed from a checkpoint with the list of frames that
+        had been flushed when the checkpoint was written.
+"""
+
+
+class MemorySink:
+    """
+    DESCRIPTION:
+        Sink that keeps all the results in memory (Measure.result). It is the behaviour of measures without a sink.
+    """
+
+    def __init__(self):
+        self.frames = []
+
+    def flush(self, Measure):
+        pass
+
+    def reset(self):
+        pass
+
+    def restore(self, frames):
+        pass
+
+
+class ChunkedFileSink:
+    """
+    DESCRIPTION:
+        Sink that appends the results of each flush to a columnar store (see store.py) and empties them from memory, so
+        memory is bounded and all the flushed results are kept if the run crashes.
+
+    ATTRIBUTES:
+        - store:        Path of the columnar store
+        - overwrite:    If False and the store already exists, results are appended to it
+        - frames:       List of the frames already flushed to the store
+    """
+
+    def __init__(self, store, overwrite=True):
+        self.store = store
+        self.overwrite = overwrite
+        self.created = False
+        self.frames = []
+
+        if not overwrite and path.isdir(store):
+            self.frames = open_column(store, "frames", int64).tolist()
+            self.created = True
+
+    def flush(self, Measure):
+        if not self.created:
+            create_store(self.store, Measure)
+            self.created = True
+
+        if len(Measure.frames) > 0:
+            append_store(self.store, Measure.result, Measure.frames)
+            self.frames += list(Measure.frames)
+
+        Measure.clear_result()
+
+    def reset(self):
+        self.created = False
+        self.frames = []
+
+    def restore(self, frames):
+        # results flushed after the checkpoint are removed, so they are not duplicated when the run is resumed
+        if path.isdir(self.store):
+            truncate_store(self.store, len(frames))
+            self.created = True
+        self.frames = list(frames)
+
+    def read(self, start=None, end=None):
+        """
+        DESCRIPTION:
+            Returns the flushed results (and their frames) of the frames between start (included) and end (excluded).
+        """
+
+        return read_store(self.store, start=start, end=end)
+
+
+class CallbackSink:
+    """
+    DESCRIPTION:
+        Sink that calls callback(name, result, frames) with the results of each flush and empties them from memory.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.frames = []
+
+    def flush(self, Measure):
+        if len(Measure.frames) > 0:
+            self.callback(Measure.name, Measure.result, Measure.frames)
+            self.frames += list(Measure.frames)
+
+        Measure.clear_result()
+
+    def reset(self):
+        self.frames = []
+
+    def restore(self, frames):
+        self.frames = list(frames)
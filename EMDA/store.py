@@ -0,0 +1,413 @@
+from os import makedirs, path, replace, truncate
+import json
+import pickle
+
+from numpy import (
+    array,
+    asarray,
+    concatenate,
+    cumsum,
+    dtype,
+    empty,
+    float32,
+    float64,
+    int32,
+    int64,
+    flatnonzero,
+    memmap,
+    nan,
+    ndarray,
+    ones,
+    save,
+    where,
+    zeros,
+)
+
+from MDAnalysis.core.groups import AtomGroup
+
+from .results import ContactsResult
+from .registry import MEASURE_TYPES
+
+"""
+DESCRIPTION
+    This Python file contains the columnar store used to save the result of a Measure to disk. A store is a folder
+    (named *.emda by default) containing:
+        - meta.json:    name, type and options of the measure, kind of result, columns and residue labels tables
+        - sel*.npy:     indices of the atoms of each selection of the measure
+        - option_*.npy: options of the measure that are arrays (i.e. RMSD reference)
+        - *.bin:        one raw binary file per column. frames.bin contains the trajectory frame index of each result
+
+    Columns are only appended, so results can be added by chunks while EMDA.run is in progress and a window of frames
+    can be read through memory maps without loading the whole file.
+
+    Available kinds of result:
+        - value:    one float (or a fixed shape of floats) per frame (distance, angle, dihedral, planar_angle, RMSD,
+                    distWATbridge)
+        - contacts: a ContactsResult stored as per-frame counts of contacts and their rows, cols and distances
+        - dict:     per-frame dictionaries of residue : value (pka), stored as per-frame counts, cols and values
+"""
+
+
+def get_store_kind(Measure):
+    """
+    DESCRIPTION:
+        Function that returns the kind of columnar store of the Measure's result, or None if it can not be stored in columns.
+    """
+
+    # the kind is declared when the type is registered (see registry.py)
+    measure_type = MEASURE_TYPES.get(Measure.type)
+    if measure_type is None:
+        return None
+
+    # contacts in the old output format are not stored in a ContactsResult
+    if measure_type.kind == "contacts" and not isinstance(
+        Measure.result, ContactsResult
+    ):
+        return None
+
+    return measure_type.kind
+
+
+def create_store(store, Measure):
+    """
+    DESCRIPTION:
+        Function that creates an empty columnar store for the given Measure. An existing store with the same name is overwritten.
+    """
+
+    kind = get_store_kind(Measure)
+    if kind is None:
+        raise TypeError(f"{Measure.type} results can not be saved in a columnar store.")
+
+    makedirs(store, exist_ok=True)
+
+    # selections are stored as arrays of atom indices, other items are kept in the metadata
+    selections = []
+    for s, sel in enumerate(Measure.sel):
+        if isinstance(sel, AtomGroup):
+            save(path.join(store, f"sel{s}.npy"), sel.indices)
+            selections.append(f"sel{s}.npy")
+        else:
+            selections.append(sel)
+
+    options = {}
+    for option, value in Measure.options.items():
+        if isinstance(value, ndarray):
+            save(path.join(store, f"option_{option}.npy"), value)
+            options[option] = f"option_{option}.npy"
+        else:
+            options[option] = value
+
+    meta = {
+        "name": Measure.name,
+        "type": Measure.type,
+        "kind": kind,
+        "options": options,
+        "selections": selections,
+        "labels": [],
+    }
+
+    if kind == "value":
+        meta["columns"] = {"value": "float64"}
+        shape = MEASURE_TYPES[Measure.type].shape
+        meta["shape"] = [] if shape is None else list(shape(Measure))
+
+    elif kind == "contacts":
+        meta["columns"] = {
+            "counts": "int64",
+            "rows": "int32",
+            "cols": "int32",
+            "distances": "float32",
+        }
+        meta["mode"] = Measure.result.mode
+        meta["distances"] = Measure.result.has_distances
+        meta["keys"] = [Measure.result.labels[k] for k in Measure.result.key_index]
+        # key residues are the first labels, as in ContactsResult
+        meta["labels"] = list(dict.fromkeys(meta["keys"]))
+
+    elif kind == "dict":
+        meta["columns"] = {"counts": "int64", "cols": "int32", "values": "float64"}
+
+    write_meta(store, meta)
+
+    for column in list(meta["columns"].keys()) + ["frames"]:
+        open(path.join(store, f"{column}.bin"), "wb").close()
+
+
+def read_meta(store):
+    """
+    DESCRIPTION:
+        Function that reads the metadata of a columnar store.
+    """
+
+    with open(path.join(store, "meta.json")) as handle:
+        return json.load(handle)
+
+
+def write_meta(store, meta):
+    """
+    DESCRIPTION:
+        Function that (re)writes the metadata of a columnar store. It is written to a temporary file first, so a crash never
+        leaves a half-written metadata file.
+    """
+
+    with open(path.join(store, "meta.json.tmp"), "w") as handle:
+        json.dump(meta, handle, default=str)
+    replace(path.join(store, "meta.json.tmp"), path.join(store, "meta.json"))
+
+
+def append_column(store, column, values, dtype_):
+    with open(path.join(store, f"{column}.bin"), "ab") as handle:
+        handle.write(asarray(values, dtype=dtype_).tobytes())
+
+
+def append_store(store, result, frames):
+    """
+    DESCRIPTION:
+        Function that appends a chunk of results (and the frame index of each of them) to an existing columnar store.
+        The frames column is written last, so the results of an interrupted append are ignored when reading.
+    """
+
+    meta = read_meta(store)
+    kind = meta["kind"]
+
+    if len(frames) != len(result):
+        raise ValueError("The number of results and frames to append is not the same.")
+
+    if kind == "value":
+        # missing values (None) are stored as NaN
+        values = array(list(result), dtype=float64).reshape(
+            [len(result)] + meta["shape"]
+        )
+        append_column(store, "value", values, float64)
+
+    elif kind == "contacts":
+        if not isinstance(result, ContactsResult):
+            chunk = ContactsResult(
+                mode=meta["mode"], labels=meta["keys"], distances=meta["distances"]
+            )
+            chunk.extend(result)
+            result = chunk
+
+        mapping = intern_labels(store, meta, result.labels)
+        indptr, rows, cols, distances = result.arrays()
+
+        if len(cols) > 0:
+            rows = where(rows >= 0, mapping[rows.clip(0)], rows)
+            cols = mapping[cols]
+
+        append_column(store, "counts", indptr[1:] - indptr[:-1], int64)
+        append_column(store, "rows", rows, int32)
+        append_column(store, "cols", cols, int32)
+        if distances is not None:
+            append_column(store, "distances", distances, float32)
+
+    elif kind == "dict":
+        labels = list(dict.fromkeys(label for r in result for label in r.keys()))
+        mapping = intern_labels(store, meta, labels)
+        local_index = {label: l for l, label in enumerate(labels)}
+
+        append_column(store, "counts", [len(r) for r in result], int64)
+        append_column(
+            store,
+            "cols",
+            [mapping[local_index[label]] for r in result for label in r.keys()],
+            int32,
+        )
+        append_column(
+            store,
+            "values",
+            [nan if v is None else v for r in result for v in r.values()],
+            float64,
+        )
+
+    append_column(store, "frames", frames, int64)
+
+
+def intern_labels(store, meta, labels):
+    """
+    DESCRIPTION:
+        Function that adds the labels not yet present to the labels table of the store and returns an array with the
+        position of each of the given labels in the table.
+    """
+
+    label_index = {label: l for l, label in enumerate(meta["labels"])}
+    new_labels = [label for label in labels if label not in label_index]
+
+    if len(new_labels) > 0:
+        for label in new_labels:
+            label_index[label] = len(meta["labels"])
+            meta["labels"].append(label)
+        write_meta(store, meta)
+
+    return array([label_index[label] for label in labels], dtype=int32)
+
+
+def truncate_store(store, n_frames):
+    """
+    DESCRIPTION:
+        Function that removes from a columnar store all the results after the first n_frames, so it can be appended again
+        from that point (i.e. when resuming a run from a checkpoint).
+    """
+
+    meta = read_meta(store)
+
+    if meta["kind"] == "value":
+        row_size = 8 * int(array(meta["shape"], dtype=int64).prod())
+        truncate(path.join(store, "value.bin"), n_frames * row_size)
+
+    else:
+        counts = open_column(store, "counts", int64, length=n_frames)
+        n_items = int(counts.sum())
+        del counts
+
+        truncate(path.join(store, "counts.bin"), n_frames * 8)
+        for column, dtype_ in meta["columns"].items():
+            if column != "counts":
+                truncate(
+                    path.join(store, f"{column}.bin"), n_items * dtype(dtype_).itemsize
+                )
+
+    truncate(path.join(store, "frames.bin"), n_frames * 8)
+
+
+def write_store(store, Measure):
+    """
+    DESCRIPTION:
+        Function that saves the result of a Measure in a new columnar store. If the Measure has no frames attribute (or it
+        is empty), results are numbered from 0.
+    """
+
+    frames = getattr(Measure, "frames", [])
+    if len(frames) != len(Measure.result):
+        frames = list(range(len(Measure.result)))
+
+    create_store(store, Measure)
+    append_store(store, Measure.result, frames)
+
+
+def open_column(store, column, dtype_, shape=(), length=None):
+    """
+    DESCRIPTION:
+        Function that opens a column of the store as a read-only memory map. length limits the number of rows mapped.
+    """
+
+    filename = path.join(store, f"{column}.bin")
+    row_size = dtype(dtype_).itemsize * int(array(shape, dtype=int64).prod())
+    n_rows = path.getsize(filename) // row_size
+
+    if length is not None:
+        n_rows = min(n_rows, length)
+
+    if n_rows == 0:
+        return empty((0,) + tuple(shape), dtype=dtype_)
+
+    return memmap(filename, dtype=dtype_, mode="r", shape=(n_rows,) + tuple(shape))
+
+
+def nan_to_none(values):
+    """
+    DESCRIPTION:
+        Function that replaces the NaN of a (nested) list of values by None, as missing values are given in the results.
+    """
+
+    if isinstance(values, list):
+        return [nan_to_none(value) for value in values]
+
+    return None if values != values else values
+
+
+def read_store(store, start=None, end=None):
+    """
+    DESCRIPTION:
+        Function that reads the results of a columnar store whose trajectory frame index is between start (included) and
+        end (excluded). Columns are memory mapped, so only the requested window is read from disk.
+
+    OUTPUT:
+        - Result in the same format than the result attribute of the Measure (list or ContactsResult)
+        - List with the frame index of each result
+    """
+
+    meta = read_meta(store)
+    kind = meta["kind"]
+
+    frames = open_column(store, "frames", int64)
+    mask = ones(len(frames), dtype=bool)
+    if start is not None:
+        mask &= frames >= start
+    if end is not None:
+        mask &= frames < end
+    positions = flatnonzero(mask)
+
+    if kind == "value":
+        values = open_column(
+            store, "value", float64, shape=meta["shape"], length=len(frames)
+        )[positions]
+
+        if meta["shape"]:
+            result = nan_to_none(values.tolist())
+        else:
+            result = values.tolist()
+
+        return result, frames[positions].tolist()
+
+    counts = open_column(store, "counts", int64, length=len(frames))
+    offsets = concatenate([zeros(1, dtype=int64), cumsum(counts)])
+
+    cols = open_column(store, "cols", int32)
+    if kind == "contacts":
+        rows = open_column(store, "rows", int32)
+        distances = (
+            open_column(store, "distances", float32) if meta["distances"] else None
+        )
+    elif kind == "dict":
+        values = open_column(store, "values", float64)
+
+    if kind == "contacts":
+        result = ContactsResult(
+            mode=meta["mode"], labels=meta["keys"], distances=meta["distances"]
+        )
+        # the labels table of the store is copied, so stored indices are valid in the result
+        for label in meta["labels"]:
+            result.intern(label)
+
+        for position in positions:
+            window = slice(offsets[position], offsets[position + 1])
+            result.append_pairs(
+                rows[window],
+                cols[window],
+                None if distances is None else distances[window],
+            )
+
+    elif kind == "dict":
+        result = []
+        for position in positions:
+            window = slice(offsets[position], offsets[position + 1])
+            result.append(
+                {
+                    meta["labels"][c]: v
+                    for c, v in zip(cols[window].tolist(), values[window].tolist())
+                }
+            )
+
+    return result, frames[positions].tolist()
+
+
+def read_pickled_measure(filename):
+    """
+    DESCRIPTION:
+        Function that reads a measure saved with save_result in a pickle file, which contains its result followed by its
+        frames. Pickle files of previous versions only contain the result, so their frames are returned empty.
+
+    OUTPUT:
+        - Result in the format it was saved (list, ContactsResult or matrix)
+        - List with the frame index of each result
+    """
+
+    with open(filename, "rb") as handle:
+        result = pickle.load(handle)
+        try:
+            frames = pickle.load(handle)
+        except EOFError:
+            frames = []
+
+    return result, frames
@@ -1,23 +1,13 @@
-from os import path, mkdir, chdir
+from os import makedirs
 
 
 def check_folder(folder):
     """
     DESCRIPTION:
-        Function to check if a requested folder exists and move to it. If it does not exist, it is created and then the directory is changed.
+        Function to check if a requested folder exists. If it does not exist, it is created (including its parents).
     """
 
-    folder = folder.split("/")
-    current_path = path.abspath(".")
-
-    for f in folder:
-        if f != "":
-            if not path.isdir(f):
-                mkdir(f)
-
-            chdir(f)
-
-    chdir(current_path)
+    makedirs(folder, exist_ok=True)
 
 
 def get_most_frequent(list_):
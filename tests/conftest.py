@@ -0,0 +1,240 @@
+import warnings
+
+import MDAnalysis as mda
+import numpy as np
+import pytest
+
+from EMDA import EMDA
+from EMDA.results import ContactsResult
+
+RESNAMES = ["ALA", "ARG", "GLU", "SER", "LYS", "TYR", "ASP", "GLY", "HIE", "LEU"] * 2
+N_WATERS = 40
+N_FRAMES = 30
+BOX = [30.0, 30.0, 40.0, 90.0, 90.0, 90.0]
+
+
+def write_system(folder):
+    """
+    Writes a small protein-like chain (5 heavy atoms per residue) solvated by rigid waters in a periodic box, with a
+    trajectory of N_FRAMES frames wrapped into the box (so some residues cross its edges), split in two halves too.
+    """
+
+    rng = np.random.default_rng(0)
+    n_protein = 5 * len(RESNAMES)
+    n_atoms = n_protein + 3 * N_WATERS
+    n_residues = len(RESNAMES) + N_WATERS
+    resindices = np.concatenate(
+        [
+            np.repeat(np.arange(len(RESNAMES)), 5),
+            np.repeat(np.arange(len(RESNAMES), n_residues), 3),
+        ]
+    )
+
+    u = mda.Universe.empty(
+        n_atoms, n_residues=n_residues, atom_resindex=resindices, trajectory=True
+    )
+    u.add_TopologyAttr(
+        "name",
+        ["N", "CA", "C", "O", "CB"] * len(RESNAMES) + ["O", "H1", "H2"] * N_WATERS,
+    )
+    u.add_TopologyAttr(
+        "type", ["N", "C", "C", "O", "C"] * len(RESNAMES) + ["O", "H", "H"] * N_WATERS
+    )
+    u.add_TopologyAttr("resname", RESNAMES + ["WAT"] * N_WATERS)
+    u.add_TopologyAttr("resid", np.arange(1, n_residues + 1))
+    u.add_TopologyAttr("segid", ["A"])
+    u.add_TopologyAttr("chainID", ["A"] * n_atoms)
+    u.add_TopologyAttr(
+        "masses",
+        [14.0, 12.0, 12.0, 16.0, 12.0] * len(RESNAMES) + [16.0, 1.0, 1.0] * N_WATERS,
+    )
+
+    positions = np.zeros((n_atoms, 3))
+    for r in range(len(RESNAMES)):
+        center = [15 + 4 * np.cos(r * 1.7), 15 + 4 * np.sin(r * 1.7), 2 + 2 * r]
+        positions[5 * r : 5 * r + 5] = center + rng.normal(0, 0.8, (5, 3))
+    for w in range(N_WATERS):
+        oxygen = rng.uniform(0, 1, 3) * BOX[:3]
+        if w < 15:
+            # waters close to the chain, so there are bridges and hydrogen bonds
+            oxygen = positions[5 * w + 3] + rng.normal(0, 2.0, 3)
+        water = n_protein + 3 * w
+        positions[water : water + 3] = oxygen + np.array(
+            [[0, 0, 0], [0.96, 0, 0], [-0.24, 0.93, 0]]
+        )
+
+    u.atoms.positions = positions
+    u.dimensions = BOX
+
+    pdb = str(folder / "system.pdb")
+    u.atoms.write(pdb)
+
+    protein = slice(0, n_protein)
+    frames = []
+    for _ in range(N_FRAMES):
+        frame = positions.copy()
+        frame[protein] += rng.normal(0, 0.4, frame[protein].shape)
+        # waters move as rigid bodies
+        shifts = rng.normal(0, 0.6, (N_WATERS, 3))
+        frame[n_protein:] += np.repeat(shifts, 3, axis=0)
+        frames.append(frame)
+
+    trajectories = {}
+    for name, window in (
+        ("trajectory", slice(0, N_FRAMES)),
+        ("first_half", slice(0, N_FRAMES // 2)),
+        ("second_half", slice(N_FRAMES // 2, N_FRAMES)),
+    ):
+        trajectories[name] = str(folder / f"{name}.dcd")
+        with mda.Writer(trajectories[name], n_atoms) as writer:
+            for frame in frames[window]:
+                # atoms are wrapped into the box, so residues and waters cross its edges
+                u.atoms.positions = frame % BOX[:3]
+                writer.write(u.atoms)
+
+    return pdb, trajectories
+
+
+@pytest.fixture(scope="session")
+def system(tmp_path_factory):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return write_system(tmp_path_factory.mktemp("system"))
+
+
+def add_measures(e):
+    """
+    Adds one measure of each built-in type (but pKa, which needs PROPKA) to an EMDA object.
+    """
+
+    e.select("a", [1, 2, 3], sel_type="res_num")
+    e.select("b", [7, 8], sel_type="res_num")
+    e.select("a1", 3, sel_type="at_num")
+    e.select("a2", 8, sel_type="at_num")
+    e.select("a3", 13, sel_type="at_num")
+    e.select("a4", 22, sel_type="at_num")
+    e.select("p1", [1, 2, 3], sel_type="at_num")
+    e.select("p2", [11, 12, 13], sel_type="at_num")
+    e.select("all", "all")
+
+    for type in ("min", "max", "com", "cog"):
+        e.add_distance(f"distance_{type}", "a", "b", type=type)
+    e.add_distance("distance_pbc", "a", "b", pbc=True)
+    e.add_angle("angle", "a1", "a2", "a3")
+    e.add_dihedral("dihedral", "a1", "a2", "a3", "a4")
+    e.add_planar_angle("planar_angle", "p1", "p2")
+    e.add_RMSD("RMSD", "a", rotations=True)
+    e.add_RMSD("RMSD_no_superposition", "a", superposition=False)
+    e.add_pairwise_RMSD("pairwise_RMSD", "a")
+    e.add_contacts("contacts_selection", "a", sel_env=5)
+    e.add_contacts("contacts_protein", "protein", sel_env=4)
+    e.add_contacts("contacts_protein_pbc", "protein", sel_env=4, pbc=True)
+    e.add_distWATbridge(
+        "bridges", "a", "b", sel1_rad=6, sel2_rad=6, top=2, two_water=True
+    )
+    e.add_hbonds("hbonds", "all", d_a_cutoff=3.5, angle_cutoff=120)
+
+    return e
+
+
+@pytest.fixture(scope="session")
+def build(system):
+    """
+    Returns a function that creates an EMDA object of the test system (or of the given trajectory) with all the measures.
+    """
+
+    pdb, trajectories = system
+
+    def build(trajectory="trajectory", measures=True):
+        if isinstance(trajectory, str):
+            trajectory = trajectories[trajectory]
+        else:
+            trajectory = [trajectories[name] for name in trajectory]
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            e = EMDA(pdb, trajectory)
+
+        return add_measures(e) if measures else e
+
+    return build
+
+
+def results(e):
+    """
+    Returns the result, frames and aux of each measure as plain Python objects.
+    """
+
+    return {
+        name: [as_plain(Measure.result), list(Measure.frames), as_plain(Measure.aux)]
+        for name, Measure in e.measures.items()
+    }
+
+
+def as_plain(value):
+    if isinstance(value, ContactsResult):
+        return [as_plain(frame) for frame in value]
+    if isinstance(value, dict):
+        return {key: as_plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [as_plain(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return as_plain(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+
+    return value
+
+
+def assert_close(a, b, path="result"):
+    """
+    Asserts that two plain results are equal, comparing floats with the tolerance of float32 coordinates.
+    """
+
+    if isinstance(a, dict):
+        assert isinstance(b, dict) and a.keys() == b.keys(), path
+        for key in a:
+            assert_close(a[key], b[key], f"{path}[{key!r}]")
+
+    elif isinstance(a, list):
+        assert isinstance(b, list) and len(a) == len(b), path
+        for i, (x, y) in enumerate(zip(a, b)):
+            assert_close(x, y, f"{path}[{i}]")
+
+    elif isinstance(a, float) and isinstance(b, (int, float)):
+        assert np.isclose(
+            a, b, rtol=1e-4, atol=1e-4, equal_nan=True
+        ), f"{path}: {a} != {b}"
+
+    else:
+        assert a == b, f"{path}: {a!r:.200} != {b!r:.200}"
+
+
+def assert_same_results(a, b):
+    assert a.keys() == b.keys()
+    for name in a:
+        assert_close(a[name], b[name], name)
+
+
+@pytest.fixture(scope="session")
+def reference(build):
+    """
+    Results of the serial frame-by-frame run (block_size=1), the reference of the other run modes.
+    """
+
+    e = build()
+    e.run(block_size=1)
+
+    return results(e)
+
+
+@pytest.fixture(scope="session")
+def computed(build):
+    """
+    EMDA object with all the measures computed with the default run options.
+    """
+
+    e = build()
+    e.run()
+
+    return e
@@ -0,0 +1,60 @@
+from collections import Counter
+
+import pytest
+
+from conftest import N_FRAMES, assert_close
+
+
+@pytest.mark.parametrize("name", ["contacts_protein", "contacts_selection"])
+@pytest.mark.parametrize("percentage", [False, True])
+@pytest.mark.parametrize("normalise", [False, True])
+def test_contacts_frequency(computed, name, percentage, normalise):
+    frames = list(computed.measures[name].result)
+    computed.analyse_contacts_frequency(
+        "frequency",
+        name,
+        percentage=percentage,
+        normalise_to_most_frequent=normalise,
+    )
+    result = computed.analyses["frequency"].result
+
+    if name == "contacts_protein":
+        # protein mode ignores normalise_to_most_frequent
+        scale = 100 / N_FRAMES if percentage else 1
+        expected = {residue: {} for residue in frames[0]}
+        for frame in frames:
+            for residue, partners in frame.items():
+                for partner in partners:
+                    expected[residue][partner] = expected[residue].get(partner, 0) + 1
+        expected = {
+            residue: {partner: count * scale for partner, count in partners.items()}
+            for residue, partners in expected.items()
+        }
+
+    else:
+        counts = Counter(residue for frame in frames for residue in frame)
+        total = max(counts.values()) if normalise else N_FRAMES if percentage else 1
+        scale = (100 if percentage else 1) / total
+        expected = {residue: count * scale for residue, count in counts.items()}
+
+        # residues are kept in order of appearance
+        assert list(result) == list(counts)
+
+    assert sum(len(frame) for frame in frames) > 0
+    assert_close(result, expected, name)
+
+
+@pytest.mark.parametrize("name", ["contacts_protein", "contacts_selection"])
+def test_contacts_amount(computed, name):
+    frames = list(computed.measures[name].result)
+    computed.analyse_contacts_amount("amount", name)
+
+    if name == "contacts_protein":
+        expected = [
+            {residue: len(partners) for residue, partners in frame.items()}
+            for frame in frames
+        ]
+    else:
+        expected = [len(frame) for frame in frames]
+
+    assert computed.analyses["amount"].result == expected
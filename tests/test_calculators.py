@@ -0,0 +1,367 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+from MDAnalysis.analysis import rms
+from MDAnalysis.lib import distances as mdadist
+
+from EMDA.exceptions import (
+    NotEqualListsLenghtError,
+    NotEqualSelectionsListsLenghtError,
+)
+from EMDA.selection import depends_on_coordinates, selection, string_to_indices
+
+from conftest import N_FRAMES, assert_close
+
+INTERACTIONS = [
+    "ARG", "HIS", "HID", "HIE", "HIP", "LYS", "ASP", "ASH", "GLU", "GLH", "SER", "THR", "ASN",
+    "GLN", "CYS", "SEC", "GLY", "PRO", "ALA", "ILE", "LEU", "MET", "PHE", "TRP", "TYR", "VAL",
+]  # fmt: skip
+
+
+@pytest.fixture(scope="module")
+def universe(build):
+    return build(measures=False).universe
+
+
+def frames(u):
+    for ts in u.trajectory:
+        yield ts
+    u.trajectory[0]
+
+
+def label(residue):
+    return residue.resname + str(residue.resid)
+
+
+def test_distances(universe, reference):
+    a = universe.select_atoms("resid 1 2 3")
+    b = universe.select_atoms("resid 7 8")
+
+    expected = {"min": [], "max": [], "com": [], "cog": [], "pbc": []}
+    for ts in frames(universe):
+        matrix = mdadist.distance_array(a.positions, b.positions)
+        expected["min"].append(matrix.min())
+        expected["max"].append(matrix.max())
+        expected["com"].append(np.linalg.norm(a.center_of_mass() - b.center_of_mass()))
+        expected["cog"].append(
+            np.linalg.norm(a.center_of_geometry() - b.center_of_geometry())
+        )
+        expected["pbc"].append(
+            mdadist.distance_array(a.positions, b.positions, box=ts.dimensions).min()
+        )
+
+    for type, values in expected.items():
+        assert_close(reference[f"distance_{type}"][0], [float(v) for v in values], type)
+
+
+def test_angles(universe, reference):
+    a1, a2, a3, a4 = (universe.atoms[[n - 1]] for n in (3, 8, 13, 22))
+    p1, p2 = universe.atoms[[0, 1, 2]], universe.atoms[[10, 11, 12]]
+
+    angles, dihedrals, planar = [], [], []
+    for ts in frames(universe):
+        angles.append(
+            np.rad2deg(mdadist.calc_angles(a1.positions, a2.positions, a3.positions)[0])
+        )
+        dihedral = mdadist.calc_dihedrals(
+            a1.positions, a2.positions, a3.positions, a4.positions
+        )
+        dihedrals.append(np.rad2deg(dihedral[0]) % 360)
+
+        normals = [
+            np.cross(p.positions[2] - p.positions[0], p.positions[1] - p.positions[0])
+            for p in (p1, p2)
+        ]
+        cosine = normals[0] @ normals[1] / np.prod(np.linalg.norm(normals, axis=1))
+        planar.append(np.rad2deg(np.arccos(cosine)))
+
+    assert_close(reference["angle"][0], [float(v) for v in angles], "angle")
+    assert_close(reference["dihedral"][0], [float(v) for v in dihedrals], "dihedral")
+    assert_close(
+        reference["planar_angle"][0], [float(v) for v in planar], "planar_angle"
+    )
+
+
+def test_planar_angle_pairs(build):
+    e = build(measures=False)
+    for name, atoms in {
+        "p1": [1, 2, 3],
+        "p2": [11, 12, 13],
+        "p3": [6, 7, 8],
+        "p4": [16, 17, 18],
+    }.items():
+        e.select(name, atoms, sel_type="at_num")
+    e.add_planar_angle("first", "p1", "p2")
+    e.add_planar_angle("second", "p3", "p4")
+    e.add_planar_angle("pairs", ["p1", "p3"], ["p2", "p4"])
+    e.run(block_size=7)
+
+    # all the pairs of planes are measured at once in each frame
+    first, second = e.measures["first"].result, e.measures["second"].result
+    assert_close(
+        [list(angles) for angles in e.measures["pairs"].result],
+        [[float(a), float(b)] for a, b in zip(first, second)],
+    )
+
+    with pytest.raises(NotEqualSelectionsListsLenghtError):
+        e.add_planar_angle("wrong", ["p1", "p3"], ["p2"])
+
+
+def test_RMSD(universe, reference):
+    sel = universe.select_atoms("resid 1 2 3")
+    ref = sel.positions.copy()
+    ref_com = ref - sel.center_of_mass()
+
+    superposed, plain = [], []
+    for ts in frames(universe):
+        superposed.append(rms.rmsd(sel.positions, ref, center=True, superposition=True))
+        plain.append(rms.rmsd(sel.positions - sel.center_of_mass(), ref_com))
+
+    assert_close(reference["RMSD"][0], superposed, "RMSD")
+    assert_close(reference["RMSD_no_superposition"][0], plain, "RMSD_no_superposition")
+
+    # the rotations superpose each centered frame onto the centered reference with the RMSD of the frame
+    rotations = np.asarray(reference["RMSD"][2]["rotations"])
+    assert rotations.shape == (N_FRAMES, 3, 3)
+    for ts, rotation, value in zip(frames(universe), rotations, superposed):
+        centered = sel.positions - sel.positions.mean(axis=0)
+        rotated = centered @ rotation
+        assert np.isclose(rms.rmsd(rotated, ref - ref.mean(axis=0)), value, atol=1e-4)
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"tile_size": 7}, {"tile_size": 4, "n_workers": 2}, {"matrix_file": True}],
+)
+def test_RMSD_matrix_and_clustering(computed, universe, tmp_path, options):
+    if options.get("matrix_file"):
+        options = {"tile_size": 8, "matrix_file": str(tmp_path / "matrix.npy")}
+
+    computed.analyse_RMSD_matrix("matrix", "pairwise_RMSD", **options)
+    matrix = np.asarray(computed.analyses["matrix"].result)
+
+    sel = universe.select_atoms("resid 1 2 3")
+    coords = [sel.positions.copy() for ts in frames(universe)]
+    expected = np.array(
+        [
+            [rms.rmsd(x, y, center=True, superposition=True) for y in coords]
+            for x in coords
+        ]
+    )
+    assert np.allclose(matrix, expected, atol=1e-4)
+    if "matrix_file" in options:
+        assert np.allclose(np.load(options["matrix_file"]), expected, atol=1e-4)
+
+    computed.analyse_clustering("clusters", "matrix", n_clusters=4)
+    labels = computed.analyses["clusters"].result
+    medoids = computed.analyses["clusters"].options["medoids"]
+
+    # each frame belongs to the cluster of its closest medoid, and each medoid to its own cluster
+    assert len(medoids) == 4 and len(labels) == N_FRAMES
+    assert labels == np.argmin(expected[medoids], axis=0).tolist()
+    assert [labels[medoid] for medoid in medoids] == list(range(4))
+
+
+def test_contacts_protein(universe, reference):
+    protein = universe.select_atoms("protein")
+    residues = protein.residues
+
+    for pbc in (False, True):
+        expected = []
+        for ts in frames(universe):
+            contacts = {label(residue): {} for residue in residues}
+            for ref in residues:
+                for env in residues:
+                    # residues whose number is equal to the reference residue index are skipped
+                    if (
+                        env == ref
+                        or env.resid == ref.resindex
+                        or env.resname not in INTERACTIONS
+                    ):
+                        continue
+
+                    # the environment is searched across the box edges, as with around
+                    periodic = mdadist.distance_array(
+                        ref.atoms.positions, env.atoms.positions, box=ts.dimensions
+                    ).min()
+                    if periodic > 4:
+                        continue
+
+                    plain = mdadist.distance_array(
+                        ref.atoms.positions, env.atoms.positions
+                    ).min()
+                    contacts[label(ref)][label(env)] = float(periodic if pbc else plain)
+            expected.append(contacts)
+
+        name = "contacts_protein_pbc" if pbc else "contacts_protein"
+        assert_close(reference[name][0], expected, name)
+
+
+def test_contacts_selection(universe, reference):
+    sel = universe.select_atoms("resid 1 2 3")
+
+    expected = []
+    for ts in frames(universe):
+        others = universe.atoms - sel
+        periodic = mdadist.distance_array(
+            others.positions, sel.positions, box=ts.dimensions
+        )
+        env = others[periodic.min(axis=1) <= 5]
+
+        contacts = {}
+        for residue in env.residues:
+            if (
+                residue.resid in sel.residues.resindices
+                or residue.resname not in INTERACTIONS
+            ):
+                continue
+            contacts[label(residue)] = float(
+                mdadist.distance_array(sel.positions, residue.atoms.positions).min()
+            )
+        expected.append(contacts)
+
+    assert_close(reference["contacts_selection"][0], expected, "contacts_selection")
+
+
+def test_water_bridges(universe, reference):
+    sel1 = universe.select_atoms("resid 1 2 3")
+    sel2 = universe.select_atoms("resid 7 8")
+    waters = universe.select_atoms("resname WAT").residues
+
+    bridges, two_water = [], []
+    for ts in frames(universe):
+        distances = {}
+        for water in waters:
+            d1 = mdadist.distance_array(sel1.positions, water.atoms.positions).min()
+            d2 = mdadist.distance_array(sel2.positions, water.atoms.positions).min()
+            distances[water.resid] = (
+                float(d1) if d1 <= 6 else np.inf,
+                float(d2) if d2 <= 6 else np.inf,
+            )
+
+        bridging = sorted(
+            (resid for resid, (d1, d2) in distances.items() if np.isfinite(d1 + d2)),
+            key=lambda resid: sum(distances[resid]) / 2,
+        )[:2]
+        frame = [[resid, *distances[resid]] for resid in bridging]
+        bridges.append(frame + [[None, None, None]] * (2 - len(frame)))
+
+        best = [None] * 5
+        for first in waters:
+            for second in waters:
+                d1, d2 = distances[first.resid][0], distances[second.resid][1]
+                if first == second or not np.isfinite(d1 + d2):
+                    continue
+                between = mdadist.distance_array(
+                    first.atoms.positions, second.atoms.positions
+                ).min()
+                if between <= 3.5 and (
+                    best[0] is None or d1 + between + d2 < best[2] + best[3] + best[4]
+                ):
+                    best = [first.resid, second.resid, d1, float(between), d2]
+        two_water.append(best)
+
+    assert_close(reference["bridges"][0], bridges, "bridges")
+    assert_close(reference["bridges"][2]["two_water"], two_water, "two_water")
+
+
+def test_hbonds(computed, reference):
+    Measure = computed.measures["hbonds"]
+    donors, hydrogens, acceptors = Measure.sel
+
+    def atom_label(atom):
+        return f"{atom.resname}{atom.resid}:{atom.name}"
+
+    expected = []
+    for ts in frames(computed.universe):
+        distances = mdadist.distance_array(donors.positions, acceptors.positions)
+        hbonds = {}
+        for d, a in zip(*np.nonzero(distances <= 3.5)):
+            if donors[d] == acceptors[a]:
+                continue
+            angle = mdadist.calc_angles(
+                donors.positions[d], hydrogens.positions[d], acceptors.positions[a]
+            )
+            if np.rad2deg(angle) >= 120:
+                hbonds[(atom_label(donors[d]), atom_label(acceptors[a]))] = float(
+                    distances[d, a]
+                )
+        expected.append(hbonds)
+
+    assert sum(len(frame) for frame in expected) > 0
+    result = [
+        {tuple(key): value for key, value in frame.items()}
+        for frame in reference["hbonds"][0]
+    ]
+    assert_close(result, expected, "hbonds")
+
+    computed.analyse_hbonds_frequency("frequency", "hbonds")
+    computed.analyse_hbonds_frequency(
+        "residues", "hbonds", level="residue", percentage=True
+    )
+
+    counts = Counter(pair for frame in expected for pair in frame)
+    assert computed.analyses["frequency"].result == dict(counts)
+    assert list(computed.analyses["frequency"].result.values()) == sorted(
+        counts.values(), reverse=True
+    )
+
+    residues = Counter(
+        pair
+        for frame in expected
+        for pair in {
+            (donor.split(":")[0], acceptor.split(":")[0]) for donor, acceptor in frame
+        }
+    )
+    assert_close(
+        computed.analyses["residues"].result,
+        {pair: count * 100 / N_FRAMES for pair, count in residues.items()},
+    )
+
+
+def test_selection_lookup_tables(universe):
+    cases = [
+        (([1, 2, 5], "res_num"), "resid 1 2 5"),
+        ((7, "res_num"), "resid 7"),
+        (([1, 30, 200], "at_num"), "bynum 1 30 200"),
+        (
+            ([3, "CA", "WAT"], ["res_num", "at_name", "res_name"]),
+            "resid 3 or name CA or resname WAT",
+        ),
+        (("resid 2:4", None), "resid 2:4"),
+        (([900], "res_num"), "resid 900"),
+    ]
+
+    for (sel_input, sel_type), sel_string in cases:
+        expected = universe.select_atoms(sel_string)
+        assert selection(universe, sel_input, sel_type) == expected, sel_string
+        assert selection(
+            universe, sel_input, sel_type, return_atomic_sel_string=True
+        ) == ("index " + " ".join(str(index) for index in expected.indices))
+
+    no_backbone = selection(universe, [1, 2], "res_num", no_backbone=True)
+    assert no_backbone == universe.select_atoms("resid 1 2 and not backbone")
+
+    # each input needs its selection type
+    with pytest.raises(NotEqualListsLenghtError):
+        selection(universe, [3, "CA", "WAT"], ["res_num", "at_name"])
+
+
+def test_coordinate_selections_are_not_memoised(universe):
+    sel_string = "resname WAT and around 4 resid 1"
+
+    assert depends_on_coordinates(sel_string)
+    assert depends_on_coordinates("same residue as (point 1 2 3 4)")
+    assert depends_on_coordinates("same x as resid 1")
+    assert not depends_on_coordinates("resid 1 2 and name CA")
+    assert not depends_on_coordinates("same residue as resname WAT")
+
+    seen = set()
+    for ts in frames(universe):
+        indices = string_to_indices(universe, sel_string)
+        assert indices.tolist() == universe.select_atoms(sel_string).indices.tolist()
+        seen.add(tuple(indices.tolist()))
+
+    # the environment changes along the trajectory
+    assert len(seen) > 1
@@ -0,0 +1,47 @@
+import warnings
+
+from EMDA import EMDAEnsemble
+
+from conftest import add_measures, assert_same_results, results
+
+
+def build_ensemble(system):
+    pdb, trajectories = system
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        ensemble = EMDAEnsemble(
+            {
+                "full": (pdb, [trajectories["trajectory"]]),
+                "halves": (
+                    pdb,
+                    {
+                        "first": trajectories["first_half"],
+                        "second": trajectories["second_half"],
+                    },
+                ),
+            }
+        )
+
+    return add_measures(ensemble)
+
+
+def test_ensemble_workers_match_serial(system, reference):
+    serial, parallel = build_ensemble(system), build_ensemble(system)
+    serial.run()
+    parallel.run(n_workers=2, block_size=5)
+
+    assert [key for key, _ in parallel] == [
+        ("full", 1),
+        ("halves", "first"),
+        ("halves", "second"),
+    ]
+    assert_same_results(results(parallel[("full", 1)]), reference)
+    for key, member in parallel:
+        assert_same_results(results(member), results(serial[key]))
+
+    # broadcast analysers return the output of each replica
+    parallel.analyse_contacts_frequency("frequency", "contacts_protein")
+    frequencies = parallel.results("frequency")
+    assert list(frequencies) == [key for key, _ in parallel]
+    assert frequencies[("full", 1)] != frequencies[("halves", "first")]
@@ -0,0 +1,211 @@
+import os
+import time
+
+import pytest
+
+from EMDA.exceptions import LostTaskError
+from EMDA.executors import FileQueueExecutor, LocalExecutor
+from EMDA.registry import MEASURE_TYPES, register_measure_type
+
+from conftest import N_FRAMES, assert_same_results, results
+
+
+def test_local_executor(build, reference):
+    e = build()
+    executor = LocalExecutor(2)
+    try:
+        e.run(executor=executor, n_workers=3, block_size=4)
+    finally:
+        executor.shutdown()
+
+    assert_same_results(results(e), reference)
+
+
+class RecordingExecutor(LocalExecutor):
+    def __init__(self, n_workers):
+        super().__init__(n_workers)
+        self.submitted = []
+
+    def submit(self, fn, /, *args, **kwargs):
+        self.submitted.append([(len(M.result), M.frames, M.aux) for M in args[1]])
+        return super().submit(fn, *args, **kwargs)
+
+
+def test_workers_receive_empty_results(build, reference):
+    e = build()
+    e.run(end=15)
+
+    # the results of the first frames are not sent with the chunks of the rest
+    executor = RecordingExecutor(2)
+    try:
+        e.run(incremental=True, executor=executor, n_workers=3, flush_every=5)
+    finally:
+        executor.shutdown()
+
+    assert len(executor.submitted) == 3
+    for measures in executor.submitted:
+        for n_results, frames, aux in measures:
+            assert n_results == 0 and frames == []
+            assert all(len(values) == 0 for values in aux.values())
+    assert_same_results(results(e), reference)
+
+
+def test_file_queue_executor(build, reference, tmp_path):
+    e = build()
+    executor = FileQueueExecutor(
+        str(tmp_path / "queue"), n_workers=2, poll_interval=0.05
+    )
+    try:
+        e.run(executor=executor, n_workers=3, flush_every=7)
+    finally:
+        executor.shutdown()
+
+    assert_same_results(results(e), reference)
+    for folder in ("jobs", "running", "results"):
+        assert os.listdir(tmp_path / "queue" / folder) == []
+
+
+def write_after(filename, seconds):
+    time.sleep(seconds)
+    open(filename, "w").close()
+    return filename
+
+
+def test_file_queue_executor_cancel(tmp_path):
+    executor = FileQueueExecutor(
+        str(tmp_path / "queue"), n_workers=1, poll_interval=0.05
+    )
+    try:
+        running = executor.submit(write_after, str(tmp_path / "running"), 1)
+        while os.listdir(tmp_path / "queue" / "running") == []:
+            time.sleep(0.05)
+        queued = executor.submit(write_after, str(tmp_path / "queued"), 0)
+        done = executor.submit(write_after, str(tmp_path / "done"), 0)
+
+        assert running.cancel() and queued.cancel()
+    finally:
+        executor.shutdown()
+
+    # the running task finishes, but its result is discarded, and the queued one is never run
+    assert running.cancelled() and queued.cancelled()
+    assert done.result() == str(tmp_path / "done")
+    assert os.path.exists(tmp_path / "running") and not os.path.exists(
+        tmp_path / "queued"
+    )
+    for folder in ("jobs", "running", "results"):
+        assert os.listdir(tmp_path / "queue" / folder) == []
+
+
+def test_file_queue_executor_late_result_of_lost_task(tmp_path):
+    # heartbeats are sent less often than the timeout, so the running task is considered lost
+    executor = FileQueueExecutor(
+        str(tmp_path / "queue"),
+        n_workers=1,
+        poll_interval=0.05,
+        heartbeat=5,
+        timeout=0.5,
+    )
+    try:
+        future = executor.submit(write_after, str(tmp_path / "slow"), 1.5)
+        assert isinstance(future.exception(), LostTaskError)
+    finally:
+        executor.shutdown()
+
+    # the slow worker finishes the task, but its late result is removed
+    assert os.path.exists(tmp_path / "slow")
+    for folder in ("jobs", "running", "results"):
+        assert os.listdir(tmp_path / "queue" / folder) == []
+
+
+def run_dying(Measure):
+    # the worker that computes the first frame dies once, as if it had been killed
+    if not os.path.exists(Measure.options["mark"]):
+        open(Measure.options["mark"], "w").close()
+        os._exit(1)
+
+    Measure.result.append(float(Measure.sel[0].positions[0, 0]))
+
+
+@pytest.fixture
+def dying_type():
+    register_measure_type("dying", runner=run_dying)
+    yield "dying"
+    del MEASURE_TYPES["dying"]
+
+
+def add_dying(e, dying_type, mark):
+    e.select("a", 1, sel_type="res_num")
+    e.measures["dying"] = e.Measure(
+        name="dying",
+        type=dying_type,
+        sel=[e.selections["a"]],
+        options={"mark": mark},
+        result=[],
+    )
+
+
+def dying_result(e):
+    return [
+        float(ts.positions[e.selections["a"].indices[0], 0])
+        for ts in e.universe.trajectory
+    ]
+
+
+@pytest.mark.parametrize("own_executor", [False, True])
+def test_local_executor_dead_worker(build, tmp_path, dying_type, own_executor):
+    e = build(measures=False)
+    add_dying(e, dying_type, str(tmp_path / "killed"))
+
+    # the pool is broken by the dead worker, so all the chunks in flight are submitted again to a new one
+    executor = None if own_executor else LocalExecutor(2)
+    try:
+        e.run(executor=executor, n_workers=3, retries=1)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    assert os.path.exists(tmp_path / "killed")
+    assert e.measures["dying"].frames == list(range(N_FRAMES))
+    assert e.measures["dying"].result == dying_result(e)
+
+
+def test_file_queue_executor_lost_worker(build, tmp_path, dying_type):
+    e = build(measures=False)
+    add_dying(e, dying_type, str(tmp_path / "killed"))
+
+    # workers are forked after the type is registered
+    executor = FileQueueExecutor(
+        str(tmp_path / "queue"),
+        n_workers=3,
+        poll_interval=0.05,
+        heartbeat=0.5,
+        timeout=3,
+    )
+    try:
+        e.run(executor=executor, n_workers=2, retries=2)
+    finally:
+        executor.shutdown()
+
+    assert os.path.exists(tmp_path / "killed")
+    assert e.measures["dying"].frames == list(range(N_FRAMES))
+    assert e.measures["dying"].result == dying_result(e)
+    assert os.listdir(tmp_path / "queue" / "running") == []
+
+
+def test_run_timeout_without_workers(build, tmp_path):
+    e = build(measures=False)
+    e.select("a", [1, 2, 3], sel_type="res_num")
+    e.select("b", [7, 8], sel_type="res_num")
+    e.add_distance("distance", "a", "b")
+
+    executor = FileQueueExecutor(
+        str(tmp_path / "queue"), n_workers=0, poll_interval=0.05
+    )
+    try:
+        with pytest.raises(TimeoutError):
+            e.run(executor=executor, n_workers=2, retries=1, timeout=0.5)
+    finally:
+        # the tasks left in the queue are cancelled, so the executor does not wait for them
+        executor.shutdown()
+
+    assert os.listdir(tmp_path / "queue" / "jobs") == []
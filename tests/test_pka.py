@@ -0,0 +1,126 @@
+import os
+import shutil
+import time
+
+import pytest
+
+import EMDA.runners
+from EMDA.cache import pka_cache_key, read_cache, write_cache
+
+from conftest import assert_close
+
+pytest.importorskip("propka")
+pytestmark = pytest.mark.skipif(
+    shutil.which("propka3") is None, reason="PROPKA is not installed"
+)
+
+N_PKA_FRAMES = 6
+
+
+def run_pka(build, tmp_path, **options):
+    e = build(measures=False)
+    e.add_pKa("pka", pdb_folder=str(tmp_path / "pdbs"), **options)
+    e.run(end=N_PKA_FRAMES)
+
+    return e.measures["pka"]
+
+
+@pytest.fixture(scope="module")
+def serial_pkas(build, tmp_path_factory):
+    return run_pka(build, tmp_path_factory.mktemp("serial")).result
+
+
+def test_pka_thread_pool(build, tmp_path, serial_pkas):
+    Measure = run_pka(build, tmp_path, n_jobs=3)
+
+    assert len(serial_pkas) == N_PKA_FRAMES and all(serial_pkas)
+    assert Measure.frames == list(range(N_PKA_FRAMES))
+    assert_close(Measure.result, serial_pkas)
+    # the scratch PDBs and .pka files are removed
+    assert os.listdir(tmp_path / "pdbs") == []
+
+
+def test_pka_keeps_one_file_per_frame(build, tmp_path):
+    run_pka(build, tmp_path, n_jobs=2, keep_pdb=True, keep_pka=True)
+
+    files = os.listdir(tmp_path / "pdbs")
+    for extension in (".pdb", ".pka"):
+        names = sorted(name for name in files if name.endswith(extension))
+        assert len(names) == N_PKA_FRAMES
+        assert [name.split("_")[0] for name in names] == [
+            f"frame{frame}" for frame in range(N_PKA_FRAMES)
+        ]
+
+
+def test_pka_predictions_in_flight_are_bounded(build, tmp_path, monkeypatch):
+    predict_pka = EMDA.runners.predict_pka
+    pending = []
+
+    # slow predictions, so the frames would run ahead of the thread pool
+    def slow_predict_pka(pdb, **kwargs):
+        pending.append(
+            len(
+                [
+                    name
+                    for name in os.listdir(tmp_path / "pdbs")
+                    if name.endswith(".pdb")
+                ]
+            )
+        )
+        time.sleep(0.1)
+        return predict_pka(pdb, **kwargs)
+
+    monkeypatch.setattr(EMDA.runners, "predict_pka", slow_predict_pka)
+    e = build(measures=False)
+    e.add_pKa("pka", pdb_folder=str(tmp_path / "pdbs"), n_jobs=2)
+    e.run(end=16)
+
+    assert len(e.measures["pka"].result) == 16
+    # 2 predictions per thread, plus the PDB of the frame waiting to be submitted
+    assert max(pending) <= 2 * 2 + 1
+
+
+def test_pka_cache_hits(build, tmp_path, serial_pkas, monkeypatch):
+    cache = str(tmp_path / "cache")
+    Measure = run_pka(build, tmp_path, n_jobs=2, cache_folder=cache)
+    assert_close(Measure.result, serial_pkas)
+    assert len(os.listdir(cache)) == N_PKA_FRAMES
+
+    # all the frames are read from the cache, so PROPKA is not run again
+    def fail(*args, **kwargs):
+        raise AssertionError("PROPKA has been run for a cached frame")
+
+    monkeypatch.setattr(EMDA.runners, "predict_pka", fail)
+    Measure = run_pka(build, tmp_path, n_jobs=2, cache_folder=cache)
+
+    assert_close(Measure.result, serial_pkas)
+    assert os.listdir(tmp_path / "pdbs") == []
+
+
+def test_pka_cache_key(build):
+    e = build(measures=False)
+    protein = e.universe.select_atoms("protein")
+
+    key = pka_cache_key(protein, "neutral")
+    assert pka_cache_key(protein, "neutral") == key
+    assert pka_cache_key(protein, "low-pH") != key
+
+    e.universe.trajectory[1]
+    assert pka_cache_key(protein, "neutral") != key
+    e.universe.trajectory[0]
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = str(tmp_path / "cache")
+    for n, key in enumerate("abcd"):
+        write_cache(cache, key, {"value": n})
+        os.utime(os.path.join(cache, f"{key}.json"), (n, n))
+    size = os.path.getsize(os.path.join(cache, "a.json"))
+
+    # reading an entry marks it as recently used
+    assert read_cache(cache, "a") == {"value": 0}
+    assert read_cache(cache, "missing") is None
+
+    write_cache(cache, "e", {"value": 4}, max_size=3 * size)
+
+    assert sorted(os.listdir(cache)) == ["a.json", "d.json", "e.json"]
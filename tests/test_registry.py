@@ -0,0 +1,64 @@
+import pytest
+
+from EMDA.registry import MEASURE_TYPES, register_measure_type
+
+from conftest import N_FRAMES, as_plain, assert_close
+
+
+def add_x_coordinate(self, name, sel, block=True):
+    self.measures[name] = self.Measure(
+        name=name,
+        type="x_coordinate" if block else "x_coordinate_frames",
+        sel=[self.selections[sel]],
+        options={},
+        result=[],
+    )
+
+
+def run_x_coordinate(Measure):
+    Measure.result.append(float(Measure.sel[0].positions[0, 0]))
+
+
+def run_x_coordinate_block(Measure, coords, box=None):
+    Measure.result.extend(float(x) for x in coords[0][:, 0, 0])
+
+
+@pytest.fixture
+def x_coordinate():
+    register_measure_type(
+        "x_coordinate",
+        block_runner=run_x_coordinate_block,
+        adder=add_x_coordinate,
+        kind="value",
+    )
+    register_measure_type("x_coordinate_frames", runner=run_x_coordinate)
+    yield
+    del MEASURE_TYPES["x_coordinate"], MEASURE_TYPES["x_coordinate_frames"]
+
+
+def test_registered_measure_type(build, x_coordinate, tmp_path):
+    # the adder of a type registered before creating the EMDA object is loaded as a method
+    e = build(measures=False)
+    e.select("a", 1, sel_type="res_num")
+    e.add_x_coordinate("block", "a")
+    e.add_x_coordinate("frames", "a", block=False)
+    e.run(block_size=7, n_workers=2)
+
+    expected = [
+        float(ts.positions[e.selections["a"].indices[0], 0])
+        for ts in e.universe.trajectory
+    ]
+    for name in ("block", "frames"):
+        assert e.measures[name].frames == list(range(N_FRAMES))
+        assert_close(e.measures[name].result, expected, name)
+
+    # the kind of the type sets the columnar store of its results
+    e.save_result("block", str(tmp_path / "block.emda"))
+    e.read_result(str(tmp_path / "block_measure.emda"), "frames", type="m")
+    assert_close(as_plain(e.measures["frames"].result), expected)
+
+
+def test_register_needs_a_runner():
+    with pytest.raises(ValueError):
+        register_measure_type("no_runner")
+    assert "no_runner" not in MEASURE_TYPES
@@ -0,0 +1,67 @@
+import pickle
+
+import pytest
+
+from EMDA.results import ContactsResult
+
+from conftest import assert_close
+
+FRAMES = {
+    "protein": [
+        {"ALA1": {"SER4": 2.5, "GLU3": 3.0}, "SER4": {"ALA1": 2.5}, "GLU3": {}},
+        {"ALA1": {}, "SER4": {}, "GLU3": {"LYS5": 3.5}},
+    ],
+    "selection": [{"SER4": 2.5, "LYS5": 3.25}, {}, {"ARG2": 1.5}],
+    "pairs": [{("SER4:O", "WAT21:O"): 2.75, ("WAT21:O", "SER4:O"): 2.75}, {}],
+}
+
+
+@pytest.mark.parametrize("mode", FRAMES)
+def test_contacts_result_behaves_as_list_of_dicts(mode):
+    labels = ["ALA1", "SER4", "GLU3"] if mode == "protein" else None
+    result = ContactsResult(mode=mode, labels=labels)
+    result.extend(FRAMES[mode])
+
+    assert len(result) == len(FRAMES[mode])
+    assert list(result) == FRAMES[mode]
+    assert result[-1] == FRAMES[mode][-1]
+    assert result[1:] == FRAMES[mode][1:]
+    with pytest.raises(IndexError):
+        result[len(FRAMES[mode])]
+
+    # emptied results keep the key residues, so their frames are built in the same way
+    empty = result.empty()
+    assert len(empty) == 0 and empty.mode == mode
+    empty.extend(result)
+    assert list(empty) == FRAMES[mode]
+
+    assert list(pickle.loads(pickle.dumps(result))) == FRAMES[mode]
+
+
+def test_contacts_result_arrays_and_pairs():
+    result = ContactsResult(mode="protein", labels=["ALA1", "SER4"], distances=False)
+    result.append_pairs([0, 1], [1, 0])
+    result.append({"ALA1": {"GLU3": None}, "SER4": {}})
+
+    indptr, rows, cols, distances = result.arrays()
+    assert indptr.tolist() == [0, 2, 3]
+    assert rows.tolist() == [0, 1, 0] and cols.tolist() == [1, 0, 2]
+    assert distances is None
+    assert result.labels == ["ALA1", "SER4", "GLU3"]
+    assert list(result) == [
+        {"ALA1": {"SER4": None}, "SER4": {"ALA1": None}},
+        {"ALA1": {"GLU3": None}, "SER4": {}},
+    ]
+
+
+def test_contacts_results_of_the_run(computed):
+    for name in ("contacts_selection", "contacts_protein", "hbonds"):
+        result = computed.measures[name].result
+        assert isinstance(result, ContactsResult)
+
+        # merging chunks of frames (as the parallel runs do) gives the same result
+        merged, chunk = result.empty(), result.empty()
+        merged.extend(result[:10])
+        chunk.extend(result[10:])
+        merged.extend(chunk)
+        assert_close(list(merged), list(result), name)
@@ -0,0 +1,282 @@
+import pickle
+import threading
+
+import numpy as np
+import pytest
+
+import EMDA.runners
+from EMDA import EMDAGroup, ChunkedFileSink
+from EMDA.exceptions import NotCheckpointError, NotKnownFramesError
+from EMDA.runners import PrefetchedTrajectory
+
+from conftest import N_FRAMES, as_plain, assert_close, assert_same_results, results
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"block_size": 7},
+        {"block_size": 100},
+        {"n_workers": 2},
+        {"n_workers": 3, "block_size": 4},
+        {"prefetch": 4},
+        {"prefetch": 1, "block_size": 1},
+        {"prefetch": 3, "n_workers": 2},
+    ],
+)
+def test_run_modes_match_serial(build, reference, options):
+    e = build()
+    e.run(**options)
+
+    assert_same_results(results(e), reference)
+
+
+@pytest.mark.parametrize(
+    "options", [{"block_size": 5}, {"n_workers": 2}, {"block_size": 5, "prefetch": 2}]
+)
+def test_step_and_start(build, reference, options):
+    e = build()
+    e.run(start=3, step=4, **options)
+
+    for name, (result, frames, aux) in results(e).items():
+        assert frames == list(range(2, N_FRAMES, 4))
+        if name != "RMSD_no_superposition" and name != "RMSD":
+            assert_close(result, reference[name][0][2::4], name)
+
+
+@pytest.mark.parametrize("options", [{"block_size": 10}, {"n_workers": 2}])
+def test_updating_selections_in_block_runs(build, options):
+    e = build(measures=False)
+    e.select("a", [1, 2, 3], sel_type="res_num")
+    near = e.universe.select_atoms(
+        "resname WAT and around 8 group a", a=e.selections["a"], updating=True
+    )
+    e.add_distance("distance", "a", near, type="cog")
+    e.run(**options)
+
+    # the water atoms near the selection are found again in each frame
+    expected, atoms = [], set()
+    for ts in e.universe.trajectory:
+        waters = e.universe.select_atoms(
+            "resname WAT and around 8 group a", a=e.selections["a"]
+        )
+        expected.append(
+            float(
+                np.linalg.norm(
+                    e.selections["a"].center_of_geometry() - waters.center_of_geometry()
+                )
+            )
+        )
+        atoms.add(tuple(waters.indices))
+
+    assert len(atoms) > 1
+    assert_close(e.measures["distance"].result, expected)
+
+
+def test_run_only_and_exclude(build, reference):
+    e = build()
+    e.run(run_only=["angle", "hbonds"])
+
+    assert [name for name, Measure in e.measures.items() if Measure.frames] == [
+        "angle",
+        "hbonds",
+    ]
+    assert_close(results(e)["hbonds"], reference["hbonds"])
+
+    e = build()
+    e.run(exclude=["angle", "hbonds"], block_size=3)
+
+    assert [name for name, Measure in e.measures.items() if not Measure.frames] == [
+        "angle",
+        "hbonds",
+    ]
+    assert_close(results(e)["dihedral"], reference["dihedral"])
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_incremental_extends_loaded_trajectory(system, build, reference, n_workers):
+    _, trajectories = system
+
+    e = build("first_half")
+    e.run(n_workers=n_workers)
+    e.load_trajectory([trajectories["first_half"], trajectories["second_half"]])
+    e.run(incremental=True, n_workers=n_workers)
+
+    assert_same_results(results(e), reference)
+
+    # nothing is left to compute
+    e.run(incremental=True, n_workers=n_workers)
+    assert_same_results(results(e), reference)
+
+
+def test_incremental_new_measure_and_earlier_frames(build, reference):
+    e = build(measures=False)
+    e.select("a", [1, 2, 3], sel_type="res_num")
+    e.select("b", [7, 8], sel_type="res_num")
+    e.add_distance("distance_min", "a", "b")
+    e.run(start=11)
+
+    e.add_contacts("contacts_protein", "protein", sel_env=4)
+    e.run(incremental=True, block_size=3)
+
+    for name in ("distance_min", "contacts_protein"):
+        assert_close(results(e)[name], reference[name], name)
+
+
+@pytest.mark.parametrize("format", ["emda", "pickle"])
+def test_incremental_after_reading_results(build, reference, tmp_path, format):
+    names = ("distance_min", "contacts_protein")
+    e = build()
+    e.run(end=15, run_only=list(names))
+    for name in names:
+        e.save_result(name, str(tmp_path / f"{name}.{format}"), format=format)
+
+    e = build()
+    for name in names:
+        e.read_result(str(tmp_path / f"{name}_measure.{format}"), name, type="m")
+    e.run(incremental=True, run_only=list(names))
+
+    for name in names:
+        assert_close(results(e)[name], reference[name], name)
+
+
+def test_incremental_refuses_unknown_frames(build, tmp_path):
+    # pickle files of previous versions only contain the result
+    e = build()
+    e.run(end=15, run_only=["distance_min"])
+    with open(tmp_path / "old_measure.pickle", "wb") as handle:
+        pickle.dump(e.measures["distance_min"].result, handle, protocol=2)
+
+    e = build()
+    e.read_result(str(tmp_path / "old_measure.pickle"), "distance_min", type="m")
+    with pytest.raises(NotKnownFramesError):
+        e.run(incremental=True, run_only=["distance_min"])
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_checkpoint_resume(build, reference, tmp_path, monkeypatch, n_workers):
+    checkpoint = str(tmp_path / "run.checkpoint")
+    write_checkpoint = EMDA.runners.write_checkpoint
+    calls = []
+
+    # the run crashes after flushing the sinks of the third flush, before writing its checkpoint
+    def crash(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 3:
+            raise Interrupted
+        return write_checkpoint(*args, **kwargs)
+
+    def build_with_sinks():
+        e = build()
+        e.set_sink("distance_min", ChunkedFileSink(str(tmp_path / "distance.emda")))
+        e.set_sink("contacts_protein", ChunkedFileSink(str(tmp_path / "contacts.emda")))
+        return e
+
+    monkeypatch.setattr(EMDA.runners, "write_checkpoint", crash)
+    e = build_with_sinks()
+    with pytest.raises(Interrupted):
+        e.run(checkpoint=checkpoint, flush_every=4, n_workers=n_workers, block_size=3)
+    monkeypatch.undo()
+
+    e = build_with_sinks()
+    e.run(resume=checkpoint, n_workers=n_workers, block_size=3)
+
+    resumed = results(e)
+    for name in ("distance_min", "contacts_protein"):
+        result, frames = e.measures[name].sink.read()
+        assert frames == list(range(N_FRAMES))
+        assert_close(as_plain(result), reference[name][0], name)
+        del resumed[name]
+
+    for name in resumed:
+        assert_close(resumed[name], reference[name], name)
+
+
+def test_checkpoint_appends_new_results(build, reference, tmp_path):
+    checkpoint = str(tmp_path / "run.checkpoint")
+    e = build()
+    e.run(checkpoint=checkpoint, flush_every=4, block_size=3)
+
+    records = []
+    with open(checkpoint, "rb") as handle:
+        while True:
+            try:
+                records.append(pickle.load(handle))
+            except EOFError:
+                break
+
+    # the first record holds the results of the first flush, and the next ones only those added since the previous
+    assert len(records) == -(-N_FRAMES // 4)
+    for record in records:
+        for offset, result, frames, _, _, aux in record["measures"].values():
+            assert len(result) == len(frames) <= 4
+            assert all(len(values) <= 4 for _, values in aux.values())
+
+    # a record left half-written by a crash is ignored
+    with open(checkpoint, "ab") as handle:
+        handle.write(pickle.dumps(records[-1])[:50])
+
+    resumed = build()
+    resumed.run(resume=checkpoint)
+    assert_same_results(results(resumed), reference)
+
+
+def test_resume_without_checkpoint(build):
+    with pytest.raises(NotCheckpointError):
+        build().run(resume=True)
+
+
+def test_group_reads_trajectory_once(build, reference, monkeypatch):
+    first, second = build(), build()
+    reads = []
+    reader = type(second.universe.trajectory)
+    read_next = reader._read_next_timestep
+
+    def count(self, ts=None):
+        if self is second.universe.trajectory:
+            reads.append(self)
+        return read_next(self, ts)
+
+    monkeypatch.setattr(reader, "_read_next_timestep", count)
+    EMDAGroup([first, second]).run(block_size=5)
+
+    assert len(reads) == 0
+    assert_same_results(results(first), reference)
+    assert_same_results(results(second), reference)
+
+
+def test_prefetched_trajectory_frames(build):
+    e = build(measures=False)
+    trajectory = e.universe.trajectory
+
+    for sliced in (trajectory[2:20:3], trajectory[[4, 1, 9]], trajectory[25:5:-6]):
+        expected = [(ts.frame, ts.positions.copy()) for ts in sliced]
+        prefetched = [
+            (ts.frame, ts.positions.copy()) for ts in PrefetchedTrajectory(sliced, 2)
+        ]
+
+        assert [frame for frame, _ in prefetched] == [frame for frame, _ in expected]
+        for (_, a), (_, b) in zip(prefetched, expected):
+            assert (a == b).all()
+
+    assert trajectory.ts.frame == 0
+
+
+def test_prefetch_stops_on_errors(build):
+    e = build(measures=False)
+    before = threading.active_count()
+
+    frames = iter(PrefetchedTrajectory(e.universe.trajectory, 2))
+    with pytest.raises(RuntimeError):
+        for ts in frames:
+            if ts.frame == 3:
+                raise RuntimeError
+    frames.close()
+
+    # the reading thread is stopped and the reader rewound
+    assert threading.active_count() == before
+    assert e.universe.trajectory.ts.frame == 0
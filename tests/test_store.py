@@ -0,0 +1,135 @@
+import pickle
+
+import pytest
+
+from EMDA import CallbackSink, ChunkedFileSink
+from EMDA.results import ContactsResult
+from EMDA.store import get_store_kind
+
+from conftest import N_FRAMES, as_plain, assert_close, results
+
+STORED = [
+    "distance_min",
+    "planar_angle",
+    "RMSD",
+    "contacts_selection",
+    "contacts_protein",
+    "bridges",
+    "hbonds",
+]
+
+
+@pytest.mark.parametrize("format", ["emda", "pickle"])
+@pytest.mark.parametrize("name", STORED + ["pairwise_RMSD"])
+def test_save_and_read_result(build, computed, reference, tmp_path, name, format):
+    computed.save_result(name, str(tmp_path / "result.emda"), format=format)
+
+    # results that can not be stored in columns are always pickled
+    if format == "emda" and get_store_kind(computed.measures[name]) is not None:
+        filename = tmp_path / "result_measure.emda"
+        assert filename.is_dir()
+    else:
+        filename = tmp_path / "result_measure.pickle"
+        assert filename.is_file()
+
+    e = build()
+    e.read_result(str(filename), name, type="m")
+
+    assert_close(as_plain(e.measures[name].result), reference[name][0], name)
+    assert e.measures[name].frames == list(range(N_FRAMES))
+
+
+@pytest.mark.parametrize("name", STORED)
+def test_read_result_window(build, computed, reference, tmp_path, name):
+    computed.save_result(name, str(tmp_path / "result.emda"))
+
+    e = build()
+    e.read_result(
+        str(tmp_path / "result_measure.emda"), name, type="m", start=5, end=12
+    )
+
+    assert e.measures[name].frames == list(range(5, 12))
+    assert_close(as_plain(e.measures[name].result), reference[name][0][5:12], name)
+
+
+@pytest.mark.parametrize("name", ["contacts_protein", "contacts_selection"])
+def test_read_old_contacts_pickle(build, computed, tmp_path, name):
+    # previous versions pickled contacts as a list of dictionaries
+    old_result = list(computed.measures[name].result)
+    with open(tmp_path / "old_measure.pickle", "wb") as handle:
+        pickle.dump(old_result, handle, protocol=2)
+
+    e = build()
+    e.read_result(str(tmp_path / "old_measure.pickle"), name, type="m")
+    assert e.measures[name].result == old_result
+    # the frames of the results are not known
+    assert e.measures[name].frames == []
+
+    e.analyse_contacts_frequency("old", name)
+    computed.analyse_contacts_frequency("new", name)
+    assert e.analyses["old"].result == computed.analyses["new"].result
+
+    mode = computed.measures[name].options["mode"]
+    labels = list(old_result[0]) if mode == "protein" else None
+    converted = ContactsResult(mode=mode, labels=labels)
+    converted.extend(old_result)
+    assert list(converted) == old_result
+
+
+def test_chunked_file_sink(build, reference, tmp_path):
+    e = build()
+    for name in STORED:
+        e.set_sink(name, ChunkedFileSink(str(tmp_path / f"{name}.emda")))
+    e.run(flush_every=4, block_size=3)
+
+    for name in STORED:
+        Measure = e.measures[name]
+        result, frames = Measure.sink.read()
+
+        assert frames == list(range(N_FRAMES)) == Measure.sink.frames
+        assert_close(as_plain(result), reference[name][0], name)
+        # flushed results are emptied from memory, but not the auxiliary outputs of the run
+        assert len(Measure.result) == 0 and len(Measure.frames) == 0
+        assert_close(as_plain(Measure.aux), reference[name][2], name)
+
+    # measures without a sink are kept in memory
+    assert_close(results(e)["angle"], reference["angle"])
+
+
+def test_chunked_file_sink_appends(build, reference, tmp_path):
+    store = str(tmp_path / "distance.emda")
+
+    e = build()
+    e.set_sink("distance_min", ChunkedFileSink(store))
+    e.run(end=15, run_only=["distance_min"], flush_every=4)
+
+    # a new session appends the remaining frames to the existing store
+    e = build()
+    e.set_sink("distance_min", ChunkedFileSink(store, overwrite=False))
+    assert e.measures["distance_min"].sink.frames == list(range(15))
+    e.run(start=16, run_only=["distance_min"], flush_every=4)
+
+    result, frames = ChunkedFileSink(store, overwrite=False).read()
+    assert frames == list(range(N_FRAMES))
+    assert_close(result, reference["distance_min"][0])
+
+
+def test_callback_sink(build, reference):
+    flushed = {}
+
+    def callback(name, result, frames):
+        assert 0 < len(frames) <= 4
+        flushed.setdefault(name, []).append((as_plain(result), list(frames)))
+
+    e = build()
+    for name in ("distance_min", "contacts_protein", "hbonds"):
+        e.set_sink(name, CallbackSink(callback))
+    e.run(flush_every=4, n_workers=2)
+
+    for name, chunks in flushed.items():
+        result = [value for chunk, _ in chunks for value in chunk]
+        frames = [frame for _, chunk in chunks for frame in chunk]
+
+        assert frames == list(range(N_FRAMES))
+        assert_close(result, reference[name][0], name)
+        assert len(e.measures[name].result) == 0